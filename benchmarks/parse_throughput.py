@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Parse throughput of deposit receipts and of SWORD statements (Atom feeds in which every entry is read as a receipt).
+
+Four figures are given:
+
+    receipts        -- `Deposit_Receipt(xml)`, including parsing the XML
+    lazy receipts   -- `Deposit_Receipt(xml, lazy=True)`, reading only its `edit` IRI
+    handle_metadata -- `Deposit_Receipt(dom=...)` on elements that are already parsed, which is only the walk over
+                       the children of each entry
+    statement       -- `Sword_Statement(xml)` for a feed of `--entries` entries
+
+Usage:
+
+    python benchmarks/parse_throughput.py [--entries 5000] [--repeat 3]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sword2.deposit_receipt import Deposit_Receipt
+from sword2.collection import Sword_Statement
+from sword2.compatible_libs import etree
+
+from optparse import OptionParser
+from time import time
+
+ENTRY = """<entry>
+    <title>Deposit %(n)s</title>
+    <id>info:deposit:%(n)s</id>
+    <updated>2011-06-07T07:40:53Z</updated>
+    <summary type="text">A summary of deposit %(n)s</summary>
+    <author><name>A. N. Author</name></author>
+    <generator uri="http://example.org/sword" version="2.0"/>
+    <dcterms:title>Title %(n)s</dcterms:title>
+    <dcterms:abstract>The abstract of deposit %(n)s</dcterms:abstract>
+    <dcterms:creator>A. N. Author</dcterms:creator>
+    <dcterms:creator>A. N. Other</dcterms:creator>
+    <dcterms:identifier>doi:10.1000/%(n)s</dcterms:identifier>
+    <category scheme="http://purl.org/net/sword/terms/" term="http://purl.org/net/sword/terms/originalDeposit"
+              label="Original Deposit"/>
+    <content type="application/zip" src="http://example.org/cont-iri/%(n)s"/>
+    <link rel="edit-media" href="http://example.org/em-iri/%(n)s"/>
+    <link rel="edit" href="http://example.org/edit-iri/%(n)s"/>
+    <link rel="http://purl.org/net/sword/terms/add" href="http://example.org/edit-iri/%(n)s"/>
+    <link rel="alternate" href="http://example.org/splash/%(n)s"/>
+    <link rel="http://purl.org/net/sword/terms/statement" type="application/atom+xml;type=feed"
+          href="http://example.org/state-iri/%(n)s.atom"/>
+    <sword:packaging>http://purl.org/net/sword/package/SimpleZip</sword:packaging>
+    <sword:packaging>http://purl.org/net/sword/package/Binary</sword:packaging>
+    <sword:treatment>Unpacked. Checked for viruses.</sword:treatment>
+    <sword:verboseDescription>Deposited through the benchmark</sword:verboseDescription>
+</entry>"""
+
+NAMESPACES = ('xmlns="http://www.w3.org/2005/Atom" xmlns:sword="http://purl.org/net/sword/terms/" '
+              'xmlns:dcterms="http://purl.org/dc/terms/"')
+
+def receipt(n):
+    return '<?xml version="1.0"?>\n' + (ENTRY % {'n':n}).replace("<entry>", "<entry %s>" % NAMESPACES, 1)
+
+def statement(entries):
+    return ('<?xml version="1.0"?>\n<feed %s>\n<title>Statement</title>\n%s\n</feed>' %
+            (NAMESPACES, "\n".join([ENTRY % {'n':n} for n in xrange(entries)])))
+
+def best_of(repeat, f):
+    times = []
+    for i in xrange(repeat):
+        start = time()
+        f()
+        times.append(time() - start)
+    return min(times)
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--entries", type="int", default=5000, help="receipts to parse, and entries in the statement")
+    parser.add_option("--repeat", type="int", default=3, help="take the best of this many runs")
+    options, args = parser.parse_args()
+    n = options.entries
+
+    documents = [receipt(i) for i in xrange(n)]
+    took = best_of(options.repeat, lambda: [Deposit_Receipt(doc) for doc in documents])
+    print "receipts:        %8.0f receipts/s  (%s in %.3fs)" % (n / took, n, took)
+
+    took = best_of(options.repeat, lambda: [Deposit_Receipt(doc, lazy=True).edit for doc in documents])
+    print "lazy receipts:   %8.0f receipts/s  (%s in %.3fs)" % (n / took, n, took)
+
+    doms = [etree.fromstring(doc) for doc in documents]
+    took = best_of(options.repeat, lambda: [Deposit_Receipt(dom=dom) for dom in doms])
+    print "handle_metadata: %8.0f receipts/s  (%s in %.3fs)" % (n / took, n, took)
+
+    feed = statement(n)
+    took = best_of(options.repeat, lambda: Sword_Statement(feed))
+    print "statement:       %8.0f entries/s   (%s entries in %.3fs)" % (n / took, n, took)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memory used per object by `Deposit_Receipt`, `Category` and `SDCollection`, against their compact (`__slots__`)
+variants, with and without the parsed DOM kept.
+
+Each variant is measured in a fresh process: the growth in its resident set size while it holds `--count` objects,
+divided by that count. The size of the instance itself (and of its `__dict__`, if it has one) is shown alongside.
+
+Usage:
+
+    python benchmarks/receipt_memory.py [--count 20000]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sword2.deposit_receipt import Deposit_Receipt, Compact_Deposit_Receipt
+from sword2.atom_objects import Category, Compact_Category
+from sword2.collection import SDCollection, Compact_SDCollection
+from sword2.compatible_libs import etree
+
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+import gc
+
+RECEIPT = """<?xml version="1.0"?>
+<entry xmlns="http://www.w3.org/2005/Atom" xmlns:sword="http://purl.org/net/sword/terms/"
+       xmlns:dcterms="http://purl.org/dc/terms/">
+    <title>Deposit %(n)s</title>
+    <id>info:deposit:%(n)s</id>
+    <updated>2011-06-07T07:40:53Z</updated>
+    <summary type="text">A summary of deposit %(n)s</summary>
+    <generator uri="http://example.org/sword" version="2.0"/>
+    <dcterms:title>Title %(n)s</dcterms:title>
+    <dcterms:abstract>The abstract of deposit %(n)s</dcterms:abstract>
+    <dcterms:creator>A. N. Author</dcterms:creator>
+    <category scheme="http://purl.org/net/sword/terms/" term="http://purl.org/net/sword/terms/originalDeposit"
+              label="Original Deposit"/>
+    <content type="application/zip" src="http://example.org/cont-iri/%(n)s"/>
+    <link rel="edit-media" href="http://example.org/em-iri/%(n)s"/>
+    <link rel="edit" href="http://example.org/edit-iri/%(n)s"/>
+    <link rel="http://purl.org/net/sword/terms/add" href="http://example.org/edit-iri/%(n)s"/>
+    <link rel="http://purl.org/net/sword/terms/statement" type="application/atom+xml;type=feed"
+          href="http://example.org/state-iri/%(n)s.atom"/>
+    <sword:packaging>http://purl.org/net/sword/package/SimpleZip</sword:packaging>
+    <sword:treatment>Unpacked. <b>Checked</b> for viruses.</sword:treatment>
+</entry>"""
+
+COLLECTION = """<collection xmlns="http://www.w3.org/2007/app" xmlns:atom="http://www.w3.org/2005/Atom"
+       xmlns:sword="http://purl.org/net/sword/terms/" xmlns:dcterms="http://purl.org/dc/terms/"
+       href="http://example.org/col-iri/%(n)s">
+    <atom:title>Collection %(n)s</atom:title>
+    <accept>*/*</accept>
+    <accept alternate="multipart-related">*/*</accept>
+    <sword:collectionPolicy>Collection policy</sword:collectionPolicy>
+    <dcterms:abstract>Collection description</dcterms:abstract>
+    <sword:mediation>true</sword:mediation>
+    <sword:treatment>Treatment description</sword:treatment>
+    <sword:acceptPackaging>http://purl.org/net/sword/package/SimpleZip</sword:acceptPackaging>
+    <atom:category scheme="http://example.org/scheme" term="theses" label="Theses"/>
+</collection>"""
+
+CATEGORY = """<category xmlns="http://www.w3.org/2005/Atom" scheme="http://example.org/scheme" term="term-%(n)s"
+                        label="Label %(n)s"/>"""
+
+def rss():
+    """Resident set size of this process, in bytes."""
+    f = open("/proc/self/statm")
+    try:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    finally:
+        f.close()
+
+def instance_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def make(kind, keep_dom, n):
+    if kind in (Deposit_Receipt, Compact_Deposit_Receipt):
+        return kind(RECEIPT % {'n':n}, keep_dom=keep_dom)
+    if kind in (SDCollection, Compact_SDCollection):
+        return kind(dom=etree.fromstring(COLLECTION % {'n':n}), keep_dom=keep_dom)
+    return kind(dom=etree.fromstring(CATEGORY % {'n':n}), keep_dom=keep_dom)
+
+def measure(kind, keep_dom, count, results):
+    make(kind, keep_dom, -1)     # warm up any caches
+    gc.collect()
+    before = rss()
+    held = [make(kind, keep_dom, n) for n in xrange(count)]
+    gc.collect()
+    results.put(((rss() - before) / float(count), instance_size(held[0])))
+
+VARIANTS = [(Deposit_Receipt, True), (Deposit_Receipt, False), (Compact_Deposit_Receipt, True),
+            (Compact_Deposit_Receipt, False),
+            (SDCollection, True), (Compact_SDCollection, False),
+            (Category, True), (Compact_Category, False)]
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--count", type="int", default=20000, help="objects to hold for each variant")
+    options, args = parser.parse_args()
+
+    print "%-26s %-9s %14s %14s" % ("class", "keep_dom", "bytes/object", "instance")
+    for kind, keep_dom in VARIANTS:
+        results = Queue()
+        p = Process(target=measure, args=(kind, keep_dom, options.count, results))
+        p.start()
+        per_object, size = results.get()
+        p.join()
+        print "%-26s %-9s %14.0f %14d" % (kind.__name__, keep_dom, per_object, size)
+
+if __name__ == "__main__":
+    main()
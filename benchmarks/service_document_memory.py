@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Peak memory and time taken to load a service document with very many collections and walk all of its workspaces,
+parsed as a whole (`ServiceDocument(xml)`), streamed (`ServiceDocument(file, streaming=True)`), and streamed without
+keeping the collections (`ServiceDocument(file, streaming=True, retain_collections=False)`, gone through with
+`iter_collections`).
+
+Each is run in a fresh process, reading the document from a temporary file; the growth in the peak resident set size
+of the process is shown.
+
+Usage:
+
+    python benchmarks/service_document_memory.py [--collections 20000] [--workspaces 4]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sword2.service_document import ServiceDocument
+
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+from tempfile import NamedTemporaryFile
+from time import time
+import resource
+
+COLLECTION = """        <collection href="http://example.org/col-iri/%(n)s">
+            <atom:title>Collection %(n)s</atom:title>
+            <accept>*/*</accept>
+            <accept alternate="multipart-related">*/*</accept>
+            <sword:collectionPolicy>Collection policy</sword:collectionPolicy>
+            <dcterms:abstract>Collection description</dcterms:abstract>
+            <sword:mediation>true</sword:mediation>
+            <sword:treatment>Treatment description</sword:treatment>
+            <sword:acceptPackaging>http://purl.org/net/sword/package/SimpleZip</sword:acceptPackaging>
+            <sword:acceptPackaging>http://purl.org/net/sword/package/Binary</sword:acceptPackaging>
+            <atom:category scheme="http://example.org/scheme" term="theses" label="Theses"/>
+        </collection>
+"""
+
+def write_document(f, collections, workspaces):
+    f.write('<?xml version="1.0" ?>\n<service xmlns:dcterms="http://purl.org/dc/terms/" '
+            'xmlns:sword="http://purl.org/net/sword/terms/" xmlns:atom="http://www.w3.org/2005/Atom" '
+            'xmlns="http://www.w3.org/2007/app">\n'
+            '    <sword:version>2.0</sword:version>\n    <sword:maxUploadSize>16777216</sword:maxUploadSize>\n')
+    per_workspace = collections // workspaces
+    for w in xrange(workspaces):
+        f.write('    <workspace>\n        <atom:title>Workspace %s</atom:title>\n' % w)
+        for n in xrange(w * per_workspace, (w + 1) * per_workspace):
+            f.write(COLLECTION % {'n':n})
+        f.write('    </workspace>\n')
+    f.write('</service>\n')
+    f.flush()
+
+def peak_rss():
+    """Peak resident set size of this process, in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+MODES = ("whole", "streamed", "not kept")
+
+def measure(path, mode, results):
+    before = peak_rss()
+    start = time()
+    if mode == "whole":
+        s = ServiceDocument(open(path, "rb").read())
+    else:
+        s = ServiceDocument(open(path, "rb"), streaming=True, retain_collections=(mode == "streamed"))
+    count = 0
+    for workspace, c in s.iter_collections():
+        count += 1
+    results.put((count, time() - start, peak_rss() - before))
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--collections", type="int", default=20000, help="collections in the service document")
+    parser.add_option("--workspaces", type="int", default=4, help="workspaces they are shared between")
+    options, args = parser.parse_args()
+
+    f = NamedTemporaryFile(suffix=".xml")
+    write_document(f, options.collections, options.workspaces)
+    print "%s bytes of service document" % os.path.getsize(f.name)
+    print "%-10s %12s %10s %16s" % ("parsed", "collections", "seconds", "peak RSS growth")
+    for mode in MODES:
+        results = Queue()
+        p = Process(target=measure, args=(f.name, mode, results))
+        p.start()
+        count, took, growth = results.get()
+        p.join()
+        print "%-10s %12d %10.2f %14.1fMB" % (mode, count, took, growth / 1048576.0)
+    f.close()
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,14 @@ from service_document import ServiceDocument
 from collection import SDCollection, Collection_Feed, Sword_Statement
 from error_document import Error_Document
 from connection import Connection
+from request_engine import Request_Engine
+from segmented import Segmented_Deposit
 from transaction_history import Transaction_History
 from exceptions import *
 from server_errors import SWORD2ERRORSBYIRI, SWORD2ERRORSBYNAME
-from utils import Timer, NS, get_md5, create_multipart_related
+from utils import Timer, NS, get_md5, get_digests, create_multipart_related
+from multipart import Multipart_Related
+from packaging import Zip_Stream
 from implementation_info import *
 from atom_objects import Entry, Category
 
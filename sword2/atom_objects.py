@@ -18,47 +18,30 @@ from utils import NS, get_text
 
 from datetime import datetime
 
-class Category(object):
-    """Convenience class to aid in the intepreting of atom:category elements in XML. Currently, this is read-only.
-    
-    Usage:
-    
-    >>> from sword2 import Category
-    
-    ... # `Category` expects an etree.SubElement node (`c_node` in this example) referencing an <atom:category> element:
-    <atom:category term="...." scheme="...." label="....."> .... </atom:category>
-    
-    # Load a `Category` instance:
-    >>> c = Category(dom = c_node)
-    
-    # Overrides `__str__` to provide a simple means to view the content
-    >>> print c
-    "Category scheme:http://purl.org/net/sword/terms/ term:http://purl.org/net/sword/terms/originalDeposit label:Orignal Deposit text:'None'"
-    
-    # Element attributes appear as object attibutes:
-    >>> c.scheme
-    'http://purl.org/net/sword/terms/'
-    
-    # Element text will be in the text attribute, if text is present
-    >>> c.text
-    None
-    
-    """
+class Category_Mixin(object):
+    """The behaviour shared by `Category` and `Compact_Category`."""
+    __slots__ = ()
+
     def __init__(self, term=None,
                        scheme=None,
                        label=None,
                        text=None,
-                       dom=None):
+                       dom=None,
+                       keep_dom=True):
         """Init a `Category` class - 99% of the time, this will be done by setting the dom parameter.
         
-        However, if (for testing) there is a need to 'fake' a `Category`, all the attributes can be set in the constructor."""
+        However, if (for testing) there is a need to 'fake' a `Category`, all the attributes can be set in the constructor.
+        
+        If `keep_dom` is `False`, the element is not kept as `self.dom` once the attributes have been read from it."""
         self.term = term
         self.scheme = scheme
         self.label = label
         self.text = text
         if dom != None:
             self.dom = dom
-            self._from_element(self.dom)
+            self._from_element(dom)
+            if not keep_dom:
+                self.dom = None
     
     def _from_element(self, e):
         """ Load the `Category`'s internal attributes using the information within an `etree.SubElement`
@@ -81,6 +64,37 @@ class Category(object):
                                                                   self.label,
                                                                   self.text)
 
+class Category(Category_Mixin):
+    """Convenience class to aid in the intepreting of atom:category elements in XML. Currently, this is read-only.
+    
+    Usage:
+    
+    >>> from sword2 import Category
+    
+    ... # `Category` expects an etree.SubElement node (`c_node` in this example) referencing an <atom:category> element:
+    <atom:category term="...." scheme="...." label="....."> .... </atom:category>
+    
+    # Load a `Category` instance:
+    >>> c = Category(dom = c_node)
+    
+    # Overrides `__str__` to provide a simple means to view the content
+    >>> print c
+    "Category scheme:http://purl.org/net/sword/terms/ term:http://purl.org/net/sword/terms/originalDeposit label:Orignal Deposit text:'None'"
+    
+    # Element attributes appear as object attibutes:
+    >>> c.scheme
+    'http://purl.org/net/sword/terms/'
+    
+    # Element text will be in the text attribute, if text is present
+    >>> c.text
+    None
+    
+    """
+
+class Compact_Category(Category_Mixin):
+    """A `Category` that keeps its attributes in `__slots__` rather than an instance `__dict__`, for when very many
+    of them are held (eg in cached deposit receipts). No other attributes can be set on it."""
+    __slots__ = ('term', 'scheme', 'label', 'text', 'dom')
 
 class Entry(object):
     """Used to create `Entry`s - for multipart/metadata submission. Has a simple and extendable way to add in
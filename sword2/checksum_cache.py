@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Provides `Checksum_Cache`, which remembers the checksums (MD5, and any others asked for) of files so that unchanged
+files are not read again.
+
+Each checksum is stored against the real path of the file, together with the device, inode, size and modification
+time it had when it was hashed. As long as those still match, the stored checksum is used and the file itself is
+not read at all. The cache can be kept on disc (with `shelve`) so that it lasts between runs - eg for repeated
+re-deposits of the same large files.
+
+Usage:
+
+>>> from sword2 import Connection
+>>> from sword2.checksum_cache import Checksum_Cache
+>>> cache = Checksum_Cache("/var/cache/sword2/checksums")
+>>> cache.get_md5(open("package.zip", "rb"))          # reads the file
+('ab6f36c0a8a5a79d2e2b7d4dbf7b3a0c', 1048576)
+>>> cache.get_md5(open("package.zip", "rb"))          # does not
+('ab6f36c0a8a5a79d2e2b7d4dbf7b3a0c', 1048576)
+
+# Or let a `Connection` use it for the Content-MD5 of every file it deposits:
+>>> conn = Connection("http://example.org/sd-uri", checksum_cache="/var/cache/sword2/checksums")
+
+Whole sets of files can be hashed on every core at once with `hash_files`, which uses a `multiprocessing.Pool`:
+
+>>> from sword2.checksum_cache import hash_files
+>>> sums = hash_files(["a.pdf", "b.pdf", "c.tiff"], cache=cache)
+>>> sums["a.pdf"]
+({'md5': '0b0c1c8a7f9e6fa0a93e6f2bdb6f2a52'}, 52311)
+
+`imap_hash_files` gives the results as each file is done, so that they can be used while the rest are hashed (as
+`Connection.add_files_to_resource` does.)
+"""
+
+from sword2_logging import logging
+cc_l = logging.getLogger(__name__)
+
+from utils import get_digests
+
+from threading import Lock
+from multiprocessing import Pool
+import shelve
+import os
+
+def file_path(data):
+    """The real path of the file behind a file object, or `None` if it is not a regular file on disc."""
+    name = getattr(data, 'name', None)
+    if not isinstance(name, basestring) or not os.path.isfile(name):
+        return None
+    return os.path.realpath(name)
+
+def file_signature(st):
+    """The parts of an `os.stat` result that show whether a file has changed: (device, inode, size, mtime)."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+class Checksum_Cache(object):
+    """A cache of the checksums of files, keyed by their real path and checked against their inode, size and
+    modification time.
+
+    path    -- file to keep the cache in, between runs. If `None`, the cache is only held in memory.
+
+    `hits` and `misses` count the lookups that could and could not be answered from the cache."""
+    def __init__(self, path=None):
+        self.path = path
+        if path is None:
+            self.db = {}
+        else:
+            self.db = shelve.open(path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def _key(self, path):
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return path
+
+    def get(self, path, st=None, algorithms=('md5',)):
+        """The ({algorithm: hexdigest}, size) stored for the file at `path`, or `None` if there is none, the file has
+        changed, or not all of the `algorithms` were stored for it."""
+        if st is None:
+            st = os.stat(path)
+        key = self._key(os.path.realpath(path))
+        self._lock.acquire()
+        try:
+            entry = self.db.get(key)
+            if entry is not None and entry[0] == file_signature(st):
+                digests = entry[1]
+                if not [name for name in algorithms if name not in digests]:
+                    self.hits += 1
+                    return dict([(name, digests[name]) for name in algorithms]), entry[2]
+            self.misses += 1
+            return None
+        finally:
+            self._lock.release()
+
+    def put(self, path, digests, size, st=None):
+        """Store the ({algorithm: hexdigest}, size) of the file at `path`, adding to any digests already stored for
+        the same version of the file."""
+        if st is None:
+            st = os.stat(path)
+        key = self._key(os.path.realpath(path))
+        signature = file_signature(st)
+        self._lock.acquire()
+        try:
+            entry = self.db.get(key)
+            if entry is not None and entry[0] == signature:
+                stored = dict(entry[1])
+                stored.update(digests)
+                digests = stored
+            self.db[key] = (signature, dict(digests), size)
+        finally:
+            self._lock.release()
+
+    def get_digests(self, data, algorithms=('md5',)):
+        """A drop-in replacement for `sword2.utils.get_digests`: returns ({algorithm: hexdigest}, size) for a `str` or
+        a file-like object. Files on disc that have not changed since they were last hashed are not read."""
+        path = file_path(data)
+        if path is None:
+            return get_digests(data, algorithms)
+        st = os.stat(path)
+        cached = self.get(path, st, algorithms)
+        if cached is not None:
+            cc_l.debug("Using the cached checksums of %s" % path)
+            return cached
+        digests, size = get_digests(data, algorithms)
+        if os.stat(path).st_mtime == st.st_mtime:
+            # Only keep them if the file did not change while it was being read
+            self.put(path, digests, size, st)
+        return digests, size
+
+    def get_md5(self, data):
+        """A drop-in replacement for `sword2.utils.get_md5`: returns (md5sum, size) for a `str` or a file-like object."""
+        digests, size = self.get_digests(data)
+        return digests['md5'], size
+
+    def __len__(self):
+        return len(self.db)
+
+    def sync(self):
+        """Write any cached checksums out to disc."""
+        if self.path is not None:
+            self._lock.acquire()
+            try:
+                self.db.sync()
+            finally:
+                self._lock.release()
+
+    def close(self):
+        if self.path is not None:
+            self._lock.acquire()
+            try:
+                self.db.close()
+            finally:
+                self._lock.release()
+
+def _hash_file(args):
+    """Pool worker: hash the file at `path`, returning (path, digests, size, stat) - or (path, None, None, None) if
+    the file changed while it was being read."""
+    path, algorithms = args
+    st = os.stat(path)
+    f = open(path, 'rb')
+    try:
+        digests, size = get_digests(f, algorithms)
+    finally:
+        f.close()
+    if os.stat(path).st_mtime != st.st_mtime:
+        return path, None, None, None
+    return path, digests, size, st
+
+def imap_hash_files(paths, algorithms=('md5',), processes=None, cache=None):
+    """Hash the files at `paths` in a pool of `processes` worker processes (by default, one per core).
+
+    Yields (path, ({algorithm: hexdigest}, size)) for each file as soon as it is done, in whatever order they finish.
+    Files already in the `Checksum_Cache` `cache` are not hashed again, and the rest are added to it."""
+    todo = []
+    for path in paths:
+        if cache is not None:
+            cached = cache.get(path, algorithms=algorithms)
+            if cached is not None:
+                yield path, cached
+                continue
+        todo.append(path)
+    if not todo:
+        return
+    pool = Pool(processes)
+    try:
+        for path, digests, size, st in pool.imap_unordered(_hash_file, [(path, algorithms) for path in todo]):
+            if digests is None:
+                # Changed while it was being hashed - do it again here
+                f = open(path, 'rb')
+                try:
+                    digests, size = get_digests(f, algorithms)
+                finally:
+                    f.close()
+            elif cache is not None:
+                cache.put(path, digests, size, st)
+            yield path, (digests, size)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def hash_files(paths, algorithms=('md5',), processes=None, cache=None):
+    """Hash the files at `paths` in a pool of worker processes, as `imap_hash_files` does.
+
+    Returns a `dict` - Key = path, Value = ({algorithm: hexdigest}, size)"""
+    return dict(imap_hash_files(paths, algorithms, processes, cache))
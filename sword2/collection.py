@@ -9,8 +9,8 @@ to make them suitable for use.
 The key class is `Collection`, which is presents a simple read-only object which represents the
 information held within a collection element in a SWORD2 document such as the Service Document.
 
-Two other classes, `Collection_Feed` and `Sword_Statement` are works in progress for now, with limited support
-for the things they logically handle.
+`Collection_Feed` lists the contents of a collection, from the (possibly paged) Atom feed at its Col-IRI, and
+`Sword_Statement` is a work in progress for now, with limited support for the things it logically handles.
 
 """
 
@@ -18,36 +18,27 @@ from sword2_logging import logging
 from implementation_info import __version__
 coll_l = logging.getLogger(__name__)
 
-from compatible_libs import etree
-from utils import NS, get_text
+from compatible_libs import etree, OrderedDict
+from utils import NS, get_text, curl_request
 
 from deposit_receipt import Deposit_Receipt
 
-from atom_objects import Category
+from atom_objects import Category, Compact_Category
 
 from datetime import datetime
+from urlparse import urljoin
 
+# How many pages of a collection feed to keep for revalidation by default
+DEFAULT_MAX_CACHED_PAGES = 64
+
+
+class SDCollection_Mixin(object):
+    """The behaviour shared by `SDCollection` and `Compact_SDCollection`."""
+    __slots__ = ()
+
+    # Class used for the atom:category elements of the collection
+    category_class = Category
 
-class SDCollection(object):
-    """
-    `Collection` - holds, parses and presents simple attributes with information taken from a collection entry
-    within a SWORD2 Service Document.
-    
-    This will be instanciated by a `sword2.Service_Document` and as such, is unlikely to be called explicitly.
-    
-    Usage:
-        
-    >>> from sword2 import SDCollection
-    >>> c = SDCollection()
-    
-    .... pull an `etree.SubElement` from a service document into `collection_node`
-    
-    >>> c.load_from_etree(collection_node)
-    >>> c.collectionPolicy
-    "This collection has the following policy for deposits"
-    >>> c.title
-    "Thesis Deposit"
-    """
     def __init__(self, title=None, 
                        href=None,
                        accept=[], 
@@ -59,7 +50,8 @@ class SDCollection(object):
                        treatment=None,
                        acceptPackaging=[],
                        service=[],
-                       dom=None):
+                       dom=None,
+                       keep_dom=True):
         """
         Creates a `Collection` object - as used by `sword2.Service_Document`
         
@@ -128,6 +120,7 @@ class SDCollection(object):
             >>> c.accept
             ["*/*"]
         
+        If `keep_dom` is `False`, the collection element is not kept as `self.dom` once it has been parsed.
         """
         # APP/Atom
         self.title = title
@@ -145,7 +138,7 @@ class SDCollection(object):
         if dom != None:
             # Allow constructor variables to provide defaults, but information within the
             # XML element overwrites or appends.
-            self.load_from_etree(dom)
+            self.load_from_etree(dom, keep_dom)
     
     def _reset(self):
         """Blank this instance of `SDCollection`"""
@@ -162,15 +155,17 @@ class SDCollection(object):
         self.service = None
         self.categories = []
     
-    def load_from_etree(self, collection):
+    def load_from_etree(self, collection, keep_dom=True):
         """
         Parse an `etree.SubElement` into attributes in this object.
         
         Also, caches the most recently used DOM object it is passed in
-        `self.dom`
+        `self.dom` (unless `keep_dom` is `False`)
         """
         self._reset()
-        self.dom = collection
+        self.dom = None
+        if keep_dom:
+            self.dom = collection
         self.title = get_text(collection, NS['atom'] % 'title')
         # MUST have href attribute
         self.href = collection.attrib.get('href', None)
@@ -182,7 +177,7 @@ class SDCollection(object):
                 self.accept.append(accept.text)
         # Categories
         for category_element in collection.findall(NS['atom'] % 'category'):
-            self.categories.append(Category(dom=category_element))
+            self.categories.append(self.category_class(dom=category_element, keep_dom=keep_dom))
         # SWORD extensions:
         self.collectionPolicy = get_text(collection, NS['sword'] % 'collectionPolicy')
                 
@@ -244,13 +239,140 @@ class SDCollection(object):
             coll_l.error("Could not return information about Collection '%s' as JSON" % self.title)
             return
 
+class SDCollection(SDCollection_Mixin):
+    """
+    `Collection` - holds, parses and presents simple attributes with information taken from a collection entry
+    within a SWORD2 Service Document.
+    
+    This will be instanciated by a `sword2.Service_Document` and as such, is unlikely to be called explicitly.
+    
+    Usage:
+        
+    >>> from sword2 import SDCollection
+    >>> c = SDCollection()
+    
+    .... pull an `etree.SubElement` from a service document into `collection_node`
+    
+    >>> c.load_from_etree(collection_node)
+    >>> c.collectionPolicy
+    "This collection has the following policy for deposits"
+    >>> c.title
+    "Thesis Deposit"
+    """
+
+class Compact_SDCollection(SDCollection_Mixin):
+    """An `SDCollection` that keeps its attributes in `__slots__` rather than an instance `__dict__`, and its
+    categories as `Compact_Category`s. It has the same attributes as an `SDCollection`, but no others can be set on
+    it."""
+    __slots__ = ('title', 'href', 'accept', 'accept_multipart', 'mediation', 'description', 'treatment',
+                 'collectionPolicy', 'acceptPackaging', 'service', 'categories', 'dom')
+    category_class = Compact_Category
+
 class Collection_Feed(object):
-    """Nothing to see here yet. Move along."""
-    def __init__(self, feed_iri=None, http_client=None, feed_xml=None):
+    """The contents of a collection, as listed by the Atom feed at its Col-IRI.
+
+    feed_iri            -- the IRI of the feed (the Col-IRI)
+    http_client         -- an `httplib2.Http` holding any credentials for the server (eg `sword2.Connection.h`)
+    feed_xml            -- the first page of the feed, if it has already been fetched
+    curl_pool           -- an optional `sword2.curl_pool.Curl_Pool` to make the requests with
+    headers             -- additional headers to send with every request (eg On-Behalf-Of)
+    max_cached_pages    -- how many pages to keep for revalidation (the least recently used are dropped first)
+
+    Usage:
+
+    >>> feed = Collection_Feed("http://swordapp.org/col-iri/43", http_client=conn.h)
+    >>> for entry in feed:
+    ...     print entry.edit, entry.title
+
+    Iterating over the feed reads it page by page, following the rel="next" link of each page, and makes each
+    atom:entry into a `sword2.Deposit_Receipt` only as it is reached - so no more than one page is held as a DOM at a
+    time, however large the collection. (`self.entries()` does the same, for any receipt class and options.)
+
+    The XML of each page is kept, along with its ETag and Last-Modified headers, in a page cache. Reading the feed
+    again sends these as If-None-Match/If-Modified-Since, and a page that the server says is Not Modified (304) is
+    read from the cache rather than sent again. `self.fetched` and `self.revalidated` count the pages sent in full and
+    the pages found to be unchanged.
+    """
+    def __init__(self, feed_iri=None, http_client=None, feed_xml=None, curl_pool=None, headers=None,
+                 max_cached_pages=DEFAULT_MAX_CACHED_PAGES):
         self.feed_xml = feed_xml
         self.feed_iri = feed_iri
-        self._cached = []
+        self._cached = OrderedDict()    # Key = page IRI, Value = (ETag, Last-Modified, XML) - least recently used first
         self.h = http_client
+        self.curl_pool = curl_pool
+        self.headers = headers or {}
+        self.max_cached_pages = max_cached_pages
+        self.fetched = 0
+        self.revalidated = 0
+
+    def _get_page(self, page_iri):
+        """The XML of the page at `page_iri`, revalidating any cached copy of it. `None` if it could not be got."""
+        headers = {'Accept':'application/atom+xml;type=feed'}
+        headers.update(self.headers)
+        cached = self._cached.pop(page_iri, None)
+        if cached is not None:
+            etag, last_modified, xml = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        coll_l.info("Getting the collection feed page %s" % page_iri)
+        resp, content = curl_request(self.h, page_iri, "GET", headers=headers, curl_pool=self.curl_pool)
+        if resp.status == 304 and cached is not None:
+            coll_l.debug("Collection feed page %s is unchanged - using the cached copy" % page_iri)
+            self.revalidated += 1
+            self._cache(page_iri, cached)
+            return cached[2]
+        if resp.status != 200:
+            coll_l.error("Could not GET the collection feed page %s - response code %s" % (page_iri, resp.status))
+            return None
+        self.fetched += 1
+        if resp.get('etag') or resp.get('last-modified'):
+            self._cache(page_iri, (resp.get('etag'), resp.get('last-modified'), content))
+        return content
+
+    def _cache(self, page_iri, page):
+        self._cached[page_iri] = page
+        while self.max_cached_pages is not None and len(self._cached) > self.max_cached_pages:
+            self._cached.popitem(last=False)
+
+    def pages(self):
+        """A generator of the pages of the feed, each parsed as a `Sword_Statement` (an Atom feed whose entries are read
+        as deposit receipts) with its entries left to be made by its `iter_entries()`, and its IRI in `page.iri`."""
+        page_iri = self.feed_iri
+        xml = self.feed_xml
+        if xml is None:
+            xml = self._get_page(page_iri)
+        seen = set([page_iri])
+        while xml is not None:
+            page = Sword_Statement(xml, build_entries=False)
+            if not page.parsed:
+                return
+            page.iri = page_iri
+            yield page
+            if not page.next:
+                return
+            page_iri = urljoin(page_iri or "", page.next)
+            if page_iri in seen:
+                coll_l.error("The collection feed page %s links back to %s - stopping" % (page.iri, page_iri))
+                return
+            seen.add(page_iri)
+            del page    # (so that the last page can be freed while the next is fetched)
+            xml = self._get_page(page_iri)
+
+    def entries(self, receipt_class=Deposit_Receipt, **kw):
+        """A generator of every entry in the feed, over all its pages, each made into a `receipt_class` (given `**kw`
+        as well, eg `lazy=True`) as it is reached."""
+        for page in self.pages():
+            for entry in page.iter_entries(receipt_class, **kw):
+                yield entry
+
+    def __iter__(self):
+        return self.entries()
+
+    def clear_cache(self):
+        """Forget all the cached pages."""
+        self._cached.clear()
         
 class Sword_Statement(object):
     """Beginning SWORD2 Sword Statement support.
@@ -262,8 +384,18 @@ class Sword_Statement(object):
     
     NB if `self.parsed` is not `True`, then there has been a problem parsing the xml document so check the original text,
     cached in `self.xml_document`
+
+    A long statement may be split into pages (as for any Atom feed - RFC 5005). The IRIs of the other pages, from the
+    feed's <link rel="first|next|previous|last"> elements, are kept in `self.first`, `self.next`, `self.previous` and
+    `self.last`; `sword2.Connection.iter_statement_entries` follows them.
+
+    Each atom:entry is read as a `sword2.Deposit_Receipt`, in `self.entries`. With `build_entries` set to `False`,
+    `self.entries` is left empty and the entries are only made as `self.iter_entries()` goes through them.
     """
-    def __init__(self, xml_document):
+    # atom:link rel values of the pagination links, and the attributes they are kept in
+    PAGE_LINKS = {'first':'first', 'next':'next', 'previous':'previous', 'prev':'previous', 'last':'last'}
+
+    def __init__(self, xml_document, build_entries=True):
         self.xml_document = xml_document
         self.parsed = False
         self.first = None
@@ -272,6 +404,7 @@ class Sword_Statement(object):
         self.last = None
         self.categories = []
         self.entries = []
+        self.build_entries = build_entries
         try:
             coll_l.info("Attempting to parse the Feed XML document")
             self.feed = etree.fromstring(xml_document)
@@ -279,15 +412,26 @@ class Sword_Statement(object):
         except Exception, e:
             coll_l.error("Failed to parse document - %s" % e)
             coll_l.error("XML document begins:\n %s" % xml_document[:300])
+            return
         self.enumerate_feed()
 
     def enumerate_feed(self):
         # Handle Categories
         for cate in self.feed.findall(NS['atom'] % 'category'):
             self.categories.append(Category(dom = cate))
+        # Pagination
+        for link in self.feed.findall(NS['atom'] % 'link'):
+            attribute = self.PAGE_LINKS.get(link.attrib.get('rel'))
+            if attribute and getattr(self, attribute) is None:
+                setattr(self, attribute, link.attrib.get('href'))
         # handle entries - each one is compatible with a Deposit receipt, so using that
-        for entry in self.feed.findall(NS['atom'] % 'entry'):
-            self.entries.append(Deposit_Receipt(dom=entry))
-        # TODO handle multipage first/last pagination
-            
+        if self.build_entries:
+            self.entries = list(self.iter_entries())
 
+    def iter_entries(self, receipt_class=Deposit_Receipt, **kw):
+        """Make each atom:entry of the feed into a `receipt_class` (given `**kw` as well, eg `lazy=True`) as it is
+        reached. There are none if the document could not be parsed."""
+        if not self.parsed:
+            return
+        for entry in self.feed.findall(NS['atom'] % 'entry'):
+            yield receipt_class(dom=entry, **kw)
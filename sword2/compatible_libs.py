@@ -5,7 +5,7 @@
 Provides the module with access to certain libraries that have more than one suitable implementation, in a optimally
 degredating manner.
 
-Provides - `etree` and `json`
+Provides - `etree`, `json` and `OrderedDict`
 
 `etree` can be from any of the following, if found in the local environment:
     `lxml`
@@ -16,6 +16,11 @@ Provides - `etree` and `json`
 `json` can be from any of the following:
     `json` (python >= 2.6)
     `simplejson`
+
+`OrderedDict` can be from any of the following:
+    `collections` (python >= 2.7)
+    `ordereddict`
+    `Ordered_Dict` (below)
     
 If no suitable library is found, then it will pass back `None`
 """
@@ -48,3 +53,117 @@ except ImportError:
     except ImportError:
         cl_l.error("Couldn't find a suitable simplejson-like library to use to serialise JSON")
         json = None
+
+class Ordered_Dict(dict):
+    """A `dict` that remembers the order its keys were first set in, for Pythons without `collections.OrderedDict`.
+
+    Only offers what is used in this package: setting, getting and deleting items, iterating in order, `keys`,
+    `items`, `iteritems`, `pop`, `popitem` (from either end), `setdefault`, `update` and `clear`."""
+    def __init__(self, *args, **kw):
+        dict.__init__(self)
+        self.__root = root = []     # Doubly linked list of [previous, next, key], in order
+        root[:] = [root, root, None]
+        self.__links = {}           # Key = key, Value = its link in the list
+        self.update(*args, **kw)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            root = self.__root
+            last = root[0]
+            last[1] = root[0] = self.__links[key] = [last, root, key]
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        previous, following, _ = self.__links.pop(key)
+        previous[1] = following
+        following[0] = previous
+
+    def __iter__(self):
+        root = self.__root
+        link = root[1]
+        while link is not root:
+            yield link[2]
+            link = link[1]
+
+    def __reversed__(self):
+        root = self.__root
+        link = root[0]
+        while link is not root:
+            yield link[2]
+            link = link[0]
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield (key, self[key])
+
+    def clear(self):
+        dict.clear(self)
+        root = self.__root
+        root[:] = [root, root, None]
+        self.__links.clear()
+
+    def pop(self, key, *default):
+        if key in self:
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self, last=True):
+        if not self:
+            raise KeyError('dictionary is empty')
+        if last:
+            key = reversed(self).next()
+        else:
+            key = iter(self).next()
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kw):
+        if args:
+            other = args[0]
+            if hasattr(other, 'keys'):
+                for key in other.keys():
+                    self[key] = other[key]
+            else:
+                for key, value in other:
+                    self[key] = value
+        for key, value in kw.items():
+            self[key] = value
+
+    def copy(self):
+        return self.__class__(self)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.items())
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    try:
+        # Python 2.6, with the backport installed
+        from ordereddict import OrderedDict
+    except ImportError:
+        OrderedDict = Ordered_Dict
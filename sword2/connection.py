@@ -15,23 +15,55 @@ from zipfile import ZipFile
 from sword2_logging import logging
 conn_l = logging.getLogger(__name__)
 
-from utils import Timer, NS, get_md5, create_multipart_related, curl_request
+from utils import Timer, NS, get_md5, get_digests, get_content_type, curl_request, Response_Sink, \
+                  is_seekable, spool, DEFAULT_SPOOL_THRESHOLD
+from multipart import Multipart_Related
+from curl_pool import Curl_Pool, DEFAULT_MAX_SIZE, DEFAULT_IDLE_TIMEOUT
+from download import fetch_resumable, fetch_segments
+from checksum_cache import Checksum_Cache, imap_hash_files
+from request_engine import Request_Engine
+from receipt_cache import Receipt_Cache, SQLite_Receipt_Cache, Receipt_Index_View, DEFAULT_MAX_RECEIPTS, CONT, SE
 
 from transaction_history import Transaction_History
 from service_document import ServiceDocument
-from deposit_receipt import Deposit_Receipt
+from deposit_receipt import Deposit_Receipt, Compact_Deposit_Receipt
 from error_document import Error_Document
-from collection import Sword_Statement
+from collection import Sword_Statement, Collection_Feed
 from exceptions import *
 
 from compatible_libs import etree
 
 import httplib2
 
+from collections import deque
+from threading import Thread
+from time import time
+from Queue import Queue, Empty
+import os
+from urlparse import urljoin
+
 
 CONTENT_TYPES = ["application/atom+xml;type=entry",
                  "text/html; charset=utf-8"]
 
+class ContentWrapper(object):
+    """The response to `Connection.get_resource`.
+    
+    `response_headers`  -- response headers
+    `content`           -- body of the response (the file or package), or `None` if it was streamed to a sink
+    `code`              -- status code
+    `size`              -- number of bytes in the body
+    `path`              -- the file the body was streamed to, if it is known (`None` otherwise)
+    """
+    def __init__(self, resp, content, size=None, path=None):
+        self.response_headers = dict(resp)
+        self.content = content
+        self.code = resp.status
+        if size is None and content is not None:
+            size = len(content)
+        self.size = size
+        self.path = path
+
 
 class Connection(object):
     """
@@ -133,7 +165,22 @@ Please see the testsuite for this class for more examples of the sorts of transa
                        cache_deposit_receipts=True,
                        honour_receipts=True,
                        error_response_raises_exceptions=True,
-                       always_authenticate=False):
+                       always_authenticate=False,
+                       keep_alive=True,
+                       max_pooled_connections=DEFAULT_MAX_SIZE,
+                       connection_idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                       multipart_encoding="base64",
+                       checksum_cache=None,
+                       payload_digests=(),
+                       spool_threshold=DEFAULT_SPOOL_THRESHOLD,
+                       receipt_cache_size=DEFAULT_MAX_RECEIPTS,
+                       receipt_cache_ttl=None,
+                       receipt_cache=None,
+                       compact_receipts=False,
+                       keep_receipt_dom=True,
+                       lazy_receipts=False,
+                       stream_service_document=False,
+                       check_packaging=False):
         """
 Creates a new Connection object.
 
@@ -172,10 +219,47 @@ Parameters:
                 
                 cache_deposit_receipts=True,
                 
+                # The most deposit receipts to keep in that cache (the least recently used are dropped first; `None`
+                # for no limit), and how many seconds to keep each for (`None` to keep them until they are dropped).
+                
+                receipt_cache_size=1024,
+                receipt_cache_ttl=None,
+                
+                # Where to keep that cache: `None` to keep it in memory, the path of an SQLite database to keep it in
+                # (which lasts between runs and can be shared by several processes), or a cache object of your own -
+                # see `sword2.receipt_cache`.
+                
+                receipt_cache=None,
+                
+                # Return (and cache) deposit receipts as `sword2.deposit_receipt.Compact_Deposit_Receipt`s, which use
+                # far less memory but cannot have attributes of their own added. With `keep_receipt_dom` False, the
+                # parsed XML of each receipt is dropped once its attributes have been read from it.
+                
+                compact_receipts=False,
+                keep_receipt_dom=True,
+                
+                # Only read the links of each deposit receipt straight away, leaving its metadata, categories,
+                # packaging and treatment to be read when they are first used (see `Deposit_Receipt`)
+                
+                lazy_receipts=False,
+                
+                # Parse the service document as a stream (see `sword2.service_document`), one collection at a time,
+                # so that one with thousands of collections never has to be held as a whole DOM. It is only read as
+                # far as it is used. The document itself is still downloaded whole by `get_service_document` - it is
+                # its parsed form that is kept small. Each `SDCollection` read is kept, to look collections up by.
+                
+                stream_service_document=False,
+                
                 # Make sure to behave as required by the SWORD2 server - not sending too large a file, not asking for invalid packaging types and so on. 
                 
                 honour_receipts=True,
                 
+                # Refuse a deposit (`create` or `create_with_files`) into a collection whose sword:acceptPackaging, in
+                # the service document, does not list the packaging given - before anything is sent. The refusal is a
+                # `sword2.exceptions.PackagingFormatNotAvailable`, or a 415 `sword2.Error_Document` if exceptions are off.
+                
+                check_packaging=False,
+                
                 # Two means of handling server error responses:
                 #   If set to True - An exception will be thrown from `sword2.exceptions` (caused by any server error response w/ 
                 #      HTTP code greater than or equal to 400)
@@ -189,7 +273,39 @@ Parameters:
                 # Set the always_authenticate flag to always include basic
                 # HTTP authentication headers in requests.
 
-                always_authenticate=False
+                always_authenticate=False,
+
+                # Keep the cURL handles (and so their open HTTP/HTTPS connections) between requests, so that
+                # consecutive requests to the same host do not each pay for a new TCP/TLS handshake.
+                # `max_pooled_connections` is the number of idle connections kept per host and
+                # `connection_idle_timeout` the number of seconds an idle connection is kept before it is closed.
+
+                keep_alive=True,
+                max_pooled_connections=8,
+                connection_idle_timeout=60,
+
+                # The Content-Transfer-Encoding used for the file in multipart deposits. "base64" works with every
+                # server but makes the upload a third larger; "binary" sends the file as it is, for servers that
+                # accept it. Can be changed at any time through `self.multipart_encoding`.
+
+                multipart_encoding="base64",
+
+                # Remember the MD5 checksums of deposited files, so that files which have not changed (same path,
+                # inode, size and modification time) are not read again just to work out their Content-MD5.
+                # Either a `sword2.checksum_cache.Checksum_Cache`, or the path of a file to keep one in.
+
+                checksum_cache=None,
+
+                # Further digests to work out for each deposited file, in the same pass over it as its MD5, eg
+                # ('sha1', 'sha256'). They are recorded, with the MD5, as 'digests' in the transaction history.
+
+                payload_digests=(),
+
+                # Payloads that cannot be rewound (pipes, sockets, generators of bytestrings...) are copied into a
+                # spool, so that they can be hashed and then sent (and re-sent after an authentication challenge).
+                # The spool is held in memory up to `spool_threshold` bytes, and in a temporary file beyond that.
+
+                spool_threshold=8388608
                 )
                 
 If a `Connection` is created with the parameter `download_service_document` set to `False`, then no attempt
@@ -213,6 +329,8 @@ Loading in a locally held Service Document:
         # Honour deposit receipts - eg raise exceptions if interactions are attempted that the service document
         #                              does not allow without bothering the server - invalid packaging types, max upload sizes, etc
         self.honour_receipts = honour_receipts   
+        # Check deposits against the sword:acceptPackaging of their collection in the service document
+        self.check_packaging = check_packaging
         
         # When error_response_raises_exceptions == True:
         # Error responses (HTTP codes >399) will raise exceptions (from sword2.exceptions) in response
@@ -222,17 +340,42 @@ Loading in a locally held Service Document:
         # Check Error_Document.code to get the response code, regardless to whether a valid Sword2 error document was received.
         self.raise_except = error_response_raises_exceptions
         self.always_authenticate = always_authenticate
+        if multipart_encoding not in ("base64", "binary"):
+            raise ValueError("multipart_encoding must be either 'base64' or 'binary'")
+        self.multipart_encoding = multipart_encoding
+        self._own_checksum_cache = isinstance(checksum_cache, basestring)
+        if self._own_checksum_cache:
+            checksum_cache = Checksum_Cache(checksum_cache)
+        self.checksum_cache = checksum_cache
+        self.payload_digests = tuple(payload_digests)
+        self.spool_threshold = spool_threshold
         
         self.keep_cache = cache_deposit_receipts
         self.h = httplib2.Http(".cache", timeout=30.0)
+        self.curl_pool = None
+        if keep_alive:
+            self.curl_pool = Curl_Pool(max_size=max_pooled_connections,
+                                       idle_timeout=connection_idle_timeout)
         self.user_name = user_name
         self.on_behalf_of = on_behalf_of
         
-        # Cached Deposit Receipt 'indexes'  *cough, cough*
-        self.edit_iris = {}          # Key = IRI, Value = ref to latest Deposit Receipt for the resource
-        self.cont_iris = {}          # Key = IRI, Value = ref to latest Deposit Receipt
-        self.se_iris = {}            # Key = IRI, Value = ref to latest Deposit Receipt
-        self.cached_at = {}          # Key = Edit-IRI, Value = Timestamp for when receipt was cached
+        # `sword2.collection.Collection_Feed`s read so far, by Col-IRI - kept for their page caches
+        self.collection_feeds = {}
+        
+        # Cached Deposit Receipts, and read-only views of their indexes
+        self.receipt_class = Deposit_Receipt
+        if compact_receipts:
+            self.receipt_class = Compact_Deposit_Receipt
+        self.keep_receipt_dom = keep_receipt_dom
+        self.lazy_receipts = lazy_receipts
+        self.stream_service_document = stream_service_document
+        self._own_receipt_cache = isinstance(receipt_cache, basestring)
+        if receipt_cache is None:
+            receipt_cache = Receipt_Cache(max_size=receipt_cache_size, ttl=receipt_cache_ttl)
+        elif self._own_receipt_cache:
+            receipt_cache = SQLite_Receipt_Cache(receipt_cache, max_size=receipt_cache_size, ttl=receipt_cache_ttl,
+                                                 receipt_class=self.receipt_class)
+        self._use_receipt_cache(receipt_cache)
         
         # Transaction history hooks
         self.history = None
@@ -319,29 +462,30 @@ Loading in a locally held Service Document:
         
         (only provides cache if `self.keep_cache` is `True` [via the `cache_deposit_receipts` init parameter flag])
         
-        Provides and maintains:
-            self.edit_iris -- a `dict`, keys: Edit-IRI hrefs, values: `sword2.Deposit_Receipt` objects they appear in
+        The receipts are kept in `self.receipts`, a `sword2.receipt_cache.Receipt_Cache` (or the `receipt_cache`
+        given to init), bounded by the `receipt_cache_size` and `receipt_cache_ttl` init parameters. It provides
+        these read-only views:
+            self.edit_iris -- keys: Edit-IRI hrefs, values: `sword2.Deposit_Receipt` objects they appear in
             
-            self.cont_iris -- a `dict`, keys: Content-IRI hrefs, values: `sword2.Deposit_Receipt` objects they appear in
+            self.cont_iris -- keys: Content-IRI hrefs, values: `sword2.Deposit_Receipt` objects they appear in
             
-            self.se_iris -- a `dict`, keys: Sword-Edit-IRI hrefs, values: `sword2.Deposit_Receipt` objects they appear in
+            self.se_iris -- keys: Sword-Edit-IRI hrefs, values: `sword2.Deposit_Receipt` objects they appear in
             
-            self.cached_at -- a `dict`, keys: Edit-IRIs, values: timestamp when receipt was last cached.
+            self.cached_at -- keys: Edit-IRIs, values: timestamp when receipt was last cached.
         """
         if self.keep_cache:
-            timestamp = self._t.get_timestamp()
-            conn_l.debug("Caching document (Edit-IRI:%s) - at %s" % (d.edit, timestamp))
-            self.edit_iris[d.edit] = d
-            if d.cont_iri:   # SHOULD exist within receipt
-                self.cont_iris[d.cont_iri] = d
-            if d.se_iri:     
-                # MUST exist according to the spec, but as it can be the same as the Edit-IRI
-                # it seems likely that a server implementation might ignore the 'MUST' part.
-                self.se_iris[d.se_iri] = d
-            self.cached_at[d.edit] = self._t.get_timestamp()
+            conn_l.debug("Caching document (Edit-IRI:%s)" % d.edit)
+            self.receipts.put(d)
         else:
             conn_l.debug("Caching request denied - deposit receipt caching is set to 'False'")
     
+    def _use_receipt_cache(self, receipt_cache):
+        self.receipts = receipt_cache
+        self.edit_iris = Receipt_Index_View(self.receipts)        # Key = IRI, Value = ref to latest Deposit Receipt for the resource
+        self.cont_iris = Receipt_Index_View(self.receipts, CONT)  # Key = IRI, Value = ref to latest Deposit Receipt
+        self.se_iris = Receipt_Index_View(self.receipts, SE)      # Key = IRI, Value = ref to latest Deposit Receipt
+        self.cached_at = Receipt_Index_View(self.receipts, timestamps=True)  # Key = Edit-IRI, Value = Timestamp for when receipt was cached
+
     def load_service_document(self, xml_document):
         """Load the Service Document XML from bytestring, `xml_document`
         
@@ -357,14 +501,23 @@ Loading in a locally held Service Document:
             `self.maxUploadSize` -- the maximum filesize for a deposit, if given in the service document
         """
         self._t.start("SD Parse")
-        self.sd = ServiceDocument(xml_document)
+        self.sd = ServiceDocument(xml_document, streaming=self.stream_service_document)
         _, took_time = self._t.time_since_start("SD Parse")
         # Set up some convenience references
         self.workspaces = self.sd.workspaces
         self.maxUploadSize = self.sd.maxUploadSize
         
         if self.history:
-            if self.sd.valid:
+            if self.sd.valid and self.sd.streaming:
+                # Listing the workspaces would read all of a streamed document
+                self.history.log('SD Parse', 
+                                 sd_iri = self.sd_iri,
+                                 valid = self.sd.valid,
+                                 streamed = True,
+                                 sword_version = self.sd.version,
+                                 maxUploadSize = self.sd.maxUploadSize,
+                                 process_duration = took_time)
+            elif self.sd.valid:
                 self.history.log('SD Parse', 
                                  sd_iri = self.sd_iri,
                                  valid = self.sd.valid,
@@ -396,12 +549,15 @@ Loading in a locally held Service Document:
     def get_service_document(self):
         """Perform an HTTP GET on the Service Document IRI (SD-IRI) and attempt to parse the result as
         a SWORD2 Service Document (using `self.load_service_document`)
+        
+        The response is read into memory as a whole, even if `self.stream_service_document` is set - only the parsing
+        is streamed.
         """
         headers = self._init_http_request_headers()
         if self.on_behalf_of:
             headers['on-behalf-of'] = self.on_behalf_of
         self._t.start("SD_URI request")
-        resp, content = curl_request(self.h, self.sd_iri, "GET", headers=headers)
+        resp, content = curl_request(self.h, self.sd_iri, "GET", headers=headers, curl_pool=self.curl_pool)
         _, took_time = self._t.time_since_start("SD_URI request")
         if self.history:
             self.history.log('SD_IRI GET', 
@@ -423,7 +579,7 @@ Loading in a locally held Service Document:
         if self.on_behalf_of:
             headers['on-behalf-of'] = self.on_behalf_of
         self._t.start("WORKSPACE_URL request")
-        resp, content = curl_request(self.h, workspace_url, "GET", headers=headers)
+        resp, content = curl_request(self.h, workspace_url, "GET", headers=headers, curl_pool=self.curl_pool)
         _, took_time = self._t.time_since_start("WORKSPACE_URL request")
 
         if self.history:
@@ -443,7 +599,7 @@ Loading in a locally held Service Document:
         """
         module_url = module_url + '/module_export?format=%s&export=Export' % packaging
         headers = self._init_http_request_headers()
-        resp, content = curl_request(self.h, module_url, "GET", headers=headers)
+        resp, content = curl_request(self.h, module_url, "GET", headers=headers, curl_pool=self.curl_pool)
         _, took_time = self._t.time_since_start("module_url request")
 
         if self.history:
@@ -459,12 +615,60 @@ Loading in a locally held Service Document:
                 "You are unauthorised (401) to access this content ",
                 "on the server. Check your username/password credentials")        
         
+    def close(self):
+        """Close the connections kept open for reuse (see the `keep_alive` init parameter).
+        
+        The `Connection` can still be used afterwards, new connections will be opened as needed.
+        
+        A checksum cache opened by the `Connection` from a path is written out and closed as well. So is a receipt
+        cache opened from a path, receipts being kept in memory from then on."""
+        if self.curl_pool is not None:
+            self.curl_pool.close()
+        if self._own_checksum_cache:
+            self.checksum_cache.close()
+            self.checksum_cache = None
+            self._own_checksum_cache = False
+        if self._own_receipt_cache:
+            self.receipts.close()
+            self._use_receipt_cache(Receipt_Cache(max_size=self.receipts.max_size, ttl=self.receipts.ttl))
+            self._own_receipt_cache = False
+
     def reset_transaction_history(self):
         """ Clear the transaction history - `self.history`"""
         del self.history
         self.history = Transaction_History()
 
-    def _make_request(self,
+    def _make_request(self, target_iri, **kw):
+        """Performs an HTTP request, as defined by the parameters. This is an internally used method and it is best that it
+        is not called directly.
+        
+        The parameters are those of `self._prepare_request`, which builds the request; it is then sent and the response
+        handled by `self._send_request` and `self._handle_response`.
+        
+        Response:
+        
+        A `sword2.Deposit_Receipt` object containing the deposit receipt data. If the response was blank or 
+        not a Deposit Response, then only a few attributes will be populated:
+            
+        `code` -- HTTP code of the response
+        `response_headers`  -- `dict` of the reponse headers
+        `content`  --  (Optional) in case the response body is not empty but the response is not a Deposit Receipt
+        
+        If exception-throwing is turned off (`error_response_raises_exceptions = False` or `self.raise_except = False`)
+        then the response will be a `sword2.Error_Document`, but will still have the aforementioned attributes set, (code,
+        response_headers, etc)
+        """
+        request = self._prepare_request(target_iri, **kw)
+        try:
+            resp, content = self._send_request(request)
+        finally:
+            for spooled in request['spools']:
+                spooled.close()
+            if isinstance(request['body'], Multipart_Related):
+                request['body'].close()
+        return self._handle_response(resp, content)
+
+    def _prepare_request(self,
                       target_iri, 
                       payload=None,       # These need to be set to upload a file
                       mimetype=None,      
@@ -476,6 +680,8 @@ Loading in a locally held Service Document:
                         
                       # Set both a file and a metadata entry for the method to perform a multipart
                       # related upload.
+                      files=None,           # or a metadata entry and a list of files, for a multipart
+                                            # related upload with a payload part for each
                       suggested_identifier=None,   # 'slug'
                       in_progress=True,
                       on_behalf_of=None,
@@ -487,9 +693,10 @@ Loading in a locally held Service Document:
                       method = "POST",
                       request_type="",       # text label for transaction history reports
                       additional_headers = {},
+                      checksums = None,      # ({algorithm: hexdigest}, size) of the payload, if already known
                       ):
-        """Performs an HTTP request, as defined by the parameters. This is an internally used method and it is best that it
-        is not called directly.
+        """Builds an HTTP request, as defined by the parameters, without sending it. This is an internally used method and
+        it is best that it is not called directly.
         
         target_iri -- IRI that will be the target of the HTTP call
         
@@ -500,15 +707,29 @@ Loading in a locally held Service Document:
         packaging - the SWORD2 packaging type of the payload. 
                     eg packaging = 'http://purl.org/net/sword/package/Binary'
         
-        # NB to work around a possible bug in httplib2 0.6.0, the file-like object is read into memory rather than streamed
-        # from disc, so is not as efficient as it should be. That said, it is recommended that file handles are passed to 
-        # the _make_request method, as this is hoped to be a temporary situation.
+        # File-like payloads must support `seek()` as well. They are streamed from disc rather than read into memory, for
+        # both binary and multipart uploads - it is recommended that file handles are passed to the _make_request method
+        # for large files. The file is rewound if the request has to be sent again, eg after an authentication challenge.
+        # With a `self.checksum_cache`, files that have not changed since they were last hashed are not read for their MD5.
+        # Any `self.payload_digests` are worked out in the same pass as the MD5.
+        # Payloads that cannot be rewound (eg pipes), or iterables of bytestrings, are first spooled - see `self.spool_threshold`.
+        
+        checksums - ({algorithm: hexdigest}, size) of the payload, worked out beforehand (eg by `sword2.checksum_cache.hash_files`)
+                    with the MD5 and any `self.payload_digests` - the payload is then not read for them here.
         
         metadata_entry  - a `sword2.Entry` to be uploaded with metadata fields set as desired.
         
         # If there is both a payload and a metadata_entry, then the request will be made as a Multipart-related request
         # Otherwise, it will be a normal request for whicever type of upload.
         
+        files   - `list` of `dict`s, each describing a file to send with the metadata_entry in one Multipart-related
+                  request, with a payload part for each:
+                    'payload'   -- bytestring or File-like object, as for `payload`
+                    'filename'  -- filename of the file (required)
+                    'mimetype'  -- MIMEType of the file (guessed from the filename if missing)
+                    'packaging' -- optional SWORD2 packaging type of the file
+                  Every file is hashed and sized before anything is sent.
+        
         empty   - a flag to specify that an empty request should be made. A blank body and a 'Content-Length:0' header will be explicitly added
                   and any payload or metadata_entry passed in will be ignored.
         
@@ -523,21 +744,23 @@ Loading in a locally held Service Document:
         method          -- "GET", "POST", etc
         request_type    -- A label to be used in the transaction history for this particular operation. 
         
-        Response:
-        
-        A `sword2.Deposit_Receipt` object containing the deposit receipt data. If the response was blank or 
-        not a Deposit Response, then only a few attributes will be populated:
-            
-        `code` -- HTTP code of the response
-        `response_headers`  -- `dict` of the reponse headers
-        `content`  --  (Optional) in case the response body is not empty but the response is not a Deposit Receipt
+        Returns a `dict` describing the request:
         
-        If exception-throwing is turned off (`error_response_raises_exceptions = False` or `self.raise_except = False`)
-        then the response will be a `sword2.Error_Document`, but will still have the aforementioned attributes set, (code,
-        response_headers, etc)
+        `target_iri`, `method`, `headers` and `body` -- what is to be sent
+        `request_type`  -- as above
+        `description`   -- the label used for this request in the transaction history, eg "Col_IRI POST: Multipart resource request"
+        `history`       -- `dict` of any additional information to record in the transaction history
+        `spools`        -- `list` of the temporary copies of payloads that could not be rewound, to be closed once sent
         """
+        spools = []
         if payload:
-            md5sum, f_size = get_md5(payload)
+            if checksums is not None:
+                digests, f_size = checksums
+            else:
+                payload, spooled, digests, f_size = self._hash_payload(payload)
+                if spooled is not None:
+                    spools.append(spooled)
+            md5sum = digests['md5']
         
         # request-level headers
         headers = self._init_http_request_headers()
@@ -548,122 +771,155 @@ Loading in a locally held Service Document:
         elif self.on_behalf_of:
             headers['On-Behalf-Of'] = self.on_behalf_of
             
-        if suggested_identifier:
-            headers['Slug'] = str(suggested_identifier)
-            
         if suggested_identifier:
             headers['Slug'] = str(suggested_identifier)
         
         if metadata_relevant:
             headers['Metadata-Relevant'] = str(metadata_relevant).lower()
         
-        if hasattr(payload, 'read'):
-            # Need to work out why a 401 challenge will stop httplib2 from sending the file...
-            # likely need to make it re-seek to 0...
-            # In the meantime, read the file into memory... *sigh*
-            payload = payload.read()
-        
-        self._t.start(request_type)
+        request = {'target_iri':target_iri,
+                   'method':method,
+                   'headers':headers,
+                   'body':None,
+                   'request_type':request_type,
+                   'history':{},
+                   'spools':spools}
+        if payload and self.payload_digests:
+            request['history']['digests'] = digests
         if empty:
             # NULL body with explicit zero length.
             headers['Content-Length'] = "0"
-            resp, content = curl_request(self.h, target_iri, method, headers=headers)
-            _, took_time = self._t.time_since_start(request_type)
-            if self.history:
-                self.history.log(request_type + ": Empty request", 
-                                 sd_iri = self.sd_iri,
-                                 target_iri = target_iri,
-                                 method = method,
-                                 response = resp,
-                                 headers = headers,
-                                 process_duration = took_time)  
+            request['description'] = request_type + ": Empty request"
         elif method == "DELETE":
-            resp, content = curl_request(self.h, target_iri, method, headers=headers)
-            _, took_time = self._t.time_since_start(request_type)
-            if self.history:
-                self.history.log(request_type + ": DELETE request", 
-                                 sd_iri = self.sd_iri,
-                                 target_iri = target_iri,
-                                 method = method,
-                                 response = resp,
-                                 headers = headers,
-                                 process_duration = took_time)
-            
+            request['description'] = request_type + ": DELETE request"
+        elif metadata_entry and files:
+            # Multipart resource creation, with a payload part for every file
+            parts = [{'key':'atom',
+                      'type':'application/atom+xml; charset="utf-8"',
+                      'data':str(metadata_entry)}]
+            for f in files:
+                data, spooled, digests, f_size = self._hash_payload(f['payload'])
+                if spooled is not None:
+                    spools.append(spooled)
+                part_headers = {'Content-MD5':str(digests['md5'])}
+                if f.get('packaging'):
+                    part_headers['Packaging'] = str(f['packaging'])
+                if self.payload_digests:
+                    request['history'].setdefault('digests', []).append(digests)
+                parts.append({'key':'payload',
+                              'type':str(f.get('mimetype') or get_content_type(f['filename'])),
+                              'filename':f['filename'],
+                              'data':data,
+                              'headers':part_headers,
+                              'encoding':self.multipart_encoding})
+            payload_data = Multipart_Related(parts)
+            headers['Content-Type'] = payload_data.content_type + '; type="application/atom+xml"'
+            headers['Content-Length'] = str(len(payload_data))
+            request['body'] = payload_data
+            request['description'] = request_type + ": Multipart resource request (%s files)" % len(files)
+            # record just the headers used in multipart construction
+            request['history']['multipart'] = [dict([(k, v) for k, v in part.iteritems() if k != 'data'])
+                                               for part in parts]
         elif metadata_entry and not (filename and payload):
             # Metadata-only resource creation
             headers['Content-Type'] = "application/atom+xml;type=entry"
             data = str(metadata_entry)
             headers['Content-Length'] = str(len(data))
-            resp, content = curl_request(self.h, target_iri, method, headers=headers, body = data)
-            _, took_time = self._t.time_since_start(request_type)
-            if self.history:
-                self.history.log(request_type + ": Metadata-only resource request", 
-                                 sd_iri = self.sd_iri,
-                                 target_iri = target_iri,
-                                 method = method,
-                                 response = resp,
-                                 headers = headers,
-                                 process_duration = took_time)
-            
+            request['body'] = data
+            request['description'] = request_type + ": Metadata-only resource request"
         elif metadata_entry and filename and payload:
             # Multipart resource creation
-            multicontent_type, payload_data = create_multipart_related([{'key':'atom',
-                                                                    'type':'application/atom+xml; charset="utf-8"',
-                                                                    'data':str(metadata_entry),  # etree default is utf-8
-                                                                    },
-                                                                    {'key':'payload',
-                                                                    'type':str(mimetype),
-                                                                    'filename':filename,
-                                                                    'data':payload,  
-                                                                    'headers':{'Content-MD5':str(md5sum),
-                                                                               'Packaging':str(packaging),
-                                                                               }
-                                                                    }
-                                                                   ])
-                                                                   
-            headers['Content-Type'] = multicontent_type + '; type="application/atom+xml"'
-            headers['Content-Length'] = str(len(payload_data))    # must be str, not int type
-            resp, content = curl_request(self.h, target_iri, method, headers=headers, body = payload_data)
-            _, took_time = self._t.time_since_start(request_type)
-            if self.history:
-                self.history.log(request_type + ": Multipart resource request",
-                                 sd_iri = self.sd_iri,
-                                 target_iri = target_iri,
-                                 response = resp,
-                                 headers = headers,
-                                 method = method,
-                                 multipart = [{'key':'atom',
-                                               'type':'application/atom+xml; charset="utf-8"'
-                                              },
+            payload_data = Multipart_Related([{'key':'atom',
+                                               'type':'application/atom+xml; charset="utf-8"',
+                                               'data':str(metadata_entry),  # etree default is utf-8
+                                               },
                                               {'key':'payload',
                                                'type':str(mimetype),
                                                'filename':filename,
+                                               'data':payload,  
                                                'headers':{'Content-MD5':str(md5sum),
                                                           'Packaging':str(packaging),
-                                                         }
-                                               }],   # record just the headers used in multipart construction
-                                 process_duration = took_time)
+                                                          },
+                                               'encoding':self.multipart_encoding
+                                               }
+                                             ])
+                                                                   
+            headers['Content-Type'] = payload_data.content_type + '; type="application/atom+xml"'
+            headers['Content-Length'] = str(len(payload_data))    # must be str, not int type
+            request['body'] = payload_data     # streamed by the transport as it is read
+            request['description'] = request_type + ": Multipart resource request"
+            request['history']['multipart'] = [{'key':'atom',
+                                                 'type':'application/atom+xml; charset="utf-8"'
+                                                },
+                                                {'key':'payload',
+                                                 'type':str(mimetype),
+                                                 'filename':filename,
+                                                 'headers':{'Content-MD5':str(md5sum),
+                                                            'Packaging':str(packaging),
+                                                           },
+                                                 'encoding':self.multipart_encoding
+                                                 }]   # record just the headers used in multipart construction
         elif filename and payload:
             headers['Content-Type'] = str(mimetype)
             headers['Content-MD5'] = str(md5sum)
             headers['Content-Length'] = str(f_size)
             headers['Content-Disposition'] = "attachment; filename=%s" % filename   # TODO: ensure filename is ASCII
             headers['Packaging'] = str(packaging)
-            
-            resp, content = curl_request(self.h, target_iri, method, headers=headers, body = payload)
-            _, took_time = self._t.time_since_start(request_type)
-            if self.history:
-                self.history.log(request_type + ": simple resource request",
-                                 sd_iri = self.sd_iri,
-                                 target_iri = target_iri,
-                                 method = method,
-                                 response = resp,
-                                 headers = headers,
-                                 process_duration = took_time)
+            request['body'] = payload
+            request['description'] = request_type + ": simple resource request"
         else:
             conn_l.error("Parameters were not complete: requires a metadata_entry, or a payload/filename/packaging or both")
             raise Exception("Parameters were not complete: requires a metadata_entry, or a payload/filename/packaging or both")
+        return request
+
+    def _hash_payload(self, payload):
+        """Works out the MD5 (and any `self.payload_digests`) and size of a payload, spooling it first if it cannot be
+        rewound.
+        
+        Returns (payload, spooled, digests, size) - `payload` is the spooled copy if one was made, and `spooled` is that
+        copy (or `None`), to be closed once the request has been sent."""
+        algorithms = ('md5',) + tuple([name for name in self.payload_digests if name != 'md5'])
+        if not isinstance(payload, basestring) and not is_seekable(payload):
+            conn_l.debug("Spooling a payload that cannot be rewound (in memory up to %s bytes)" % self.spool_threshold)
+            spooled, digests, f_size = spool(payload, self.spool_threshold, algorithms)
+            return spooled, spooled, digests, f_size
+        if self.checksum_cache is not None:
+            digests, f_size = self.checksum_cache.get_digests(payload, algorithms)
+        else:
+            digests, f_size = get_digests(payload, algorithms)
+        return payload, None, digests, f_size
+
+    def _send_request(self, request):
+        """Sends a request built by `self._prepare_request`, recording it in the transaction history.
         
+        Returns the (response, content) tuple from `sword2.utils.curl_request`"""
+        self._t.start(request['request_type'])
+        resp, content = curl_request(self.h, request['target_iri'], request['method'], headers=request['headers'],
+                                     body=request['body'], curl_pool=self.curl_pool)
+        _, took_time = self._t.time_since_start(request['request_type'])
+        self._log_request(request, resp, took_time)
+        return resp, content
+
+    def _log_request(self, request, resp, took_time):
+        """Record a request built by `self._prepare_request` and its response in the transaction history."""
+        if self.history:
+            self.history.log(request['description'],
+                             sd_iri = self.sd_iri,
+                             target_iri = request['target_iri'],
+                             method = request['method'],
+                             response = resp,
+                             headers = request['headers'],
+                             process_duration = took_time,
+                             **request['history'])
+
+    def _new_receipt(self, xml_deposit_receipt=None, **kw):
+        """A deposit receipt of `self.receipt_class`, keeping its DOM as `self.keep_receipt_dom` says, and parsed
+        lazily if `self.lazy_receipts` is set."""
+        return self.receipt_class(xml_deposit_receipt, keep_dom=self.keep_receipt_dom, lazy=self.lazy_receipts, **kw)
+
+    def _handle_response(self, resp, content):
+        """Interpret the response to a request made by `self._make_request`, returning a `sword2.Deposit_Receipt` or, if the
+        response was an error and exceptions are turned off, a `sword2.Error_Document`."""
         if resp['status'] == "201":
             #   Deposit receipt in content
             conn_l.info("Received a Resource Created (201) response.")
@@ -671,7 +927,7 @@ Loading in a locally held Service Document:
             location = resp.get('location', None)
             if len(content) > 0:
                 # Fighting chance that this is a deposit receipt
-                d = Deposit_Receipt(xml_deposit_receipt = content)
+                d = self._new_receipt(xml_deposit_receipt = content)
                 if d.parsed:
                     conn_l.info("Server response included a Deposit Receipt. Caching a copy in .resources['%s']" % d.edit)
                 d.response_headers = dict(resp)
@@ -681,7 +937,7 @@ Loading in a locally held Service Document:
                 return d
             else:
                 # No body...
-                d = Deposit_Receipt()
+                d = self._new_receipt()
                 conn_l.info("Server response dir not include a Deposit Receipt.")
                 d.response_headers = dict(resp)
                 d.code = 201
@@ -692,7 +948,7 @@ Loading in a locally held Service Document:
             conn_l.info("Received a valid 'No Content' (204) response.")
             location = resp.get('location', None)
             # Check response headers for updated Locatio
-            return Deposit_Receipt(response_headers = dict(resp), location=location, code=204)
+            return self._new_receipt(response_headers = dict(resp), location=location, code=204)
         elif resp['status'] in ["200", "302"]:
             # we treat 200 and 302 the same since the both indicate the upload
             # to the repository was successfull.
@@ -702,7 +958,7 @@ Loading in a locally held Service Document:
             content_type = resp.get('content-type')
             location = resp.get('location', None)
             if content_type in CONTENT_TYPES and len(content) > 0:
-                d = Deposit_Receipt(content)
+                d = self._new_receipt(content)
                 if d.parsed:
                     conn_l.info("Server response included a Deposit Receipt. "
                                 "Caching a copy in .resources['%s']" % d.edit)
@@ -713,7 +969,7 @@ Loading in a locally held Service Document:
                     return d
             else:
                 # No atom entry...
-                d = Deposit_Receipt()
+                d = self._new_receipt()
                 conn_l.info("Server response dir not include a Deposit Receipt Entry.")
                 d.response_headers = dict(resp)
                 d.location = location
@@ -871,20 +1127,12 @@ From the spec:
 The SWORD server is not required to support packaging formats, but this profile RECOMMENDS that the server be able to accept a ZIP file as the Media Part of an Atom Multipart request (See Section 5: IRIs and Section 7: Packaging for more details)."
         """
         conn_l.debug("Create Resource")
-        if not col_iri:
-            for w, collections in self.workspaces:
-                if w == workspace:
-                    for c in collections:
-                        if c.title == collection:
-                            conn_l.debug("Matched: Workspace='%s', Collection='%s' ==> Col-IRI='%s'" % (workspace, 
-                                                                                                        collection, 
-                                                                                                        c.href))
-                            col_iri = c.href
-                            break
-
+        col_iri = self._find_col_iri(workspace, collection, col_iri)
         if not col_iri:   # no col_iri provided and no valid workspace/collection given
             conn_l.error("No suitable Col-IRI was found, with the given parameters.")
             return
+        if not self._packaging_accepted(col_iri, packaging):
+            return self._refuse_packaging(col_iri, packaging)
         
         return self._make_request(target_iri = col_iri,
                                   payload=payload,
@@ -899,6 +1147,102 @@ The SWORD server is not required to support packaging formats, but this profile
                                   request_type='Col_IRI POST',
                                   additional_headers=additional_headers)
         
+    def _find_col_iri(self, workspace, collection, col_iri=None):
+        """The Col-IRI given, or else the one of the collection titled `collection` in the workspace `workspace`
+        (looked up in the service document's index)."""
+        if not col_iri and self.sd is not None:
+            c = self.sd.find_collection(workspace, collection)
+            if c is not None:
+                conn_l.debug("Matched: Workspace='%s', Collection='%s' ==> Col-IRI='%s'" % (workspace, 
+                                                                                            collection, 
+                                                                                            c.href))
+                col_iri = c.href
+        return col_iri
+
+    def _packaging_accepted(self, col_iri, packaging):
+        """Whether, as far as the service document says, the collection at `col_iri` accepts deposits packaged as
+        `packaging`. Collections that are not in the service document, or that do not list any sword:acceptPackaging,
+        are taken to accept anything - as is everything, unless `self.check_packaging` is set."""
+        if not (self.check_packaging and packaging and self.sd is not None):
+            return True
+        c = self.sd.get_collection(col_iri)
+        if c is None or not c.acceptPackaging:
+            return True
+        conn_l.debug("Checking that the packaging format '%s' is accepted by %s" % (packaging, col_iri))
+        return packaging in c.acceptPackaging
+
+    def _refuse_packaging(self, col_iri, packaging):
+        """Report a deposit that `self._packaging_accepted` has refused, as if the server had responded with a 415."""
+        conn_l.error("Packaging format '%s' is not accepted by the collection at %s, according to the service document. Change the client parameter 'check_packaging' to False to avoid this check." % (packaging, col_iri))
+        resp = httplib2.Response({'status':'415', 'content-type':'text/plain'})
+        return self._return_error_or_exception(PackagingFormatNotAvailable, resp, "")
+
+    def create_with_files(self, 
+                        workspace=None,     # Either provide workspace/collection or
+                        collection=None,    # the exact Col-IRI itself
+                        col_iri=None,  
+                        metadata_entry=None,
+                        files=(),
+                        suggested_identifier=None,
+                        in_progress=True,
+                        on_behalf_of=None,
+                        additional_headers={},
+                        ):
+        """
+Creating a Resource with an Atom Entry and several files
+========================================================
+
+Creates a resource from a metadata entry and any number of files, all sent in a single streamed Multipart-related
+request - one Atom part and a payload part for each file. For servers that accept this, it saves the round trip of
+an `add_file_to_resource` for every file after the first.
+
+Select the collection as for `create`, by `col_iri` or by `workspace` and `collection`.
+
+    `metadata_entry`    -- an instance of `sword2.Entry`, set with the metadata required
+    `files`             -- `list` of `dict`s, one for each file:
+                            'payload'   -- a bytestring or a File-like object that supports `payload.read()`
+                            'filename'  -- filename of the file
+                            'mimetype'  -- MIMEType of the file (guessed from the filename if missing)
+                            'packaging' -- optional SWORD2 packaging type of the file
+
+Every file is hashed and sized before the request is made, so that each part carries its own Content-MD5 and the
+request has an exact Content-Length. The files themselves are only read as the request is sent.
+
+    >>> conn.create_with_files(col_iri = collection_iri,
+    ...                        metadata_entry = entry,
+    ...                        files = [{'payload':open("thesis.pdf", "rb"), 'filename':"thesis.pdf"},
+    ...                                 {'payload':open("data.csv", "rb"), 'filename':"data.csv",
+    ...                                  'mimetype':"text/csv"}])
+
+The SWORD2 request parameters (`suggested_identifier`, `in_progress` and `on_behalf_of`) are as for `create`.
+
+Response:
+
+A `sword2.Deposit_Receipt` (or `sword2.Error_Document`), as for `create`.
+        """
+        conn_l.debug("Create Resource with %s files" % len(files))
+        col_iri = self._find_col_iri(workspace, collection, col_iri)
+        if not col_iri:
+            conn_l.error("No suitable Col-IRI was found, with the given parameters.")
+            return
+        if not metadata_entry or not files:
+            conn_l.error("A multi-file deposit requires a metadata_entry and at least one file")
+            raise Exception("A multi-file deposit requires a metadata_entry and at least one file")
+        for f in files:
+            if not f.get('filename') or not f.get('payload'):
+                raise Exception("Every file in a multi-file deposit needs a 'payload' and a 'filename'")
+            if not self._packaging_accepted(col_iri, f.get('packaging')):
+                return self._refuse_packaging(col_iri, f.get('packaging'))
+        return self._make_request(target_iri = col_iri,
+                                  metadata_entry=metadata_entry,
+                                  files=files,
+                                  suggested_identifier=suggested_identifier,
+                                  in_progress=in_progress,
+                                  on_behalf_of=on_behalf_of,
+                                  method="POST",
+                                  request_type='Col_IRI POST',
+                                  additional_headers=additional_headers)
+
     def update(self, metadata_entry = None,    # required for a metadata update
                              payload = None,            # required for a file update      
                              filename = None,           # required for a file update
@@ -1089,6 +1433,115 @@ response_headers, etc)
                                   request_type='EM_IRI POST (APPEND)',
                                   additional_headers=additional_headers)
 
+    def add_files_to_resource(self, 
+                        edit_media_iri,
+                        paths,          # The files to upload, each with its own request
+                        mimetype=None,  # If not given, guessed from each filename
+                        
+                        on_behalf_of=None,
+                        in_progress=False, 
+                        metadata_relevant=False,
+                        additional_headers={},
+                        processes=None,
+                        max_concurrent=4,
+                        ):
+        """
+Adding a set of Files to the Media Resource
+
+Adds each of the files at `paths` to the media resource, as `self.add_file_to_resource` would, one request per file.
+
+Rather than working out the MD5 of each file just before it is sent, the files are hashed all at once in a pool of
+`processes` worker processes (by default, one per core), and each file is sent as soon as its checksum is ready - with
+up to `max_concurrent` uploads in flight at once. Hashing the files on every core so overlaps with sending them.
+Each file is only opened when its upload starts, and is closed once it has been sent, so that no more than
+`max_concurrent` of them are open at any time.
+
+The checksums go into `self.checksum_cache` if there is one (and files already in it are not hashed again).
+
+Set the following parameters in addition to the basic parameters:
+
+    `edit_media_iri` - The Edit-Media-IRI
+    `paths`     - `list` of the paths of the files to upload. The filename sent for each is its basename.
+    `mimetype`  - MIMEType of the files, if they all share one. Otherwise it is guessed from each filename.
+
+eg:
+    >>> receipts = conn.add_files_to_resource(dr.edit_media, glob.glob("scans/*.tiff"))
+
+Response:
+
+A `list` with the response for each file, in the same order as `paths`: a `sword2.Deposit_Receipt` as for
+`self.add_file_to_resource`, a `sword2.Error_Document` if exceptions are turned off, or the exception raised.
+        """
+        paths = list(paths)
+        algorithms = ('md5',) + tuple([name for name in self.payload_digests if name != 'md5'])
+        
+        # Positions of each path in `paths` (a path could be listed more than once)
+        positions = {}
+        for index, path in enumerate(paths):
+            positions.setdefault(path, []).append(index)
+        
+        # Hash in a background thread, which hands on each (path, checksums) as soon as it is done
+        hashed = Queue()
+        def hash_paths():
+            try:
+                for item in imap_hash_files(paths, algorithms, processes, self.checksum_cache):
+                    hashed.put(item)
+            except Exception, e:
+                hashed.put(e)
+            hashed.put(None)
+        hasher = Thread(target=hash_paths)
+        hasher.daemon = True
+        hasher.start()
+        
+        conn_l.info("Adding %s files to a deposit via Edit-Media-IRI %s" % (len(paths), edit_media_iri))
+        engine = Request_Engine(self, max_concurrent=max_concurrent)
+        ready = deque()     # (path, checksums) of the files hashed but not yet sent
+        tickets = {}        # Key = position in `paths`, Value = engine ticket
+        open_files = []
+        hashing = True
+        try:
+            while hashing or ready or engine.pending():
+                if hashing:
+                    try:
+                        if ready or engine.pending():
+                            item = hashed.get_nowait()
+                        else:
+                            item = hashed.get()     # Nothing to send until another file is hashed
+                    except Empty:
+                        item = False
+                    if item is None:
+                        hashing = False
+                    elif isinstance(item, Exception):
+                        raise item
+                    elif item:
+                        ready.append(item)
+                # Only open a file once there is a free slot to send it in
+                while ready and engine.pending() < max_concurrent:
+                    path, checksums = ready.popleft()
+                    f = open(path, 'rb')
+                    open_files.append(f)
+                    filename = os.path.basename(path)
+                    request = self._prepare_request(edit_media_iri,
+                                                    payload=f,
+                                                    filename=filename,
+                                                    mimetype=mimetype or get_content_type(filename),
+                                                    on_behalf_of=on_behalf_of,
+                                                    in_progress=in_progress,
+                                                    method="POST",
+                                                    metadata_relevant=metadata_relevant,
+                                                    request_type='EM_IRI POST (APPEND)',
+                                                    additional_headers=additional_headers,
+                                                    checksums=checksums)
+                    request['spools'].append(f)     # so that the engine closes it once it has been sent
+                    tickets[positions[path].pop(0)] = engine.submit_request(request)
+                if engine.pending():
+                    engine.step(timeout=0.05)
+            return [engine.result(tickets[index]) for index in range(len(paths))]
+        finally:
+            engine.close()
+            for f in open_files:
+                f.close()
+
     def append(self, 
                         se_iri = None,  
                         
@@ -1297,8 +1750,8 @@ and the correct IRI will automatically be chosen.
         else:
             conn_l.info("Deleting Resource via Edit-Media-IRI %s" % edit_media_iri)
 
-        return self.delete_resource(edit_media_iri,
-                                    on_behalf_of = on_behalf_of)
+        return self.delete(edit_media_iri,
+                           on_behalf_of = on_behalf_of)
 
 
 
@@ -1344,8 +1797,8 @@ and the correct IRI will automatically be chosen.
         else:
             conn_l.info("Deleting Container via Edit-IRI %s" % edit_iri)
 
-        return self.delete_resource(edit_iri,
-                                    on_behalf_of = on_behalf_of)
+        return self.delete(edit_iri,
+                           on_behalf_of = on_behalf_of)
             
     def complete_deposit(self,
                         se_iri = None,
@@ -1673,6 +2126,37 @@ response_headers, etc)
                                   request_type='Edit_IRI PUT',
                                   additional_headers=additional_headers)
 
+    def get_collection_feed(self, workspace=None, collection=None, col_iri=None):
+        """
+Listing the contents of a collection
+====================================
+
+The `sword2.collection.Collection_Feed` of the collection at `col_iri` (or titled `collection` in the workspace
+`workspace`), which reads the Atom feed at the Col-IRI page by page as it is iterated over, giving each entry as a
+deposit receipt of `self.receipt_class`. The same feed object is returned for the same Col-IRI each time, so that
+pages that have not changed since it was last read are revalidated from its page cache (by ETag or Last-Modified)
+rather than sent again.
+
+eg:
+    >>> for entry in conn.get_collection_feed(col_iri = "http://swordapp.org/col-iri/43").entries(conn.receipt_class):
+    ...     print entry.edit
+
+Response:
+
+A `sword2.collection.Collection_Feed`, or `None` if no Col-IRI was given and no collection could be found.
+        """
+        col_iri = self._find_col_iri(workspace, collection, col_iri)
+        if not col_iri:
+            conn_l.error("No suitable Col-IRI was found, with the given parameters.")
+            return
+        feed = self.collection_feeds.get(col_iri)
+        if feed is None:
+            headers = self._init_http_request_headers()
+            if self.on_behalf_of:
+                headers['On-Behalf-Of'] = self.on_behalf_of
+            feed = Collection_Feed(col_iri, http_client=self.h, curl_pool=self.curl_pool, headers=headers)
+            self.collection_feeds[col_iri] = feed
+        return feed
 
     def get_atom_sword_statement(self, sword_statement_iri):
         """
@@ -1694,11 +2178,133 @@ IN PROGRESS - USE AT OWN RISK.... see `sword2.Sword_Statement`.
             #    # Any error here is to do with the parsing
             #    return response.content
 
+    def _download_statement_page(self, page_iri, headers, curl_pool=None):
+        """GET one page of an Atom Sword Statement, without touching any other state of this connection (its
+        history, timers or receipt cache) - so that it can be run on a background thread. Unless a `curl_pool` is
+        given, the page is fetched over a cURL handle of its own.
+
+        Returns (response, content, seconds taken)."""
+        start = time()
+        resp, content = curl_request(self.h, page_iri, "GET", headers=headers, curl_pool=curl_pool)
+        return resp, content, time() - start
+
+    def _read_statement_page(self, page_iri, headers, downloaded):
+        """Record a page downloaded by `self._download_statement_page` in the transaction history, and parse it,
+        leaving its entries to be made as they are read. `None` if the server did not send the page (and exceptions
+        are turned off), or if what it sent could not be parsed."""
+        resp, content, took_time = downloaded
+        if self.history:
+            self.history.log('Sword Statement page GET',
+                             sd_iri = self.sd_iri,
+                             page_iri = page_iri,
+                             on_behalf_of = self.on_behalf_of,
+                             response = resp,
+                             headers = headers,
+                             process_duration = took_time)
+        if resp['status'] != '200':
+            conn_l.error("Could not GET the Sword Statement page at %s - response code %s" % (page_iri, resp['status']))
+            self._handle_error_response(resp, content)
+            return None
+        page = Sword_Statement(content, build_entries=False)
+        if not page.parsed:
+            conn_l.error("Could not parse the Sword Statement page at %s as an Atom feed" % page_iri)
+            return None
+        page.iri = page_iri
+        return page
+
+    def _statement_page_headers(self):
+        headers = self._init_http_request_headers()
+        if self.on_behalf_of:
+            headers['On-Behalf-Of'] = self.on_behalf_of
+        headers['Accept'] = 'application/atom+xml;type=feed'
+        return headers
+
+    def _fetch_in_background(self, fetch, *args):
+        """Start `fetch(*args)` on a background thread. Returns a `Queue` that the result (or the exception raised)
+        is put on."""
+        result = Queue(1)
+        def run():
+            try:
+                result.put(fetch(*args))
+            except Exception, e:
+                result.put(e)
+        fetcher = Thread(target=run)
+        fetcher.daemon = True
+        fetcher.start()
+        return result
+
+    def iter_statement_pages(self, sword_statement_iri, prefetch=True):
+        """
+Reading a long Atom Sword Statement, page by page
+=================================================
+
+A generator of the pages of the Atom Sword Statement at `sword_statement_iri` (each a `sword2.Sword_Statement`),
+following the rel="next" link of each page to the next. A page is only fetched once the one before it is reached.
+
+With `prefetch` (the default), the next page is fetched in a background thread while the current one is being read,
+so that the wait for each page overlaps with the work done on the one before. No more than two pages are held at a
+time, however long the statement. The background fetch uses a cURL handle of its own and leaves the connection alone,
+so the connection can be used as usual while the pages are being read; each page is entered in `self.history` when
+it is reached.
+
+The entries of each page are not made into `sword2.Deposit_Receipt`s until they are read with
+`page.iter_entries()` - see `self.iter_statement_entries`.
+
+eg:
+    >>> for page in conn.iter_statement_pages(dr.links['http://purl.org/net/sword/terms/statement'][0]['href']):
+    ...     print page.iri, page.next
+        """
+        headers = self._statement_page_headers()
+        page = self._read_statement_page(sword_statement_iri, headers,
+                                         self._download_statement_page(sword_statement_iri, headers, self.curl_pool))
+        seen = set([sword_statement_iri])
+        while page is not None:
+            next_iri = None
+            if page.next:
+                next_iri = urljoin(page.iri, page.next)
+                if next_iri in seen:
+                    conn_l.error("The Sword Statement page %s links back to %s - stopping" % (page.iri, next_iri))
+                    next_iri = None
+                else:
+                    seen.add(next_iri)
+            upcoming = None
+            if next_iri and prefetch:
+                upcoming = self._fetch_in_background(self._download_statement_page, next_iri, headers)
+            yield page
+            if not next_iri:
+                return
+            if upcoming is not None:
+                downloaded = upcoming.get()
+                if isinstance(downloaded, Exception):
+                    raise downloaded
+            else:
+                downloaded = self._download_statement_page(next_iri, headers, self.curl_pool)
+            page = self._read_statement_page(next_iri, headers, downloaded)
+
+    def iter_statement_entries(self, sword_statement_iri, prefetch=True):
+        """
+A generator of all the entries of the Atom Sword Statement at `sword_statement_iri`, over all its pages (see
+`self.iter_statement_pages`), as deposit receipts - of `self.receipt_class`, and kept and parsed as the
+`keep_receipt_dom` and `lazy_receipts` settings of this `Connection` say.
+
+eg:
+    >>> for entry in conn.iter_statement_entries(statement_iri):
+    ...     print entry.cont_iri
+        """
+        for page in self.iter_statement_pages(sword_statement_iri, prefetch=prefetch):
+            for entry in page.iter_entries(self.receipt_class, keep_dom=self.keep_receipt_dom,
+                                           lazy=self.lazy_receipts):
+                yield entry
+
     def get_resource(self, content_iri = None, 
                            packaging=None, 
                            on_behalf_of=None, 
                            headers = {},
-                           dr = None):
+                           dr = None,
+                           sink = None,
+                           chunk_callback = None,
+                           resume = False,
+                           segments = 1):
         """
 Retrieving the content
 
@@ -1724,12 +2330,45 @@ Set `content_iri` to be the Content-IRI for a given resource (or to the IRI of a
 you can pass back the `sword2.Deposit_Receipt` object you got from a previous transaction as the `dr` parameter, 
 and the correct IRI will automatically be chosen.
 
+Streaming the content:
+----------------------
+
+By default, the whole file or package is held in memory. To write it out as it arrives instead, set `sink` to
+either a file path or a writable file-like object. A path is only opened (and overwritten) once the server has
+responded successfully.
+
+`chunk_callback` can be set to a callable that is called as `chunk_callback(chunk, bytes_received)` for every chunk
+of the body as it is written to the sink (eg to show progress or to update a checksum.)
+
+>>> cw = conn.get_resource(dr = receipt, sink = "/tmp/package.zip")
+>>> cw.path, cw.size
+('/tmp/package.zip', 1048576)
+
+Ranged downloads:
+-----------------
+
+When `sink` is a file path, two further options use HTTP Range requests:
+
+`resume = True` -- if an earlier download to the same path was interrupted, only the rest of the resource is
+requested. The ETag (or Last-Modified date) of the resource is kept in a file alongside the partial download, and
+sent back as If-Range, so that if the resource has changed since, the whole of the new version is downloaded instead.
+
+`segments = n` -- the resource is downloaded as up to n byte ranges in parallel, which can make better use of a
+long or lossy link. Servers that do not support ranges simply send the whole resource in the first response.
+
+>>> cw = conn.get_resource(dr = receipt, sink = "/tmp/package.zip", resume = True)
+
+In both cases, `ContentWrapper.code` is 206 if only a part of the resource was requested, and `ContentWrapper.size`
+is the size of the complete file.
+
 Response:
     
     A `ContentWrapper` - 
         `ContentWrapper.response_headers`    -- response headers
-        `ContentWrapper.content` -- body of response from server (the file or package)
+        `ContentWrapper.content` -- body of response from server (the file or package), or `None` if a `sink` was given
         `ContentWrapper.code`    -- status code ('200' on success.)
+        `ContentWrapper.size`    -- number of bytes in the body
+        `ContentWrapper.path`    -- the file the body was written to, if a `sink` was given and its path is known
 
         """
                 
@@ -1754,9 +2393,9 @@ Response:
         if self.honour_receipts and packaging:
             # Make sure that the packaging format is available from the deposit receipt, if loaded
             conn_l.debug("Checking that the packaging format '%s' is available." % content_iri)
-            conn_l.debug("Cached Cont-IRI Receipts: %s" % self.cont_iris.keys())
-            if content_iri in self.cont_iris.keys():
-                if not (packaging in self.cont_iris[content_iri].packaging):
+            receipt = self.receipts.get_by_cont_iri(content_iri)
+            if receipt is not None:
+                if not (packaging in receipt.packaging):
                     conn_l.error("Desired packaging format '%' not available from the server, according to the deposit receipt. Change the client parameter 'honour_receipts' to False to avoid this check.")
                     return self._return_error_or_exception(PackagingFormatNotAvailable, {}, "")
         if on_behalf_of:
@@ -1771,7 +2410,20 @@ Response:
             conn_l.info("IRI GET resource '%s' with Accept-Packaging:%s" % (content_iri, packaging))
         else:
             conn_l.info("IRI GET resource '%s'" % content_iri)
-        resp, content = curl_request(self.h, content_iri, "GET", headers=headers)
+        response_sink = None
+        if (resume or segments > 1) and not isinstance(sink, basestring):
+            raise ValueError("Resumed or segmented downloads need `sink` to be a file path")
+        if segments > 1:
+            resp, content, size = fetch_segments(self.h, content_iri, sink, headers, segments,
+                                                 curl_pool=self.curl_pool, chunk_callback=chunk_callback)
+        elif resume:
+            resp, content, size = fetch_resumable(self.h, content_iri, sink, headers,
+                                                  curl_pool=self.curl_pool, chunk_callback=chunk_callback)
+        else:
+            if sink is not None:
+                response_sink = Response_Sink(sink, chunk_callback)
+            resp, content = curl_request(self.h, content_iri, "GET", headers=headers, curl_pool=self.curl_pool,
+                                         response_sink=response_sink)
         _, took_time = self._t.time_since_start("IRI GET resource")
         if self.history:
             self.history.log('Cont_IRI GET resource', 
@@ -1784,13 +2436,17 @@ Response:
                              process_duration = took_time)
         conn_l.info("Server response: %s" % resp['status'])
         conn_l.debug(resp)
-        if resp['status'] == '200':
+        if resp['status'] == '200' or (resp['status'] == '206' and (resume or segments > 1)):
+            if resume or segments > 1:
+                conn_l.debug("Cont_IRI GET resource successful - %s holds all %s bytes from %s" % (sink, size,
+                                                                                                  content_iri))
+                return ContentWrapper(resp, None, size=size, path=sink)
+            if response_sink is not None:
+                conn_l.debug("Cont_IRI GET resource successful - wrote %s bytes from %s to %s" % (response_sink.size,
+                                                                                                  content_iri,
+                                                                                                  response_sink.path))
+                return ContentWrapper(resp, None, size=response_sink.size, path=response_sink.path)
             conn_l.debug("Cont_IRI GET resource successful - got %s bytes from %s" % (len(content), content_iri))
-            class ContentWrapper(object):
-                def __init__(self, resp, content):
-                    self.response_headers = dict(resp)
-                    self.content = content
-                    self.code = resp.status
             return ContentWrapper(resp, content)
         elif resp['status'] == '408':   # Unavailable packaging format 
             conn_l.error("Desired packaging format '%' not available from the server.")
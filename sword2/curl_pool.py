@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Provides `Curl_Pool`, a per-host pool of reusable `pycurl.Curl` handles.
+
+libcurl keeps the underlying TCP (and TLS) connection of a handle open after a transfer has finished, so
+reusing the same handle for the next request to the same host avoids a fresh handshake. The pool keeps a
+small stack of idle handles for each scheme/host/port, resets them as they are returned (so that an idle handle
+holds on to nothing from its last request) and closes those that have been idle for too long.
+
+Usage:
+
+>>> from sword2.curl_pool import Curl_Pool
+>>> pool = Curl_Pool(max_size=4, idle_timeout=60)
+>>> curl = pool.acquire("http://example.org/sd-uri")
+... perform a request with `curl` ...
+>>> pool.release("http://example.org/sd-uri", curl)
+
+# Close every idle handle (and their connections)
+>>> pool.close()
+"""
+
+from sword2_logging import logging
+pool_l = logging.getLogger(__name__)
+
+from time import time
+from urlparse import urlsplit
+
+import threading
+
+DEFAULT_MAX_SIZE = 8        # idle handles kept per host
+DEFAULT_IDLE_TIMEOUT = 60   # seconds an idle handle is kept before it is closed
+
+def host_key(uri):
+    """Reduce an IRI to the (scheme, host, port) tuple that identifies its connection."""
+    parts = urlsplit(str(uri))
+    scheme = parts.scheme.lower()
+    port = parts.port
+    if port is None:
+        port = {'http': 80, 'https': 443}.get(scheme)
+    return (scheme, (parts.hostname or "").lower(), port)
+
+class Curl_Pool(object):
+    """Keeps idle `pycurl.Curl` handles, grouped by the host they last talked to.
+
+    max_size        -- maximum number of idle handles kept for any single host. Handles released when the
+                       host's stack is full are closed.
+    idle_timeout    -- handles that have been idle for longer than this (in seconds) are closed rather than
+                       reused. `None` keeps them indefinitely.
+
+    The pool is safe to share between threads; a handle is only ever held by one caller at a time.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = {}         # Key = host_key(), Value = list of (last used timestamp, handle), newest last
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def _new_handle(self):
+        import pycurl
+        self.created += 1
+        return pycurl.Curl()
+
+    def acquire(self, uri):
+        """Get a handle for a request to `uri`, reusing an idle one for the same host if there is one.
+
+        Idle handles were `reset()` when they were released, so no options from a previous request carry over.
+        The connection cache of the handle survives the reset."""
+        key = host_key(uri)
+        now = time()
+        stale = []
+        curl = None
+        self._lock.acquire()
+        try:
+            stack = self._idle.get(key, [])
+            while stack:
+                last_used, candidate = stack.pop()
+                if self.idle_timeout is not None and now - last_used > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    curl = candidate
+                    break
+            if curl is not None:
+                self.reused += 1
+        finally:
+            self._lock.release()
+        self._close_handles(stale)
+        if curl is None:
+            pool_l.debug("No idle cURL handle for %s://%s:%s - creating a new one" % key)
+            return self._new_handle()
+        return curl
+
+    def release(self, uri, curl):
+        """Return a handle to the pool once its request has completed (successfully or not).
+
+        The handle is `reset()` straight away, which drops its callbacks - and with them the response body and
+        headers (or the sink) of the request - rather than keeping them alive while it is idle. Any handles that
+        have been idle for too long are closed at the same time."""
+        key = host_key(uri)
+        try:
+            curl.reset()
+        except Exception, e:
+            pool_l.debug("Could not reset a cURL handle - closing it instead - %s" % e)
+            self._close_handles([curl])
+            self.evict_idle()
+            return
+        self.evict_idle()
+        self._lock.acquire()
+        try:
+            stack = self._idle.setdefault(key, [])
+            if len(stack) < self.max_size:
+                stack.append((time(), curl))
+                curl = None
+        finally:
+            self._lock.release()
+        if curl is not None:
+            self._close_handles([curl])
+
+    def discard(self, curl):
+        """Close a handle that should not be reused, for example after a transfer error."""
+        self._close_handles([curl])
+
+    def evict_idle(self):
+        """Close all handles that have been idle for longer than `self.idle_timeout`."""
+        if self.idle_timeout is None:
+            return
+        now = time()
+        stale = []
+        self._lock.acquire()
+        try:
+            for key, stack in self._idle.items():
+                fresh = []
+                for last_used, curl in stack:
+                    if now - last_used > self.idle_timeout:
+                        stale.append(curl)
+                    else:
+                        fresh.append((last_used, curl))
+                if fresh:
+                    self._idle[key] = fresh
+                else:
+                    del self._idle[key]
+        finally:
+            self._lock.release()
+        self._close_handles(stale)
+
+    def close(self):
+        """Close every idle handle held by the pool."""
+        self._lock.acquire()
+        try:
+            handles = [curl for stack in self._idle.values() for _, curl in stack]
+            self._idle = {}
+        finally:
+            self._lock.release()
+        self._close_handles(handles)
+
+    def idle_count(self, uri=None):
+        """Number of idle handles, either for the host of `uri` or in total."""
+        self._lock.acquire()
+        try:
+            if uri is not None:
+                return len(self._idle.get(host_key(uri), []))
+            return sum([len(stack) for stack in self._idle.values()])
+        finally:
+            self._lock.release()
+
+    def _close_handles(self, handles):
+        for curl in handles:
+            self.evicted += 1
+            try:
+                curl.close()
+            except Exception, e:
+                pool_l.debug("Error closing a cURL handle - %s" % e)
+
+    def __len__(self):
+        return self.idle_count()
@@ -13,16 +13,64 @@ See Section 10. Deposit Receipt: http://sword-app.svn.sourceforge.net/viewvc/swo
 from sword2_logging import logging
 d_l = logging.getLogger(__name__)
 
-from atom_objects import Category
+from atom_objects import Category, Compact_Category
 
 from compatible_libs import etree
 from utils import NS, get_text
 
-NS = dict(NS)
-NS['sword'] = "{http://purl.org/net/sword/}%s"
+# Namespace URI -> prefix used in the field names of `Deposit_Receipt.metadata` (eg 'dcterms_title'). Elements in the
+# SWORD 1.3 namespace, which some servers still use in their receipts and error documents, are read as 'sword' too.
+PREFIXES = dict([(template[1:template.index("}")], prefix) for prefix, template in NS.iteritems()])
+PREFIXES["http://purl.org/net/sword/"] = "sword"
 
-class Deposit_Receipt(object):
-    def __init__(self, xml_deposit_receipt=None, dom=None, response_headers={}, location=None, code=0):
+def _attribute_handler(field, attribute):
+    """A `Deposit_Receipt.HANDLERS` entry that sets `attribute` to the text of the element and keeps it in the
+    metadata as `field`."""
+    attribute = "_" + attribute     # (only ever used while parsing, so straight to the attribute behind the property)
+    def handler(self, e):
+        setattr(self, attribute, e.text)
+        self._add_metadata(field, e.text)
+    return handler
+
+# Attributes of a lazy receipt (see `Deposit_Receipt`) that are only read from its XML when one of them is first used
+LAZY_FIELDS = ('metadata', 'categories', 'packaging', 'treatment', 'title', 'id', 'updated', 'summary')
+
+def _lazy_attribute(name):
+    """A property for one of the `LAZY_FIELDS`, kept as '_' + `name`, which finishes parsing a lazy receipt before
+    it is read or set."""
+    private = "_" + name
+    def get(self):
+        if self._pending is not None:
+            self._parse_pending()
+        return getattr(self, private)
+    def set(self, value):
+        if self._pending is not None:
+            self._parse_pending()
+        setattr(self, private, value)
+    return property(get, set)
+
+def _native(value):
+    """Values decoded from JSON are all `unicode`: give back ASCII ones as `str`, as they would be from the XML."""
+    if isinstance(value, unicode):
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+    if isinstance(value, list):
+        return [_native(v) for v in value]
+    if isinstance(value, dict):
+        return dict([(_native(k), _native(v)) for k, v in value.iteritems()])
+    return value
+
+class Deposit_Receipt_Mixin(object):
+    """The behaviour shared by `Deposit_Receipt` and `Compact_Deposit_Receipt`."""
+    __slots__ = ()
+
+    # Class used for the atom:category elements of the receipt
+    category_class = Category
+
+    def __init__(self, xml_deposit_receipt=None, dom=None, response_headers={}, location=None, code=0, keep_dom=True,
+                 lazy=False):
         """
 `Deposit_Receipt` - provides convenience methods for extracting information from the Deposit Receipts sent back by the 
 SWORD2-compliant server for many transactions.
@@ -100,13 +148,24 @@ Availible attributes:
     `self.response_headers` -- The HTTP response headers that accompanied this receipt
     
     `self.location`         -- The location, if given (from HTTP Header: "Location: ....")
+
+    `self.dom`              -- The parsed receipt (an `etree.Element`), unless `keep_dom` is `False`, in which case it is
+                                dropped once the attributes above have been read from it (and `to_xml` is no longer
+                                possible).
+
+With `lazy` True, only the <atom:link> and <atom:content> elements are read when the receipt is made - which is all
+that the IRI attributes above (and `sword2.receipt_cache`) need. The rest of the XML is read the first time any of
+`metadata`, `categories`, `packaging`, `treatment`, `title`, `id`, `updated` or `summary` is used, so a receipt that is
+only checked for its `code` and `edit` IRI costs little more than parsing the XML. A lazy receipt keeps its `dom` until
+then, even if `keep_dom` is `False`.
     """
+        self._pending = None
         self.parsed = False
         self.response_headers=response_headers
         self.location = location
         self.content = None
         self.code = code
-        self.metadata = {}
+        self._metadata = {}
         self.links = {}
         self.edit = None
         self.edit_media = None
@@ -114,14 +173,14 @@ Availible attributes:
         self.alternate = None
         self.se_iri = None 
         # Atom convenience attribs
-        self.title = None
-        self.id = None
-        self.updated = None
-        self.summary = None
+        self._title = None
+        self._id = None
+        self._updated = None
+        self._summary = None
         
-        self.packaging = []
-        self.treatment = None
-        self.categories = []
+        self._packaging = []
+        self._treatment = None
+        self._categories = []
         self.content = {}
         self.cont_iri = None
         
@@ -132,55 +191,93 @@ Availible attributes:
             except Exception, e:
                 d_l.error("Was not able to parse the deposit receipt as XML.")
                 return
-            self.handle_metadata()
         elif dom != None:
             self.dom = dom
             self.parsed = True
+        else:
+            return
+        if lazy:
+            self.handle_links()
+            self._pending = keep_dom
+        else:
             self.handle_metadata()
-    
-    def handle_metadata(self):
-        """Method that walks the `etree.SubElement`, assigning the information to the objects attributes."""
-        for e in self.dom.getchildren():
-            for nmsp, prefix in NS.iteritems():
-                if str(e.tag).startswith(prefix % ""):
-                    _, tagname = e.tag.rsplit("}", 1)
-                    field = "%s_%s" % (nmsp, tagname)
-                    d_l.debug("Attempting to intepret field: '%s'" % field)
-                    if field == "atom_link":
-                        self.handle_link(e)
-                    elif field == "atom_content":
-                        self.handle_content(e)
-                    elif field == "atom_generator":
-                        for ak,av in e.attrib.iteritems():
-                            if not e.text:
-                                e.text = ""
-                            e.text += " %s:\"%s\"" % (ak, av)
-                        self.metadata[field] = e.text.strip()
-                    elif field == "sword_packaging":
-                        self.packaging.append(e.text)
-                    elif field == "sword_treatment":
-                        # Special case since the sword:treatment might contain child tags
-                        body = etree.tounicode(e, with_tail=False)
-                        self.treatment = body[body.find('>')+1:body.rfind('<')]
-                    else:
-                        if field == "atom_title":
-                            self.title = e.text
-                        if field == "atom_id":
-                            self.id = e.text
-                        if field == "atom_updated":
-                            self.updated = e.text
-                        if field == "atom_summary":
-                            self.summary = e.text
-                        if field == "atom_category":
-                            self.categories.append(Category(dom=e))
-                        if self.metadata.has_key(field):
-                            if isinstance(self.metadata[field], list):
-                                self.metadata[field].append(e.text)
-                            else:
-                                self.metadata[field] = [self.metadata[field], e.text]
-                        else:
-                            self.metadata[field] = e.text
-                    
+            if not keep_dom:
+                self._drop_dom()
+
+    def _parse_pending(self):
+        """Read the elements of a lazy receipt that `handle_links` left."""
+        keep_dom = self._pending
+        self._pending = None
+        self.handle_metadata(skip=self.EAGER_FIELDS)
+        if not keep_dom:
+            self._drop_dom()
+
+    def _drop_dom(self):
+        self.dom = None
+        for c in self._categories:
+            c.dom = None
+
+    def handle_metadata(self, skip=()):
+        """Method that walks the `etree.SubElement`, assigning the information to the objects attributes.
+        
+        Each child is classified by a single lookup of its namespace in `PREFIXES`, and of the resulting field name
+        (eg 'atom_link') in `self.HANDLERS`; anything without a handler of its own is kept in `self.metadata`.
+        Fields in `skip` are passed over."""
+        handlers = self.HANDLERS
+        for e in self.dom:
+            tag = e.tag
+            if not isinstance(tag, basestring) or tag[:1] != "{":
+                continue    # comments, processing instructions and elements in no namespace
+            uri, tagname = tag[1:].split("}", 1)
+            prefix = PREFIXES.get(uri)
+            if prefix is None:
+                continue
+            field = prefix + "_" + tagname
+            if skip and field in skip:
+                continue
+            handler = handlers.get(field)
+            if handler is None:
+                self._add_metadata(field, e.text)
+            else:
+                handler(self, e)
+
+    def handle_links(self):
+        """Read only the <atom:link> and <atom:content> elements (the `EAGER_FIELDS`) - the first step of parsing a
+        lazy receipt."""
+        for e in self.dom.findall(NS['atom'] % "link"):
+            self.handle_link(e)
+        for e in self.dom.findall(NS['atom'] % "content"):
+            self.handle_content(e)
+
+    def _add_metadata(self, field, value):
+        metadata = self._metadata
+        if field in metadata:
+            if isinstance(metadata[field], list):
+                metadata[field].append(value)
+            else:
+                metadata[field] = [metadata[field], value]
+        else:
+            metadata[field] = value
+
+    def _handle_generator(self, e):
+        for ak,av in e.attrib.iteritems():
+            if not e.text:
+                e.text = ""
+            e.text += " %s:\"%s\"" % (ak, av)
+        self._metadata["atom_generator"] = e.text.strip()
+
+    def _handle_packaging(self, e):
+        self._packaging.append(e.text)
+
+    def _handle_treatment(self, e):
+        # Special case since the sword:treatment might contain child tags
+        body = etree.tounicode(e, with_tail=False)
+        self._treatment = body[body.find('>')+1:body.rfind('<')]
+
+    def _handle_category(self, e):
+        self._categories.append(self.category_class(dom=e))
+        self._add_metadata("atom_category", e.text)
+
     def handle_link(self, e):
         """Method that handles the intepreting of <atom:link> element information and placing it into the anticipated attributes."""
         # MUST have rel
@@ -220,6 +317,62 @@ Availible attributes:
             self.content[src] = info
             self.cont_iri = src
             
+    # Field name -> method that interprets it. atom:title, id, updated and summary are set as attributes as well as
+    # being kept in `self.metadata`.
+    HANDLERS = {'atom_link':handle_link,
+                'atom_content':handle_content,
+                'atom_generator':_handle_generator,
+                'atom_category':_handle_category,
+                'sword_packaging':_handle_packaging,
+                'sword_treatment':_handle_treatment,
+                'atom_title':_attribute_handler('atom_title', 'title'),
+                'atom_id':_attribute_handler('atom_id', 'id'),
+                'atom_updated':_attribute_handler('atom_updated', 'updated'),
+                'atom_summary':_attribute_handler('atom_summary', 'summary')}
+
+    # Fields read by `handle_links`, straight away, when a receipt is lazy
+    EAGER_FIELDS = ('atom_link', 'atom_content')
+
+    metadata = _lazy_attribute('metadata')
+    categories = _lazy_attribute('categories')
+    packaging = _lazy_attribute('packaging')
+    treatment = _lazy_attribute('treatment')
+    title = _lazy_attribute('title')
+    id = _lazy_attribute('id')
+    updated = _lazy_attribute('updated')
+    summary = _lazy_attribute('summary')
+
+    # Attributes kept in a record of the receipt, as made by `to_record`
+    RECORD_FIELDS = ['parsed', 'code', 'location', 'response_headers', 'metadata', 'links', 'edit', 'edit_media',
+                     'edit_media_feed', 'alternate', 'se_iri', 'title', 'id', 'updated', 'summary', 'packaging',
+                     'treatment', 'content', 'cont_iri']
+
+    def to_record(self):
+        """The information in this receipt as a `dict` of plain values (suitable for JSON), leaving out anything
+        that is empty. The XML itself is not kept - see `from_record`."""
+        record = {}
+        for field in self.RECORD_FIELDS:
+            value = getattr(self, field)
+            if value:
+                record[field] = value
+        if self.categories:
+            record['categories'] = [dict([(k, v) for k, v in (('term', c.term), ('scheme', c.scheme),
+                                                              ('label', c.label), ('text', c.text)) if v is not None])
+                                    for c in self.categories]
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """A `Deposit_Receipt` made from a record produced by `to_record`, without parsing any XML. It has no `dom`
+        and so cannot be turned back into XML with `to_xml`."""
+        d = cls()
+        for field in cls.RECORD_FIELDS:
+            if field in record:
+                setattr(d, field, _native(record[field]))
+        d.categories = [cls.category_class(**dict([(str(k), v) for k, v in _native(c).iteritems()]))
+                        for c in record.get('categories', [])]
+        return d
+
     def to_xml(self):
         """Convenience method for outputing the DOM as a (byte)string."""
         return etree.tostring(self.dom)
@@ -249,3 +402,16 @@ Availible attributes:
         for k, v in self.links.iteritems():
             _s.append("Link rel:'%s' -- %s" % (k, v))
         return "\n".join(_s)
+
+class Deposit_Receipt(Deposit_Receipt_Mixin):
+    pass
+
+class Compact_Deposit_Receipt(Deposit_Receipt_Mixin):
+    """A `Deposit_Receipt` that keeps its attributes in `__slots__` rather than an instance `__dict__`, and its
+    categories as `Compact_Category`s - for holding very many receipts, eg in a `sword2.receipt_cache.Receipt_Cache`.
+
+    It has the same attributes as a `Deposit_Receipt`, but no others can be set on it. Pass `keep_dom=False` to drop
+    the parsed XML as well, once the attributes have been read from it."""
+    __slots__ = (tuple([f for f in Deposit_Receipt_Mixin.RECORD_FIELDS if f not in LAZY_FIELDS]) +
+                 tuple(["_" + f for f in LAZY_FIELDS]) + ('dom', '_pending'))
+    category_class = Compact_Category
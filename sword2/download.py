@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ranged downloads of a resource to a local file, used by `sword2.Connection.get_resource`.
+
+`fetch_resumable` continues an interrupted download from the size of the partial file, using an HTTP Range request.
+The ETag (or Last-Modified date) of the resource is kept next to the partial file, in a file with the suffix
+`VALIDATOR_SUFFIX`, and sent back as If-Range. If the resource has changed since, the server sends the whole of the
+new version and the partial file is replaced.
+
+`fetch_segments` downloads a single resource as several byte ranges at once over a `pycurl.CurlMulti` handle, each
+range being written straight to its place in the file.
+
+Usage:
+
+>>> from sword2.download import fetch_resumable
+>>> resp, content, size = fetch_resumable(conn.h, "http://example.org/cont-iri/1", "/tmp/package.zip")
+
+(In practice, use `conn.get_resource(..., sink="/tmp/package.zip", resume=True)` or `segments=4`.)
+"""
+
+from sword2_logging import logging
+dl_l = logging.getLogger(__name__)
+
+from utils import Response_Sink, setup_curl, get_credentials, curl_request
+
+import os
+
+VALIDATOR_SUFFIX = ".sword2-validator"
+
+# Ranges smaller than this are not worth a connection of their own
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+def validator_path(path):
+    return path + VALIDATOR_SUFFIX
+
+def read_validator(path):
+    """The ETag or Last-Modified date recorded for a partial download at `path`, or `None`."""
+    try:
+        f = open(validator_path(path))
+        try:
+            return f.read().strip() or None
+        finally:
+            f.close()
+    except IOError:
+        return None
+
+def write_validator(path, validator):
+    f = open(validator_path(path), 'w')
+    try:
+        f.write(validator)
+    finally:
+        f.close()
+
+def clear_validator(path):
+    if os.path.exists(validator_path(path)):
+        os.remove(validator_path(path))
+
+def response_validator(headers):
+    """The value to send as If-Range to resume a download of the response with the given (lowercased) headers:
+    its ETag, unless that is weak (which If-Range does not allow), or else its Last-Modified date."""
+    etag = headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('last-modified')
+
+def parse_content_range(value):
+    """Parses a Content-Range header value such as 'bytes 0-1023/4096' into (first, last, total). `total` is
+    `None` if the server gave it as '*'. Returns `None` if the value cannot be parsed."""
+    try:
+        unit, spec = value.split(None, 1)
+        span, total = spec.split('/', 1)
+        first, last = span.split('-', 1)
+        if total.strip() == '*':
+            total = None
+        else:
+            total = int(total)
+        return int(first), int(last), total
+    except (ValueError, AttributeError):
+        return None
+
+class Resumable_Sink(Response_Sink):
+    """A `Response_Sink` for a file path that may already hold the first `offset` bytes of the resource.
+
+    A '206 Partial Content' response is written from the start of its range; any other successful response replaces
+    the file. The validator of the response is recorded alongside the file as soon as its body starts to arrive."""
+    def __init__(self, path, chunk_callback=None, offset=0):
+        Response_Sink.__init__(self, path, chunk_callback)
+        self.offset = offset
+
+    def _open(self):
+        if self._file is None:
+            content_range = None
+            if self.status == 206:
+                content_range = parse_content_range(self.response_headers.get('content-range'))
+            if content_range is not None and content_range[0] > 0:
+                self.offset = content_range[0]
+                self._file = open(self.path, 'r+b')
+                self._file.seek(self.offset)
+                self._file.truncate()
+            else:
+                self.offset = 0
+                self._file = open(self.path, 'wb')
+            validator = response_validator(self.response_headers)
+            if validator:
+                write_validator(self.path, validator)
+            else:
+                clear_validator(self.path)
+        return self._file
+
+class Segment_Sink(Response_Sink):
+    """Writes the byte range `first`-`last` of a resource into its place in an existing file at `path`.
+
+    Only a '206 Partial Content' response for exactly that range is accepted. Any other successful response (eg
+    the whole resource, because it has changed since the If-Range validator was taken) aborts the transfer."""
+    def __init__(self, path, first, last, chunk_callback=None):
+        Response_Sink.__init__(self, path, chunk_callback)
+        self.first = first
+        self.last = last
+
+    def _successful(self):
+        if self.status != 206:
+            return False
+        content_range = parse_content_range(self.response_headers.get('content-range'))
+        return content_range is not None and content_range[:2] == (self.first, self.last)
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'r+b')
+            self._file.seek(self.first)
+        return self._file
+
+    def write(self, chunk):
+        if self.status is not None and 200 <= self.status < 300 and not self._successful():
+            return 0     # Tells cURL to abort the transfer
+        return Response_Sink.write(self, chunk)
+
+    def complete(self):
+        return self._successful() and self.size == self.last - self.first + 1
+
+def fetch_resumable(http_object, uri, path, headers=None, curl_pool=None, chunk_callback=None):
+    """GET `uri` into the file at `path`, continuing from the end of the file if it holds part of an earlier download
+    of the same version of the resource.
+
+    Returns (response, content, size) - `content` is only the body of an unsuccessful response, and `size` is the
+    size of the file on success."""
+    validator = read_validator(path)
+    offset = 0
+    if validator and os.path.exists(path):
+        offset = os.path.getsize(path)
+    request_headers = dict(headers or {})
+    if offset:
+        dl_l.info("Resuming the download of %s to %s from byte %s" % (uri, path, offset))
+        request_headers['Range'] = 'bytes=%s-' % offset
+        request_headers['If-Range'] = validator
+    sink = Resumable_Sink(path, chunk_callback, offset)
+    resp, content = curl_request(http_object, uri, "GET", headers=request_headers, curl_pool=curl_pool,
+                                 response_sink=sink)
+    if resp.status == 416 and offset:
+        # The partial file does not fit the resource any more - start again
+        dl_l.info("Range not satisfiable for %s - downloading it again from the start" % uri)
+        clear_validator(path)
+        return fetch_resumable(http_object, uri, path, headers, curl_pool, chunk_callback)
+    if 200 <= resp.status < 300:
+        clear_validator(path)
+        return resp, content, sink.offset + sink.size
+    return resp, content, None
+
+def fetch_segments(http_object, uri, path, headers=None, segments=4, curl_pool=None, chunk_callback=None,
+                   min_segment_size=MIN_SEGMENT_SIZE):
+    """GET `uri` into the file at `path` as up to `segments` byte ranges in parallel.
+
+    The first `min_segment_size` bytes are fetched on their own, to learn the size and validator of the resource.
+    If the server does not support ranges, that first request returns the whole resource and nothing more is
+    needed. Should any of the parallel ranges fail, the rest of the download falls back to `fetch_resumable`.
+
+    Returns (response, content, size), as `fetch_resumable` does."""
+    import pycurl
+
+    headers = dict(headers or {})
+    probe_headers = dict(headers)
+    probe_headers['Range'] = 'bytes=0-%s' % (min_segment_size - 1)
+    clear_validator(path)
+    probe = Resumable_Sink(path, chunk_callback)
+    resp, content = curl_request(http_object, uri, "GET", headers=probe_headers, curl_pool=curl_pool,
+                                 response_sink=probe)
+    if resp.status != 206:
+        if 200 <= resp.status < 300:
+            clear_validator(path)
+            return resp, content, probe.size
+        return resp, content, None
+    content_range = parse_content_range(resp.get('content-range'))
+    validator = read_validator(path)
+    if content_range is None or content_range[2] is None or not validator:
+        # The rest cannot be safely fetched in pieces
+        return fetch_resumable(http_object, uri, path, headers, curl_pool, chunk_callback)
+    total = content_range[2]
+    received = probe.size
+    if received >= total:
+        clear_validator(path)
+        return resp, content, total
+
+    remaining = total - received
+    count = max(1, min(segments, remaining // min_segment_size))
+    step = (remaining + count - 1) // count
+    f = open(path, 'r+b')
+    try:
+        f.truncate(total)
+    finally:
+        f.close()
+
+    progress = [received]
+    def segment_progress(chunk, bytes_received):
+        progress[0] += len(chunk)
+        if chunk_callback is not None:
+            chunk_callback(chunk, progress[0])
+
+    dl_l.info("Downloading %s bytes of %s as %s ranges" % (remaining, uri, count))
+    credentials = get_credentials(http_object, uri)
+    multi = pycurl.CurlMulti()
+    active = {}
+    for first in xrange(received, total, step):
+        last = min(first + step, total) - 1
+        if curl_pool is not None:
+            curl = curl_pool.acquire(uri)
+        else:
+            curl = pycurl.Curl()
+        range_headers = dict(headers)
+        range_headers['Range'] = 'bytes=%s-%s' % (first, last)
+        range_headers['If-Range'] = validator
+        sink = Segment_Sink(path, first, last, segment_progress)
+        setup_curl(curl, uri, "GET", headers=range_headers, credentials=credentials, response_sink=sink)
+        active[curl] = sink
+        multi.add_handle(curl)
+
+    failed = False
+    try:
+        while active:
+            while True:
+                ret, _ = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            while True:
+                remaining_messages, succeeded, errors = multi.info_read()
+                finished = [(curl, None) for curl in succeeded] + [(curl, errmsg) for curl, errno, errmsg in errors]
+                for curl, error in finished:
+                    sink = active.pop(curl)
+                    multi.remove_handle(curl)
+                    sink.close()
+                    if error is None and sink.complete():
+                        if curl_pool is not None:
+                            curl_pool.release(uri, curl)
+                        else:
+                            curl.close()
+                    else:
+                        dl_l.warn("Range %s-%s of %s failed - %s" % (sink.first, sink.last, uri,
+                                                                     error or "status %s" % sink.status))
+                        failed = True
+                        if curl_pool is not None:
+                            curl_pool.discard(curl)
+                        else:
+                            curl.close()
+                if not remaining_messages:
+                    break
+            if active:
+                multi.select(1.0)
+    finally:
+        for curl in active.keys():
+            multi.remove_handle(curl)
+            active[curl].close()
+            curl.close()
+        multi.close()
+
+    if failed:
+        # Keep what the first request fetched and get the rest in one go
+        f = open(path, 'r+b')
+        try:
+            f.truncate(received)
+        finally:
+            f.close()
+        return fetch_resumable(http_object, uri, path, headers, curl_pool, chunk_callback)
+    clear_validator(path)
+    return resp, content, total
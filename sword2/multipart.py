@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Provides `Multipart_Related`, a streaming writer for multipart/related request bodies.
+
+Unlike `sword2.utils.create_multipart_related`, which builds the whole MIME message in memory, `Multipart_Related`
+works out the exact length of the message from the part headers and payload sizes up front and only produces the
+boundaries, headers and payload data as they are read. File-like payloads are read from disc in chunks (or, when
+they are regular files sent without base64 encoding, straight out of a memory map of the file), so the memory used
+does not depend on the size of the package being deposited.
+
+Usage:
+
+>>> from sword2.multipart import Multipart_Related
+>>> body = Multipart_Related([{'key':'atom',
+...                            'type':'application/atom+xml; charset="utf-8"',
+...                            'data':str(entry)},
+...                           {'key':'payload',
+...                            'type':'application/zip',
+...                            'filename':'package.zip',
+...                            'data':open('package.zip', 'rb'),
+...                            'headers':{'Content-MD5':md5sum,
+...                                       'Packaging':'http://purl.org/net/sword/package/SimpleZip'}}])
+>>> body.content_type
+'multipart/related; boundary="===============1306321305838426128=="'
+>>> len(body)        # Content-Length of the whole message
+1234567
+
+# Read it like a file (which is how it is handed to cURL)...
+>>> chunk = body.read(16384)
+
+# ... or iterate over its chunks:
+>>> for chunk in body:
+...     sock.sendall(chunk)
+
+# ... or, for 'binary' parts of files on disc, over zero-copy buffers of the mapped file:
+>>> for chunk in body.buffers():
+...     sock.sendall(chunk)
+>>> body.close()
+"""
+
+from sword2_logging import logging
+mp_l = logging.getLogger(__name__)
+
+from utils import get_content_type, map_file
+
+from binascii import b2a_base64
+from bisect import bisect_right
+from random import randrange
+import os
+import io
+
+CRLF = "\r\n"
+
+# base64 is written out in lines of 76 characters, each encoding 57 bytes
+B64_LINE_BYTES = 57
+READ_SIZE = B64_LINE_BYTES * 16384       # ~ 900kB, a multiple of a whole base64 line
+
+def make_boundary():
+    """A boundary string in the style used by the `email` package"""
+    return "=" * 15 + ("%019d" % randrange(10 ** 19)) + "=="
+
+def data_length(data):
+    """Size in bytes of a part's data - either a bytestring or a seekable file-like object."""
+    if not hasattr(data, 'read'):
+        return len(data)
+    if isinstance(data, (file, io.IOBase)):
+        # (Not for any object with a `fileno`, as that would move a `SpooledTemporaryFile` to disc)
+        try:
+            return os.fstat(data.fileno()).st_size
+        except (AttributeError, IOError, OSError):
+            pass
+    data.seek(0, 2)
+    size = data.tell()
+    data.seek(0)
+    return size
+
+def base64_length(size):
+    """Length of the base64 encoding of `size` bytes, written in CRLF-terminated lines of 76 characters."""
+    lines = (size + B64_LINE_BYTES - 1) // B64_LINE_BYTES
+    return 4 * ((size + 2) // 3) + len(CRLF) * lines
+
+def encode_base64_lines(chunk):
+    """base64-encode `chunk` as CRLF-terminated lines. Only the last chunk of a payload may have a length that is
+    not a multiple of `B64_LINE_BYTES`."""
+    return CRLF.join([b2a_base64(chunk[i:i + B64_LINE_BYTES])[:-1]
+                      for i in xrange(0, len(chunk), B64_LINE_BYTES)]) + CRLF
+
+class Multipart_Related(object):
+    """A multipart/related message that is produced as it is read.
+
+    payloads -- `list` of `dict`s, as for `sword2.utils.create_multipart_related`:
+                'key'       -- name of the part (SWORD2 expects 'atom' and 'payload')
+                'type'      -- content type of the part (guessed from the filename if missing)
+                'filename'  -- optional filename
+                'data'      -- the part's content, either a bytestring or a seekable file-like object
+                'headers'   -- optional `dict` of additional part headers
+                'encoding'  -- optional Content-Transfer-Encoding of the part, 'base64' or 'binary'
+
+    Unless its 'encoding' says otherwise, the 'payload' part is base64 encoded; the others are sent as they are.
+    'binary' parts are sent as they are too, with a 'Content-Transfer-Encoding: binary' header, which avoids the
+    third larger body and the encoding work of base64 for servers that accept it.
+
+    Attributes:
+
+    `content_type`      -- the Content-Type of the message, including its boundary
+    `content_length`    -- the exact size of the message in bytes (also `len(self)`)
+
+    The message is kept as a list of segments - the boundaries and part headers as small bytestrings, and the
+    data of each part sent as it is as an `mmap` of its file, where it is a regular file. Reading the message walks
+    those segments, so the file data is only copied once, into the string handed to cURL, and never held in memory
+    as a whole. `buffers()` gives the segments without any copy at all.
+
+    The message can be iterated over, or read with `read()` like a file. `seek()` can move anywhere in the message
+    except into the middle of a base64 encoded part, whose encoding has to be produced from its start. `close()`
+    releases the memory maps.
+    """
+    def __init__(self, payloads, boundary=None):
+        self.payloads = payloads
+        if boundary is None:
+            boundary = make_boundary()
+            while [p for p in payloads if not hasattr(p['data'], 'read') and boundary in p['data']]:
+                boundary = make_boundary()
+        self.boundary = boundary
+        self.content_type = 'multipart/related; boundary="%s"' % boundary
+        self._parts = []    # (headers bytestring, data, encoding, data size)
+        for payload in payloads:
+            self._parts.append(self._part(payload))
+        self._maps = []
+        self._segments = self._layout()
+        self._starts = []
+        self.content_length = 0
+        for kind, source, length in self._segments:
+            self._starts.append(self.content_length)
+            self.content_length += length
+        self._starts.append(self.content_length)
+        self.seek(0)
+
+    def _part(self, payload):
+        mimetype = payload.get('type')
+        if mimetype is None:
+            mimetype = get_content_type(payload.get("filename"))
+        headers = ["--" + self.boundary,
+                   "Content-Type: %s" % mimetype,
+                   "MIME-Version: 1.0"]
+        if payload.get('filename', None):
+            headers.append('Content-Disposition: attachment; name="%s"; filename="%s"' % (payload['key'],
+                                                                                         payload['filename']))
+        else:
+            headers.append('Content-Disposition: attachment; name="%s"' % payload['key'])
+        for k, v in payload.get('headers', {}).iteritems():
+            headers.append("%s: %s" % (k, v))
+        encoding = payload.get('encoding')
+        if encoding is None and payload['key'] == 'payload':
+            encoding = 'base64'
+        if encoding not in (None, 'base64', 'binary'):
+            raise ValueError("Unsupported Content-Transfer-Encoding '%s'" % encoding)
+        if encoding:
+            headers.append("Content-Transfer-Encoding: %s" % encoding)
+        return (CRLF.join(headers) + CRLF + CRLF, payload['data'], encoding, data_length(payload['data']))
+
+    def _layout(self):
+        """The message as a list of (kind, source, length) segments, in order. `kind` is one of:
+
+        'bytes'     -- `source` is a bytestring (boundaries, part headers and bytestring data)
+        'mmap'      -- `source` is an `mmap` of a regular file sent as it is
+        'file'      -- `source` is any other file-like object sent as it is
+        'base64'    -- `source` is the data of a base64 encoded part, bytestring or file-like
+        """
+        segments = []
+        def add(kind, source, length):
+            if length:
+                segments.append((kind, source, length))
+        for headers, data, encoding, size in self._parts:
+            add('bytes', headers, len(headers))
+            if encoding == 'base64':
+                # (The encoding's own line endings are part of the body: the CRLF below still has to follow it,
+                # not least when the part is empty and there are no lines at all)
+                add('base64', data, base64_length(size))
+            elif hasattr(data, 'read'):
+                mapped = map_file(data)
+                if mapped is not None:
+                    self._maps.append(mapped)
+                    add('mmap', mapped, len(mapped))
+                else:
+                    add('file', data, size)
+            else:
+                add('bytes', data, size)
+            # The CRLF that ends the data is part of the following boundary delimiter
+            add('bytes', CRLF, len(CRLF))
+        closing = "--" + self.boundary + "--" + CRLF
+        add('bytes', closing, len(closing))
+        return segments
+
+    def __len__(self):
+        return self.content_length
+
+    def _read_data(self, data):
+        if not hasattr(data, 'read'):
+            yield data
+            return
+        data.seek(0)
+        chunk = data.read(READ_SIZE)
+        while chunk:
+            yield chunk
+            chunk = data.read(READ_SIZE)
+
+    def _read_base64(self, data):
+        carry = ""
+        for chunk in self._read_data(data):
+            if carry:
+                chunk = carry + chunk
+            whole = len(chunk) - (len(chunk) % B64_LINE_BYTES)
+            carry = chunk[whole:]
+            if whole:
+                yield encode_base64_lines(chunk[:whole])
+        if carry:
+            yield encode_base64_lines(carry)
+
+    def __iter__(self):
+        """Produce the message, chunk by chunk."""
+        for kind, source, length in self._segments:
+            if kind == 'bytes':
+                yield source
+            elif kind == 'mmap':
+                for offset in xrange(0, length, READ_SIZE):
+                    yield source[offset:offset + READ_SIZE]
+            elif kind == 'file':
+                for chunk in self._read_data(source):
+                    yield chunk
+            else:
+                for chunk in self._read_base64(source):
+                    yield chunk
+
+    def buffers(self):
+        """Produce the message as a sequence of buffers without copying any file data: parts that are sent as they
+        are come straight from their `mmap` as `buffer` slices. Anything that takes a buffer (eg `socket.sendall`
+        or `file.write`) can send these as they are."""
+        for kind, source, length in self._segments:
+            if kind == 'mmap':
+                for offset in xrange(0, length, READ_SIZE):
+                    yield buffer(source, offset, READ_SIZE)
+            elif kind == 'bytes':
+                yield source
+            elif kind == 'file':
+                for chunk in self._read_data(source):
+                    yield chunk
+            else:
+                for chunk in self._read_base64(source):
+                    yield chunk
+
+    def _read_segment(self, kind, source, size):
+        """Up to `size` bytes of the current segment, from `self._offset` into it."""
+        if kind == 'bytes':
+            if self._offset == 0 and size == len(source):
+                return source
+            return source[self._offset:self._offset + size]
+        if kind == 'mmap':
+            # The only copy of the file data made: straight from the mapped pages into the string cURL is given
+            return source[self._offset:self._offset + size]
+        if kind == 'file':
+            source.seek(self._offset)
+            return source.read(size)
+        if self._encoded is None:
+            self._encoded = self._read_base64(source)
+        while self._chunk_offset >= len(self._chunk):
+            self._chunk = self._encoded.next()
+            self._chunk_offset = 0
+        piece = self._chunk[self._chunk_offset:self._chunk_offset + size]
+        self._chunk_offset += len(piece)
+        return piece
+
+    def read(self, size=-1):
+        """Read up to `size` bytes of the message (or the rest of it, if `size` is negative)."""
+        out = []
+        wanted = size
+        while wanted != 0 and self._index < len(self._segments):
+            kind, source, length = self._segments[self._index]
+            left = length - self._offset
+            if wanted > 0 and wanted < left:
+                left = wanted
+            piece = self._read_segment(kind, source, left)
+            if not piece:
+                raise IOError("The data of a part ended %s bytes early - has the file changed?" %
+                              (length - self._offset))
+            self._offset += len(piece)
+            if self._offset >= length:
+                self._next_segment(self._index + 1)
+            if wanted > 0:
+                wanted -= len(piece)
+            out.append(piece)
+        if len(out) == 1:
+            data = out[0]
+        else:
+            data = "".join(out)
+        self._position += len(data)
+        return data
+
+    def _next_segment(self, index, offset=0):
+        self._index = index
+        self._offset = offset
+        self._encoded = None
+        self._chunk = ""
+        self._chunk_offset = 0
+
+    def seek(self, offset, whence=0):
+        """Move to `offset` in the message. Any position can be reached except one inside a base64 encoded part,
+        which can only be re-read from its start."""
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.content_length
+        if offset < 0:
+            raise IOError("Cannot seek to a negative position")
+        index = bisect_right(self._starts, offset) - 1
+        if index >= len(self._segments):
+            self._next_segment(len(self._segments))
+            self._position = offset
+            return
+        inside = offset - self._starts[index]
+        if inside and self._segments[index][0] == 'base64':
+            raise IOError("Cannot seek into the middle of a base64 encoded part")
+        self._next_segment(index, inside)
+        self._position = offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        """Release the memory maps of the files in the message."""
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+    def getvalue(self):
+        """The whole message as a bytestring - only intended for small messages and testing."""
+        return "".join(self)
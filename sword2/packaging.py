@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Provides `Zip_Stream`, which packages files as a SimpleZip ZIP archive while it is being read, so that a package can be
+deposited without first being written out to disc.
+
+The archive is produced in the 'streaming' form of the ZIP format: each member's CRC and sizes follow its data (in a
+data descriptor) rather than preceding it, so nothing needs to be known about a file before it is read. Zip64 records
+are used for members or archives too large for the original format.
+
+Members are deflated on several threads at once, and members that are already compressed (images, PDFs, nested
+archives, ...) are stored as they are rather than deflated again.
+
+SWORD2 deposits must carry the MD5 of the package in their Content-MD5 header, which has to be known before the body is
+sent. A `Zip_Stream` can be rewound with `seek(0)`, after which it produces exactly the same bytes again, so a
+`sword2.Connection` reads it through once to work out its MD5 and size and then again as it is uploaded. The source
+files are read twice, but no temporary package is ever written. (If a source file changes between the two passes, the
+upload is aborted with an `IOError` rather than sending a package that does not match its checksum.)
+
+Usage:
+
+>>> from sword2 import Connection, Entry
+>>> from sword2.packaging import Zip_Stream, SIMPLEZIP
+>>> conn = Connection("http://example.org/sd-uri", user_name="sword", user_pass="sword")
+>>> package = Zip_Stream("/data/thesis")               # a directory, or a list of files
+>>> receipt = conn.create(col_iri="http://example.org/col-iri/1",
+...                       payload=package,
+...                       mimetype="application/zip",
+...                       filename="thesis.zip",
+...                       packaging=SIMPLEZIP)
+
+Members can also be named explicitly, with a list of (path, name in the archive) tuples:
+
+>>> package = Zip_Stream([("/data/thesis/main.pdf", "thesis.pdf"), ("/tmp/manifest.xml", "manifest.xml")])
+"""
+
+from sword2_logging import logging
+pkg_l = logging.getLogger(__name__)
+
+from struct import pack
+from zlib import crc32, compressobj, DEFLATED, MAX_WBITS, Z_FINISH, Z_SYNC_FLUSH
+from zipfile import ZIP_STORED, ZIP_DEFLATED
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from collections import deque
+import time
+import os
+
+SIMPLEZIP = "http://purl.org/net/sword/package/SimpleZip"
+
+READ_SIZE = 64 * 1024
+BLOCK_SIZE = 128 * 1024     # Size of the blocks deflated in parallel
+
+# Already compressed formats, which are stored rather than deflated again
+COMPRESSED_EXTENSIONS = set(['.jpg', '.jpeg', '.png', '.gif', '.webp', '.jp2', '.heic',
+                             '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.jar',
+                             '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub',
+                             '.pdf', '.mp3', '.mp4', '.m4a', '.m4v', '.mov', '.avi', '.mkv', '.ogg', '.flac'])
+COMPRESSED_MAGIC = ['\xff\xd8\xff',                # JPEG
+                    '\x89PNG\r\n\x1a\n',           # PNG
+                    'GIF8',                         # GIF
+                    '\x00\x00\x00\x0cjP  ',         # JPEG 2000
+                    'PK\x03\x04',                   # ZIP (and docx, odt, epub, jar...)
+                    '\x1f\x8b',                     # gzip
+                    'BZh',                          # bzip2
+                    '\xfd7zXZ\x00',                  # xz
+                    '7z\xbc\xaf\x27\x1c',            # 7-Zip
+                    'Rar!\x1a\x07',                  # RAR
+                    '\x28\xb5\x2f\xfd',              # zstd
+                    '%PDF',                         # PDF
+                    'ID3',                          # MP3
+                    'OggS',                         # Ogg
+                    'fLaC']                         # FLAC
+
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+ZIP_MAX = 0xFFFFFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+def dos_date_time(timestamp):
+    """The MS-DOS (date, time) pair used in ZIP headers for a POSIX timestamp."""
+    t = time.localtime(timestamp)
+    if t[0] < 1980:
+        return (0 << 9) | (1 << 5) | 1, 0
+    return (t[0] - 1980) << 9 | t[1] << 5 | t[2], t[3] << 11 | t[4] << 5 | (t[5] // 2)
+
+def is_compressed(path):
+    """Whether the file at `path` is already compressed, going by its extension or else its first few bytes."""
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    f = open(path, 'rb')
+    try:
+        start = f.read(16)
+    finally:
+        f.close()
+    for magic in COMPRESSED_MAGIC:
+        if start.startswith(magic):
+            return True
+    # ISO media (mp4, mov, m4a, heic, ...) and WebP
+    return start[4:8] == 'ftyp' or (start[:4] == 'RIFF' and start[8:12] == 'WEBP')
+
+def deflate_block(data, level, final):
+    """Deflate one block of a member on its own. Blocks other than the last end on a byte boundary (with a sync flush)
+    and not with the final-block marker, so that the compressed blocks joined together are a single deflate stream."""
+    compressor = compressobj(level, DEFLATED, -MAX_WBITS)
+    if final:
+        return compressor.compress(data) + compressor.flush(Z_FINISH)
+    return compressor.compress(data) + compressor.flush(Z_SYNC_FLUSH)
+
+class Deflate_Block(object):
+    """A block of a member, compressed on a thread pool (zlib does not hold the GIL while it compresses)."""
+    def __init__(self, data, level, final):
+        self.data = data
+        self.level = level
+        self.final = final
+        self._result = None
+
+    def start(self, pool):
+        self._result = pool.apply_async(deflate_block, (self.data, self.level, self.final))
+        self.data = None
+
+    def result(self):
+        return self._result.get()
+
+def list_members(sources):
+    """(path, name in the archive) for each file in `sources` - a directory (all the files beneath it, named relative
+    to it), or a list of file paths (named by their basename) and/or (path, name) tuples."""
+    if isinstance(sources, basestring):
+        if not os.path.isdir(sources):
+            return [(sources, os.path.basename(sources))]
+        members = []
+        for dirpath, dirnames, filenames in os.walk(sources):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                members.append((path, os.path.relpath(path, sources).replace(os.sep, "/")))
+        return members
+    members = []
+    for source in sources:
+        if isinstance(source, basestring):
+            members.append((source, os.path.basename(source)))
+        else:
+            members.append(tuple(source))
+    return members
+
+class Zip_Stream(object):
+    """A ZIP archive of `sources`, produced as it is read.
+
+    sources         -- a directory, or a `list` of file paths and/or (path, name in the archive) tuples
+    compression     -- `zipfile.ZIP_DEFLATED` (the default) or `zipfile.ZIP_STORED`
+    compresslevel   -- zlib compression level for deflated members
+    threads         -- number of threads to compress with (by default, one per core). With more than one, members
+                       are deflated in independent blocks of `BLOCK_SIZE` bytes, which are compressed at the same time.
+    store_compressed -- store members that are already compressed (JPEGs, PDFs, nested zips, etc - see
+                       `is_compressed`) rather than deflating them again for next to no gain
+
+    Attributes:
+
+    `members`   -- `list` of the (path, name) of each member
+
+    Can be read like a file, or iterated over chunk by chunk. `seek(0)` rewinds it, and `len()` gives the size of the
+    archive - which, for compressed archives, is only known once the archive has been read through (so if needed
+    before then, the archive is read through to find it)."""
+    def __init__(self, sources, compression=ZIP_DEFLATED, compresslevel=6, threads=None, store_compressed=True):
+        if compression not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ValueError("Only ZIP_STORED and ZIP_DEFLATED archives can be streamed")
+        self.members = list_members(sources)
+        self.compression = compression
+        self.compresslevel = compresslevel
+        if threads is None:
+            threads = cpu_count()
+        self.threads = threads
+        self.store_compressed = store_compressed
+        self.content_length = None
+        self._checks = None     # (crc, size) of each member, as read the first time through
+        self.seek(0)
+
+    def _method(self, path):
+        """The compression method for the member at `path` - members that are already compressed are stored."""
+        if self.compression == ZIP_DEFLATED and self.store_compressed and is_compressed(path):
+            return ZIP_STORED
+        return self.compression
+
+    def _member(self, path, name, position, checks, central_directory):
+        """Produce the pieces of one member: its local header, its data and its data descriptor.
+
+        Pieces are either bytestrings, `Deflate_Block`s to be compressed on the thread pool, or callables that make
+        the bytes that can only be worked out once everything before them has been produced (the header, which
+        records the offset of the member, and the data descriptor, which records its compressed size). The callables
+        are called in order, with `position[0]` being the offset in the archive they are at."""
+        st = os.stat(path)
+        date, dostime = dos_date_time(st.st_mtime)
+        method = self._method(path)
+        flags = FLAG_DATA_DESCRIPTOR
+        if isinstance(name, unicode):
+            try:
+                name = name.encode('ascii')
+            except UnicodeEncodeError:
+                name = name.encode('utf-8')
+                flags |= FLAG_UTF8
+        zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+        if zip64:
+            version = 45
+            extra = pack('<HH2Q', 1, 16, 0, 0)
+        else:
+            version = 20
+            extra = ""
+        header = pack('<4s5H3L2H', 'PK\003\004', version, flags, method, dostime, date,
+                      0, 0, 0, len(name), len(extra)) + name + extra
+        member = {}
+        def start():
+            member['offset'] = position[0]
+            member['data_offset'] = position[0] + len(header)
+            return header
+        yield start
+
+        crc = 0
+        size = 0
+        f = open(path, 'rb')
+        try:
+            if method == ZIP_DEFLATED and self.threads > 1:
+                # Compress in independent blocks, so that they can be compressed at the same time (like pigz)
+                chunk = f.read(BLOCK_SIZE)
+                while True:
+                    crc = crc32(chunk, crc)
+                    size += len(chunk)
+                    following = f.read(BLOCK_SIZE)
+                    yield Deflate_Block(chunk, self.compresslevel, final=not following)
+                    if not following:
+                        break
+                    chunk = following
+            else:
+                compressor = None
+                if method == ZIP_DEFLATED:
+                    compressor = compressobj(self.compresslevel, DEFLATED, -MAX_WBITS)
+                chunk = f.read(READ_SIZE)
+                while chunk:
+                    crc = crc32(chunk, crc)
+                    size += len(chunk)
+                    if compressor is not None:
+                        chunk = compressor.compress(chunk)
+                    if chunk:
+                        yield chunk
+                    chunk = f.read(READ_SIZE)
+                if compressor is not None:
+                    yield compressor.flush()
+        finally:
+            f.close()
+        crc &= 0xFFFFFFFF
+
+        if self._checks is not None and self._checks[len(checks)] != (crc, size):
+            raise IOError("%s changed while it was being packaged - the package no longer matches its checksum" % path)
+        checks.append((crc, size))
+
+        def finish():
+            compressed_size = position[0] - member['data_offset']
+            if zip64:
+                descriptor = pack('<4sL2Q', 'PK\007\010', crc, compressed_size, size)
+            elif size > ZIP_MAX or compressed_size > ZIP_MAX:
+                raise IOError("%s grew too large for a ZIP member while it was being packaged" % path)
+            else:
+                descriptor = pack('<4s3L', 'PK\007\010', crc, compressed_size, size)
+
+            # Central directory record
+            central_version = version
+            zip64_fields = []
+            central_size, central_compressed, central_offset = size, compressed_size, member['offset']
+            if size > ZIP64_LIMIT:
+                zip64_fields.append(size)
+                central_size = ZIP_MAX
+            if compressed_size > ZIP64_LIMIT:
+                zip64_fields.append(compressed_size)
+                central_compressed = ZIP_MAX
+            if member['offset'] > ZIP64_LIMIT:
+                zip64_fields.append(member['offset'])
+                central_offset = ZIP_MAX
+            central_extra = ""
+            if zip64_fields:
+                central_version = 45
+                central_extra = pack('<HH' + 'Q' * len(zip64_fields), 1, 8 * len(zip64_fields), *zip64_fields)
+            central_directory.append(pack('<4s6H3L5H2L', 'PK\001\002', (3 << 8) | central_version, central_version,
+                                          flags, method, dostime, date, crc, central_compressed, central_size,
+                                          len(name), len(central_extra), 0, 0, 0, (st.st_mode & 0xFFFF) << 16,
+                                          central_offset) + name + central_extra)
+            return descriptor
+        yield finish
+
+    def _pieces(self, position, checks):
+        central_directory = []
+        for path, name in self.members:
+            for piece in self._member(path, name, position, checks, central_directory):
+                yield piece
+
+        def end():
+            central_offset = position[0]
+            central = "".join(central_directory)
+            central_size = len(central)
+            count = len(central_directory)
+            records = [central]
+            if count > ZIP_FILECOUNT_LIMIT or central_offset > ZIP64_LIMIT or central_size > ZIP64_LIMIT:
+                end_offset = central_offset + central_size
+                records.append(pack('<4sQ2H2L4Q', 'PK\006\006', 44, 45, 45, 0, 0, count, count, central_size,
+                                    central_offset))
+                records.append(pack('<4sLQL', 'PK\006\007', 0, end_offset, 1))
+                count, central_size, central_offset = (min(count, 0xFFFF), min(central_size, ZIP_MAX),
+                                                       min(central_offset, ZIP_MAX))
+            records.append(pack('<4s4H2LH', 'PK\005\006', 0, 0, count, count, central_size, central_offset, 0))
+            return "".join(records)
+        yield end
+
+    def __iter__(self):
+        """Produce the archive, chunk by chunk."""
+        position = [0]
+        checks = []
+        pool = None
+        if self.threads > 1:
+            pool = ThreadPool(self.threads)
+        queued = deque()
+        in_flight = [0]
+
+        def produce(piece):
+            if isinstance(piece, Deflate_Block):
+                in_flight[0] -= 1
+                data = piece.result()
+            elif callable(piece):
+                data = piece()
+            else:
+                data = piece
+            position[0] += len(data)
+            return data
+
+        try:
+            for piece in self._pieces(position, checks):
+                if isinstance(piece, Deflate_Block):
+                    piece.start(pool)
+                    in_flight[0] += 1
+                queued.append(piece)
+                # Keep a few blocks per thread in hand, so that none of them wait
+                while in_flight[0] > 2 * self.threads or (queued and not isinstance(queued[0], Deflate_Block)):
+                    yield produce(queued.popleft())
+            while queued:
+                yield produce(queued.popleft())
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        if self._checks is None:
+            self._checks = checks
+            self.content_length = position[0]
+
+    def __nonzero__(self):
+        # Truth-testing must not fall back on `__len__`, which may have to read through the whole archive
+        return True
+
+    def __len__(self):
+        if self.content_length is None:
+            # Read through a fresh copy of the archive to find its size
+            position = self._position
+            for chunk in iter(self):
+                pass
+            self.seek(0)
+            self.read(position)
+        return self.content_length
+
+    def read(self, size=-1):
+        """Read up to `size` bytes of the archive (or the rest of it, if `size` is negative)."""
+        out = []
+        wanted = size
+        while wanted != 0:
+            if self._offset >= len(self._chunk):
+                try:
+                    self._chunk = self._chunks.next()
+                except StopIteration:
+                    break
+                self._offset = 0
+                continue
+            if wanted < 0:
+                piece = self._chunk[self._offset:]
+            else:
+                piece = self._chunk[self._offset:self._offset + wanted]
+                wanted -= len(piece)
+            self._offset += len(piece)
+            out.append(piece)
+        data = "".join(out)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        """Only rewinding to the start, or seeking to the end (to find the size), is supported."""
+        if whence == 2 and offset == 0:
+            length = len(self)
+            self._chunks = iter([])
+            self._chunk = ""
+            self._offset = 0
+            self._position = length
+            return
+        if offset != 0 or whence != 0:
+            raise IOError("A Zip_Stream can only be rewound to its start")
+        self._chunks = iter(self)
+        self._chunk = ""
+        self._offset = 0
+        self._position = 0
+
+    def tell(self):
+        return self._position
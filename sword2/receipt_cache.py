@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Provides `Receipt_Cache`, the store of the latest `sword2.Deposit_Receipt` for each resource that a `sword2.Connection`
+has seen.
+
+Receipts are keyed by their Edit-IRI, with indexes by Content-IRI and SE-IRI kept alongside. The cache can be bounded
+in size - the least recently used receipt is dropped to make room for a new one - and in age - receipts older than
+`ttl` seconds are treated as missing. Dropping a receipt, for either reason, also drops its Content-IRI and SE-IRI
+index entries.
+
+Usage:
+
+>>> from sword2.receipt_cache import Receipt_Cache
+>>> cache = Receipt_Cache(max_size=1000, ttl=3600)
+>>> cache.put(receipt)
+>>> cache.get("http://example.org/edit-iri/1") is receipt
+True
+>>> cache.get_by_cont_iri("http://example.org/cont-iri/1") is receipt
+True
+>>> cache.stats()
+{'size': 1, 'hits': 2, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+A `Connection` keeps its receipts in one of these, as `conn.receipts`; set its size and age limits with the
+`receipt_cache_size` and `receipt_cache_ttl` parameters. `conn.edit_iris`, `conn.cont_iris`, `conn.se_iris` and
+`conn.cached_at` are read-only, `dict`-like views of it.
+
+`SQLite_Receipt_Cache` keeps the receipts in an SQLite database instead, so that they last between runs and are
+shared by every process (eg ingest workers) that uses the same file:
+
+>>> conn = Connection("http://example.org/sd-uri", receipt_cache="/var/cache/sword2/receipts.db")
+
+Any other object with the same methods (`put`, `lookup`, `get`, `get_by_cont_iri`, `get_by_se_iri`, `remove`,
+`purge_expired`, `clear`, `keys`, `__len__`, `stats` and `close`) can be given as `receipt_cache` too.
+"""
+
+from sword2_logging import logging
+rc_l = logging.getLogger(__name__)
+
+from deposit_receipt import Deposit_Receipt
+from compatible_libs import OrderedDict
+
+from UserDict import DictMixin
+from datetime import datetime
+from threading import Lock
+import sqlite3
+import json
+import time
+
+# Receipts held by a `Connection` unless told otherwise
+DEFAULT_MAX_RECEIPTS = 1024
+
+EDIT = 'edit'
+CONT = 'cont'
+SE = 'se'
+
+# Column of the SQLite table for each index
+COLUMNS = {EDIT:'edit_iri', CONT:'cont_iri', SE:'se_iri'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (edit_iri TEXT PRIMARY KEY,
+                                     cont_iri TEXT,
+                                     se_iri TEXT,
+                                     cached_at REAL NOT NULL,
+                                     used_at REAL NOT NULL,
+                                     record TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS receipts_cont_iri ON receipts (cont_iri);
+CREATE INDEX IF NOT EXISTS receipts_se_iri ON receipts (se_iri);
+CREATE INDEX IF NOT EXISTS receipts_used_at ON receipts (used_at);
+"""
+
+class Receipt_Cache(object):
+    """An LRU cache of deposit receipts, keyed by Edit-IRI and indexed by Content-IRI and SE-IRI.
+
+    max_size    -- the most receipts to hold (`None` for no limit)
+    ttl         -- seconds that a receipt is kept for (`None` to keep them until they are pushed out)
+
+    `hits`, `misses`, `evictions` (receipts dropped to make room) and `expirations` (receipts dropped for being older
+    than `ttl`) count what the cache has done."""
+    def __init__(self, max_size=DEFAULT_MAX_RECEIPTS, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()   # Key = Edit-IRI, Value = (receipt, cached at (`datetime`), cached at (`time`))
+        self._index = {CONT:{}, SE:{}}  # Key = IRI, Value = Edit-IRI
+        self._lock = Lock()
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[2] > self.ttl
+
+    def _drop(self, edit_iri):
+        receipt = self._entries.pop(edit_iri)[0]
+        for name, iri in ((CONT, receipt.cont_iri), (SE, receipt.se_iri)):
+            if iri and self._index[name].get(iri) == edit_iri:
+                del self._index[name][iri]
+
+    def put(self, receipt):
+        """Store `receipt` as the latest for its Edit-IRI, replacing any older one, and index it by its Content-IRI
+        and SE-IRI."""
+        if not receipt.edit:
+            rc_l.debug("Not caching a deposit receipt that has no Edit-IRI")
+            return
+        self._lock.acquire()
+        try:
+            if receipt.edit in self._entries:
+                self._drop(receipt.edit)
+            self._entries[receipt.edit] = (receipt, datetime.now(), time.time())
+            if receipt.cont_iri:   # SHOULD exist within receipt
+                self._index[CONT][receipt.cont_iri] = receipt.edit
+            if receipt.se_iri:
+                # MUST exist according to the spec, but as it can be the same as the Edit-IRI
+                # it seems likely that a server implementation might ignore the 'MUST' part.
+                self._index[SE][receipt.se_iri] = receipt.edit
+            while self.max_size is not None and len(self._entries) > self.max_size:
+                oldest = iter(self._entries).next()
+                rc_l.debug("Evicting the deposit receipt for %s" % oldest)
+                self._drop(oldest)
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def lookup(self, index, iri, touch=True):
+        """The (receipt, cached at (`datetime`), ...) entry for `iri` in the index `EDIT`, `CONT` or `SE`, or `None`.
+        Expired entries are dropped. With `touch`, the lookup is counted and the receipt is marked as the most
+        recently used."""
+        self._lock.acquire()
+        try:
+            if index == EDIT:
+                edit_iri = iri
+            else:
+                edit_iri = self._index[index].get(iri)
+            entry = self._entries.get(edit_iri)
+            if entry is not None and self._expired(entry):
+                self._drop(edit_iri)
+                self.expirations += 1
+                entry = None
+            if touch:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    # (OrderedDict has no move_to_end in Python 2)
+                    del self._entries[edit_iri]
+                    self._entries[edit_iri] = entry
+            return entry
+        finally:
+            self._lock.release()
+
+    def get(self, edit_iri):
+        """The receipt cached for `edit_iri`, or `None`."""
+        entry = self.lookup(EDIT, edit_iri)
+        return entry and entry[0]
+
+    def get_by_cont_iri(self, cont_iri):
+        """The receipt giving `cont_iri` as its Content-IRI, or `None`."""
+        entry = self.lookup(CONT, cont_iri)
+        return entry and entry[0]
+
+    def get_by_se_iri(self, se_iri):
+        """The receipt giving `se_iri` as its SE-IRI, or `None`."""
+        entry = self.lookup(SE, se_iri)
+        return entry and entry[0]
+
+    def remove(self, edit_iri):
+        """Drop the receipt for `edit_iri`, if there is one."""
+        self._lock.acquire()
+        try:
+            if edit_iri in self._entries:
+                self._drop(edit_iri)
+        finally:
+            self._lock.release()
+
+    def purge_expired(self):
+        """Drop every receipt older than `ttl`. Returns how many were dropped."""
+        if self.ttl is None:
+            return 0
+        self._lock.acquire()
+        try:
+            expired = [edit_iri for edit_iri, entry in self._entries.iteritems() if self._expired(entry)]
+            for edit_iri in expired:
+                self._drop(edit_iri)
+            self.expirations += len(expired)
+            return len(expired)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            for index in self._index.values():
+                index.clear()
+        finally:
+            self._lock.release()
+
+    def keys(self, index=EDIT):
+        """The IRIs in the given index - `EDIT` (the default), `CONT` or `SE`."""
+        self._lock.acquire()
+        try:
+            if index == EDIT:
+                return self._entries.keys()
+            return self._index[index].keys()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'size':len(self),
+                'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions,
+                'expirations':self.expirations}
+
+    def close(self):
+        pass
+
+class SQLite_Receipt_Cache(Receipt_Cache):
+    """A `Receipt_Cache` kept in an SQLite database at `path`, which any number of processes (and the threads within
+    them) can share.
+
+    Each receipt is stored as a compact JSON record (see `Deposit_Receipt.to_record`), in a row indexed by its
+    Edit-IRI, Content-IRI and SE-IRI, so that loading one needs no XML parsing. The database is used in WAL mode, so
+    that readers do not block the writer, and waits up to `timeout` seconds for a lock held by another process.
+
+    `max_size` and `ttl` are as for `Receipt_Cache`, across all the processes sharing the database. The counters
+    (`hits` and so on) only count what this instance has done. Receipts are loaded as `receipt_class`."""
+    def __init__(self, path, max_size=DEFAULT_MAX_RECEIPTS, ttl=None, timeout=30.0, receipt_class=Deposit_Receipt):
+        Receipt_Cache.__init__(self, max_size, ttl)
+        self.path = path
+        self.receipt_class = receipt_class
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        # Several processes may be creating the table at once - only one at a time may do so
+        self.db.isolation_level = None
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    self.db.execute(statement)
+        finally:
+            self.db.execute("COMMIT")
+            self.db.isolation_level = ""
+
+    def _execute(self, sql, *args):
+        self._lock.acquire()
+        try:
+            for attempt in (1, 2):
+                try:
+                    cursor = self.db.execute(sql, args)
+                    rows = cursor.fetchall()
+                    self.db.commit()
+                    return rows, cursor.rowcount
+                except sqlite3.OperationalError, e:
+                    self.db.rollback()
+                    # Another process changed the schema since the statement was prepared - prepare it again
+                    if attempt == 2 or "schema has changed" not in str(e):
+                        raise
+                except:
+                    self.db.rollback()
+                    raise
+        finally:
+            self._lock.release()
+
+    def put(self, receipt):
+        if not receipt.edit:
+            rc_l.debug("Not caching a deposit receipt that has no Edit-IRI")
+            return
+        now = time.time()
+        record = json.dumps(receipt.to_record(), separators=(',', ':'))
+        self._execute("INSERT OR REPLACE INTO receipts (edit_iri, cont_iri, se_iri, cached_at, used_at, record) "
+                      "VALUES (?, ?, ?, ?, ?, ?)", receipt.edit, receipt.cont_iri, receipt.se_iri, now, now, record)
+        if self.max_size is not None:
+            rows, dropped = self._execute("DELETE FROM receipts WHERE edit_iri IN "
+                                          "(SELECT edit_iri FROM receipts ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                                          self.max_size)
+            if dropped > 0:
+                rc_l.debug("Evicted %s deposit receipts" % dropped)
+                self.evictions += dropped
+
+    def lookup(self, index, iri, touch=True):
+        rows, _ = self._execute("SELECT edit_iri, cached_at, record FROM receipts WHERE %s = ? "
+                                "ORDER BY cached_at DESC LIMIT 1" % COLUMNS[index], iri)
+        entry = None
+        if rows:
+            edit_iri, cached_at, record = rows[0]
+            if self.ttl is not None and time.time() - cached_at > self.ttl:
+                self._execute("DELETE FROM receipts WHERE edit_iri = ?", edit_iri)
+                self.expirations += 1
+            else:
+                receipt = self.receipt_class.from_record(json.loads(record))
+                entry = (receipt, datetime.fromtimestamp(cached_at), cached_at)
+                if touch:
+                    self._execute("UPDATE receipts SET used_at = ? WHERE edit_iri = ?", time.time(), edit_iri)
+        if touch:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def remove(self, edit_iri):
+        self._execute("DELETE FROM receipts WHERE edit_iri = ?", edit_iri)
+
+    def purge_expired(self):
+        if self.ttl is None:
+            return 0
+        rows, dropped = self._execute("DELETE FROM receipts WHERE cached_at < ?", time.time() - self.ttl)
+        self.expirations += dropped
+        return dropped
+
+    def clear(self):
+        self._execute("DELETE FROM receipts")
+
+    def keys(self, index=EDIT):
+        rows, _ = self._execute("SELECT DISTINCT %s FROM receipts WHERE %s IS NOT NULL" % (COLUMNS[index],
+                                                                                           COLUMNS[index]))
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        rows, _ = self._execute("SELECT COUNT(*) FROM receipts")
+        return rows[0][0]
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self.db.close()
+        finally:
+            self._lock.release()
+
+class Receipt_Index_View(DictMixin):
+    """A read-only `dict`-like view of one index of a `Receipt_Cache`, for code that used the `edit_iris`,
+    `cont_iris`, `se_iris` and `cached_at` dicts of a `Connection` directly.
+
+    Looking receipts up through a view neither counts as a hit or miss nor changes which receipt is the least recently
+    used. Deleting a key drops that receipt from the cache."""
+    def __init__(self, cache, index=EDIT, timestamps=False):
+        self.cache = cache
+        self.index = index
+        self.timestamps = timestamps
+
+    def __getitem__(self, iri):
+        entry = self.cache.lookup(self.index, iri, touch=False)
+        if entry is None:
+            raise KeyError(iri)
+        if self.timestamps:
+            return entry[1]
+        return entry[0]
+
+    def __contains__(self, iri):
+        return self.cache.lookup(self.index, iri, touch=False) is not None
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self.cache.keys(self.index))
+
+    def keys(self):
+        return self.cache.keys(self.index)
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __delitem__(self, iri):
+        entry = self.cache.lookup(self.index, iri, touch=False)
+        if entry is None:
+            raise KeyError(iri)
+        self.cache.remove(entry[0].edit)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
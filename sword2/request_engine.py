@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Provides `Request_Engine`, which runs many SWORD2 requests at once over a single `sword2.Connection`.
+
+`Connection` methods block until their request has completed. The engine instead queues the requests that those
+same methods would make and drives them concurrently, on the calling thread, with a `pycurl.CurlMulti` handle.
+The responses are handled just as `Connection` handles them, so each result is the `sword2.Deposit_Receipt` (or
+`sword2.Error_Document`) that the equivalent blocking call would have returned.
+
+Usage:
+
+>>> from sword2 import Connection, Request_Engine, Entry
+>>> conn = Connection("http://example.org/sd-uri", user_name="sword", user_pass="sword")
+>>> engine = Request_Engine(conn, max_concurrent=24)
+
+# Queue requests by naming the `Connection` method and giving its usual parameters:
+>>> tickets = []
+>>> for n in range(100):
+...     e = Entry(title="Deposit %s" % n, id="deposit:%s" % n)
+...     tickets.append(engine.submit("create", col_iri="http://example.org/col-iri/1", metadata_entry=e))
+
+# Run the queued requests (at most 24 in flight at any time) and get the results in submission order:
+>>> receipts = engine.collect()
+>>> receipts[0].code
+201
+
+Or pick out the result of a single request by its ticket:
+>>> ticket = engine.submit("append", dr=receipts[0], metadata_entry=e)
+>>> engine.perform()
+>>> engine.result(ticket)
+
+If a request fails, the exception it raised is put in its place in the results - either a `pycurl.error` for
+transfer errors, or one of the `sword2.exceptions` if `conn.raise_except` is `True` and the server responded with
+an error code.
+"""
+
+from sword2_logging import logging
+engine_l = logging.getLogger(__name__)
+
+from utils import setup_curl, get_credentials, parse_curl_headers
+from multipart import Multipart_Related
+
+from time import time
+from collections import deque
+import types
+
+DEFAULT_MAX_CONCURRENT = 16
+
+# The `Connection` methods that can be queued: those that make their request through `Connection._make_request`.
+# Others (eg `get_resource`) send their requests themselves, and so cannot be deferred.
+REQUEST_OPERATIONS = ('create', 'create_with_files', 'update', 'update_files_for_resource',
+                      'update_metadata_for_resource', 'update_metadata_and_files_for_resource',
+                      'add_file_to_resource', 'append', 'delete', 'delete_content_of_resource', 'delete_container',
+                      'complete_deposit')
+
+class Deferred_Connection(object):
+    """Stands in for a `Connection` while one of its methods builds a request: `_make_request` hands back the
+    request `dict` that `Connection._prepare_request` builds, unsent. The connection's methods are run against this
+    object (so that they call this `_make_request`), and any attribute they set is set here rather than on the
+    connection."""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def _make_request(self, target_iri, **kw):
+        return self._conn._prepare_request(target_iri, **kw)
+
+    def __getattr__(self, name):
+        value = getattr(type(self._conn), name, None)
+        if isinstance(value, types.MethodType):
+            return types.MethodType(value.im_func, self)
+        return getattr(self._conn, name)
+
+class Request_Engine(object):
+    """Queues and concurrently performs requests for a `sword2.Connection`.
+
+    connection      -- the `sword2.Connection` to make requests for. Its settings (credentials, On-Behalf-Of,
+                       error handling, receipt caching, transaction history and keep-alive pool) all apply.
+    max_concurrent  -- the maximum number of requests in flight at any one time.
+    """
+    def __init__(self, connection, max_concurrent=DEFAULT_MAX_CONCURRENT):
+        self.conn = connection
+        self.max_concurrent = max_concurrent
+        self._queue = deque()       # (ticket, request) awaiting a transfer slot
+        self._active = {}           # Key = cURL handle, Value = transfer state dict
+        self._results = {}          # Key = ticket, Value = result
+        self._next_ticket = 0
+        self._multi = None
+
+    def submit(self, operation, *args, **kw):
+        """Queue the request that the `Connection` method named `operation` would make with the given parameters.
+
+        eg `engine.submit("update", dr=receipt, metadata_entry=entry)` queues the request that
+        `conn.update(dr=receipt, metadata_entry=entry)` would have made.
+
+        Only the methods in `REQUEST_OPERATIONS` can be queued - a `ValueError` is raised for any other.
+
+        Returns a ticket (`int`) identifying the request, or `None` if the method did not make a request (eg
+        `create` with a workspace/collection pair that could not be found)."""
+        if operation not in REQUEST_OPERATIONS:
+            raise ValueError("'%s' does not make its request through Connection._make_request, so it cannot be "
+                             "queued" % operation)
+        # Build the request, exactly as the blocking method would, but stop short of sending it
+        request = getattr(Deferred_Connection(self.conn), operation)(*args, **kw)
+        if request is None:
+            return None
+        if not isinstance(request, dict):
+            raise ValueError("'%s' returned %r rather than building a request" % (operation, request))
+        return self.submit_request(request)
+
+    def submit_request(self, request):
+        """Queue a request `dict`, as built by `Connection._prepare_request`. Returns its ticket."""
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        self._queue.append((ticket, request))
+        return ticket
+
+    def pending(self):
+        """Number of requests queued or in flight."""
+        return len(self._queue) + len(self._active)
+
+    def _release(self, request):
+        """Close what a request holds open for its body, as `Connection._make_request` does once it has sent one."""
+        for spooled in request['spools']:
+            spooled.close()
+        if isinstance(request['body'], Multipart_Related):
+            request['body'].close()
+
+    def _start(self, ticket, request):
+        pool = self.conn.curl_pool
+        if pool is not None:
+            curl = pool.acquire(request['target_iri'])
+        else:
+            import pycurl
+            curl = pycurl.Curl()
+        try:
+            response_headers, response_data = setup_curl(curl, request['target_iri'], request['method'],
+                                                         request['body'], request['headers'],
+                                                         credentials=get_credentials(self.conn.h, request['target_iri']))
+        except:
+            if pool is not None:
+                pool.discard(curl)
+            else:
+                curl.close()
+            raise
+        self._active[curl] = {'ticket':ticket,
+                              'request':request,
+                              'response_headers':response_headers,
+                              'response_data':response_data,
+                              'started':time()}
+        self._multi.add_handle(curl)
+
+    def _finish(self, curl, error=None):
+        transfer = self._active.pop(curl)
+        self._multi.remove_handle(curl)
+        request = transfer['request']
+        self._release(request)
+        pool = self.conn.curl_pool
+        if error is not None:
+            engine_l.error("%s to %s failed - %s" % (request['method'], request['target_iri'], error))
+            if pool is not None:
+                pool.discard(curl)
+            else:
+                curl.close()
+            self._results[transfer['ticket']] = error
+            return
+        if pool is not None:
+            pool.release(request['target_iri'], curl)
+        else:
+            curl.close()
+        try:
+            resp = parse_curl_headers(transfer['response_headers'].getvalue())
+            self.conn._log_request(request, resp, time() - transfer['started'])
+            result = self.conn._handle_response(resp, transfer['response_data'].getvalue())
+        except Exception, e:
+            result = e
+        self._results[transfer['ticket']] = result
+
+    def step(self, timeout=1.0):
+        """Make what progress can be made on the queued requests without blocking for longer than `timeout` seconds:
+        start as many as there are free transfer slots for, move the transfers in flight along, and handle any that
+        have finished. Returns the number of requests still queued or in flight.
+
+        Lets the caller do other work (eg preparing more requests) between calls, while transfers carry on."""
+        import pycurl
+        if self._multi is None:
+            self._multi = pycurl.CurlMulti()
+        multi = self._multi
+        while self._queue and len(self._active) < self.max_concurrent:
+            ticket, request = self._queue.popleft()
+            try:
+                self._start(ticket, request)
+            except Exception, e:
+                engine_l.error("%s to %s could not be started - %s" % (request['method'], request['target_iri'], e))
+                self._release(request)
+                self._results[ticket] = e
+        while True:
+            ret, _ = multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        while True:
+            remaining, succeeded, failed = multi.info_read()
+            for curl in succeeded:
+                self._finish(curl)
+            for curl, errno, errmsg in failed:
+                self._finish(curl, error=pycurl.error(errno, errmsg))
+            if not remaining:
+                break
+        if self._active and not (self._queue and len(self._active) < self.max_concurrent):
+            multi.select(timeout)
+        return self.pending()
+
+    def perform(self):
+        """Run every queued request to completion, keeping up to `self.max_concurrent` of them in flight."""
+        while self.pending():
+            self.step()
+
+    def result(self, ticket):
+        """The result for a ticket whose request has completed, removing it from the engine. Raises `KeyError`
+        if there is no result (yet) for the ticket."""
+        return self._results.pop(ticket)
+
+    def collect(self):
+        """Perform all queued requests and return every uncollected result, in the order they were submitted."""
+        self.perform()
+        results = [self._results[ticket] for ticket in sorted(self._results.keys())]
+        self._results = {}
+        return results
+
+    def close(self):
+        """Release the `pycurl.CurlMulti` handle. Any requests still queued or in flight are dropped, and their bodies
+        closed."""
+        for ticket, request in self._queue:
+            self._release(request)
+        self._queue.clear()
+        for curl, transfer in self._active.items():
+            self._multi.remove_handle(curl)
+            curl.close()
+            self._release(transfer['request'])
+        self._active = {}
+        if self._multi is not None:
+            self._multi.close()
+            self._multi = None
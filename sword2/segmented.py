@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Provides `Segmented_Deposit`, for depositing files larger than a server's `maxUploadSize`.
+
+The file is split into parts of at most `segment_size` bytes (by default, the `maxUploadSize` given in the service
+document). A container is created with 'In-Progress: true', each part is added to its media resource as a file of
+its own with `Connection.add_file_to_resource`, and the deposit is then marked as complete with
+`Connection.complete_deposit`. Several parts are sent at once through a `sword2.Request_Engine`.
+
+The status of every part is tracked, so that if some of them fail, only those need to be sent again.
+
+Usage:
+
+>>> from sword2 import Connection, Entry
+>>> from sword2.segmented import Segmented_Deposit
+>>> conn = Connection("http://example.org/sd-uri", user_name="sword", user_pass="sword")
+>>> deposit = Segmented_Deposit(conn, open("huge.zip", "rb"), "huge.zip", mimetype="application/zip",
+...                             max_concurrent=4)
+>>> deposit.create(col_iri="http://example.org/col-iri/1", metadata_entry=Entry(title="Huge", id="huge:1"))
+>>> failed = deposit.upload()
+>>> while failed:
+...     failed = deposit.upload()       # only the failed parts are sent again
+>>> deposit.complete()
+
+Each part is uploaded with the filename given by `part_filename`, by default eg 'huge.zip.part001' - putting the
+parts back together is left to the server.
+"""
+
+from sword2_logging import logging
+seg_l = logging.getLogger(__name__)
+
+from request_engine import Request_Engine
+from error_document import Error_Document
+from atom_objects import Entry
+
+from StringIO import StringIO
+
+PENDING = "pending"
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+# Part size used when neither `segment_size` nor the server's maxUploadSize are known
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+def default_part_filename(filename, number, count):
+    return "%s.part%03d" % (filename, number)
+
+class File_Segment(object):
+    """A read-only, seekable window of `length` bytes onto a file, starting at `offset`.
+
+    The underlying file is positioned before every read, so several segments can share one file handle as long as
+    they are read from a single thread (as the `Request_Engine` does)."""
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    def read(self, size=-1):
+        left = self.length - self.position
+        if size < 0 or size > left:
+            size = left
+        if size <= 0:
+            return ""
+        self.f.seek(self.offset + self.position)
+        data = self.f.read(size)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.length
+        self.position = max(0, min(offset, self.length))
+
+    def tell(self):
+        return self.position
+
+    def __len__(self):
+        return self.length
+
+    def __nonzero__(self):
+        # A segment is a payload even when it is empty - truth-testing must not fall back on `__len__`
+        return True
+
+class Segmented_Deposit(object):
+    """A deposit of one large file, sent as a number of size-bounded parts.
+
+    connection      -- the `sword2.Connection` to deposit through
+    payload         -- the file to deposit: a seekable file-like object, or a bytestring
+    filename        -- the name of the file
+    mimetype        -- MIMEType of the parts (default 'application/octet-stream')
+    segment_size    -- the largest part to send, in bytes. Defaults to the `maxUploadSize` of the server.
+    max_concurrent  -- the most parts to have in flight at once
+    part_filename   -- callable giving the filename of a part, as `part_filename(filename, number, count)`
+
+    Attributes:
+
+    `receipt`   -- the `sword2.Deposit_Receipt` of the container, once created
+    `parts`     -- `list` of `dict`s, one per part, with the keys:
+                    'number', 'offset', 'length', 'filename',
+                    'status'   -- one of `PENDING`, `UPLOADED` or `FAILED`
+                    'attempts' -- how many times the part has been sent
+                    'result'   -- the response to the last attempt: a `sword2.Deposit_Receipt`, a `sword2.Error_Document`
+                                  or the exception that was raised
+
+    A file of zero bytes has a single part, of zero length, which is sent as an empty file.
+    """
+    # Runs the uploads of the parts (a stand-in with the same interface can be put here, eg for testing)
+    engine_class = Request_Engine
+
+    def __init__(self, connection, payload, filename, mimetype=None, segment_size=None, max_concurrent=4,
+                       part_filename=default_part_filename):
+        self.conn = connection
+        if not hasattr(payload, 'read'):
+            payload = StringIO(payload)
+        self.payload = payload
+        self.filename = filename
+        self.mimetype = mimetype or "application/octet-stream"
+        if segment_size is None:
+            if getattr(connection, 'maxUploadSize', 0):
+                segment_size = connection.maxUploadSize * 1024      # maxUploadSize is in kB
+            else:
+                segment_size = DEFAULT_SEGMENT_SIZE
+        self.segment_size = segment_size
+        self.max_concurrent = max_concurrent
+        self.receipt = None
+
+        payload.seek(0, 2)
+        self.size = payload.tell()
+        payload.seek(0)
+        if self.size == 0:
+            count = 1   # One empty part, so that the file is still deposited
+        else:
+            count = (self.size + segment_size - 1) // segment_size
+        self.parts = []
+        for number in range(1, count + 1):
+            offset = (number - 1) * segment_size
+            self.parts.append({'number':number,
+                               'offset':offset,
+                               'length':min(segment_size, self.size - offset),
+                               'filename':part_filename(filename, number, count),
+                               'status':PENDING,
+                               'attempts':0,
+                               'result':None})
+
+    def create(self, workspace=None, collection=None, col_iri=None, metadata_entry=None,
+                     suggested_identifier=None, on_behalf_of=None):
+        """Create the container for the deposit, marked as 'In-Progress', using `Connection.create`. If no
+        `metadata_entry` is given, a minimal one titled with the filename is sent.
+
+        Returns the `sword2.Deposit_Receipt` (or `sword2.Error_Document`) from the server."""
+        if metadata_entry is None:
+            metadata_entry = Entry(title=self.filename)
+        self.receipt = self.conn.create(workspace=workspace, collection=collection, col_iri=col_iri,
+                                        metadata_entry=metadata_entry, suggested_identifier=suggested_identifier,
+                                        on_behalf_of=on_behalf_of, in_progress=True)
+        return self.receipt
+
+    def use_container(self, receipt):
+        """Deposit the parts into an existing, in-progress container instead of calling `create`."""
+        self.receipt = receipt
+
+    def _succeeded(self, result):
+        if result is None or isinstance(result, (Exception, Error_Document)):
+            return False
+        return result.code is None or result.code < 400
+
+    def pending(self):
+        """The parts that have not been uploaded yet (or have failed)."""
+        return [part for part in self.parts if part['status'] != UPLOADED]
+
+    def failed(self):
+        return [part for part in self.parts if part['status'] == FAILED]
+
+    def upload(self, parts=None):
+        """Upload the given parts - by default, every part that has not been uploaded successfully yet - with up to
+        `self.max_concurrent` in flight at once.
+
+        Returns the `list` of parts that failed, which can be passed back to `upload` to try them again."""
+        if self.receipt is None or not getattr(self.receipt, 'edit_media', None):
+            raise Exception("The container must be created (with a deposit receipt giving its EM-IRI) before parts "
+                            "can be uploaded")
+        if parts is None:
+            parts = self.pending()
+        engine = self.engine_class(self.conn, max_concurrent=self.max_concurrent)
+        tickets = {}
+        try:
+            for part in parts:
+                part['attempts'] += 1
+                segment = File_Segment(self.payload, part['offset'], part['length'])
+                ticket = engine.submit("add_file_to_resource",
+                                       edit_media_iri=self.receipt.edit_media,
+                                       payload=segment,
+                                       filename=part['filename'],
+                                       mimetype=self.mimetype,
+                                       in_progress=True)
+                tickets[ticket] = part
+            engine.perform()
+            for ticket, part in tickets.iteritems():
+                part['result'] = engine.result(ticket)
+                if self._succeeded(part['result']):
+                    part['status'] = UPLOADED
+                else:
+                    part['status'] = FAILED
+                    seg_l.error("Part %s of %s (%s) failed on attempt %s - %s" % (part['number'], len(self.parts),
+                                                                                  part['filename'], part['attempts'],
+                                                                                  part['result']))
+        finally:
+            engine.close()
+        return self.failed()
+
+    def complete(self):
+        """Mark the deposit as complete with `Connection.complete_deposit`, once every part has been uploaded."""
+        if self.pending():
+            raise Exception("%s of the %s parts have not been uploaded" % (len(self.pending()), len(self.parts)))
+        return self.conn.complete_deposit(dr=self.receipt)
@@ -48,6 +48,36 @@ SWORD: Treatment - 'Treatment description'
 SWORD: Accept Packaging: '['http://purl.org/net/sword/package/SimpleZip', 'http://purl.org/net/sword/package/METSDSpaceSIP']'
 SWORD: Nested Service Documents - 'http://swordapp.org/sd-iri/e4'
 
+# Very large service documents (eg from aggregators, with thousands of collections) can be read as a stream instead,
+# with `iterparse`. The document is only read as far as the workspaces and collections that have been asked for, one
+# collection at a time, and the XML of each is thrown away once its `SDCollection` (which keeps no DOM) is made:
+
+>>> s = ServiceDocument(open("aggregator-sd.xml"), streaming=True)
+>>> s.workspaces[0][0]           # reads as far as the title of the first workspace
+'Main Site'
+>>> for workspace, collections in s.workspaces:
+...     for c in collections:
+...         print c.href
+
+# Each `SDCollection` is kept once it has been read, though, so that the workspaces can be gone through again and the
+# collections looked up - memory still grows with the number of collections read. To hold only one at a time, do
+# not keep them, and go through them once with `iter_collections`:
+
+>>> s = ServiceDocument(open("aggregator-sd.xml"), streaming=True, retain_collections=False)
+>>> for workspace_title, c in s.iter_collections():
+...     print c.href
+
+# Collections can be looked up without walking the workspaces, from indexes built as the document is loaded:
+
+>>> s.find_collection("Main Site", "Collection 43").href
+'http://swordapp.org/col-iri/43'
+>>> s.get_collection("http://swordapp.org/col-iri/43").title
+'Collection 43'
+>>> [c.href for c in s.collections_accepting_packaging("http://purl.org/net/sword/package/SimpleZip")]
+['http://swordapp.org/col-iri/43']
+>>> [c.href for c in s.collections_accepting("application/zip")]     # matched by its */* accept
+['http://swordapp.org/col-iri/43']
+
 """
 
 from sword2_logging import logging
@@ -58,8 +88,173 @@ from collection import SDCollection
 from compatible_libs import etree
 from utils import NS, get_text
 
+from cStringIO import StringIO
+
+class Lazy_List(object):
+    """A read-only list that a `Service_Document_Stream` adds items to as they are read from the document. Asking
+    for an item (or the length, or the next item when iterating) reads as much more of the document as that needs."""
+    def __init__(self, stream):
+        self._stream = stream
+        self._items = []
+        self.done = False       # Set by the stream once there can be no more items
+
+    def _fill(self, index=None):
+        """Read on until there is an item at `index` (or until the list is complete, if `index` is `None`)."""
+        while not self.done and (index is None or len(self._items) <= index):
+            self._stream.step()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) or index < 0:
+            self._fill()
+        else:
+            self._fill(index)
+        return self._items[index]
+
+    def __len__(self):
+        self._fill()
+        return len(self._items)
+
+    def __nonzero__(self):
+        self._fill(0)
+        return bool(self._items)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            self._fill(index)
+            if index >= len(self._items):
+                return
+            yield self._items[index]
+            index += 1
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+class Streamed_Workspace(object):
+    """A workspace of a streamed service document. Like the ("Workspace Title", [collections]) tuples of a
+    `ServiceDocument` that is not streamed, it can be indexed or unpacked into its title and its collections, which
+    are a `Lazy_List` of `SDCollection`s."""
+    def __init__(self, stream):
+        self._stream = stream
+        self._title = None
+        self._has_title = False
+        self.collections = Lazy_List(stream)
+
+    @property
+    def title(self):
+        while not self._has_title and not self.collections.done:
+            self._stream.step()
+        return self._title
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        return (self.title, self.collections)[index]
+
+    def __iter__(self):
+        return iter((self.title, self.collections))
+
+    def __repr__(self):
+        return "<Streamed_Workspace '%s'>" % self.title
+
+class Service_Document_Stream(object):
+    """Reads a service document with `etree.iterparse`, one element event at a time (`step`), into a `Lazy_List` of
+    `Streamed_Workspace`s (`workspaces`).
+
+    Each app:collection is made into an `SDCollection` as soon as it has been read - without keeping its DOM - and is
+    then cleared and removed from the tree, so no more than one collection's XML is held at a time.
+
+    If `retain` is `False`, the `SDCollection`s are not added to the workspaces (nor indexed): only the one just read
+    is kept, as `last_collection`, until the next is read."""
+    def __init__(self, source, retain=True):
+        if not hasattr(source, 'read'):
+            source = StringIO(source)
+        self.events = etree.iterparse(source, events=("start", "end"))
+        self.stack = []         # The elements the parser is inside
+        self.version = None
+        self.maxUploadSize = None
+        self.workspaces = Lazy_List(self)
+        self.workspace = None   # The workspace being read
+        self.finished = False
+        self.indexer = None     # Called with (workspace title, collection) for each collection read
+        self.retain = retain
+        self.last_collection = None
+
+    def set_indexer(self, indexer):
+        """Have `indexer` called with the workspace title and `SDCollection` of every collection - those already read
+        as well as those still to come."""
+        self.indexer = indexer
+        for workspace in self.workspaces._items:
+            if workspace._has_title:
+                for c in workspace.collections._items:
+                    indexer(workspace._title, c)
+
+    def step(self):
+        """Handle the next element event of the document. Returns `False` once the document has been read."""
+        if self.finished:
+            return False
+        try:
+            event, element = self.events.next()
+        except StopIteration:
+            self.finished = True
+            self.workspaces.done = True
+            if self.workspace is not None:
+                self.workspace.collections.done = True
+            return False
+        tag = element.tag
+        if event == "start":
+            self.stack.append(element)
+            if tag == NS['app'] % "workspace" and len(self.stack) == 2:
+                self.workspace = Streamed_Workspace(self)
+                self.workspaces._items.append(self.workspace)
+                sd_l.debug("Found a workspace")
+            return True
+        self.stack.pop()
+        if len(self.stack) == 1:
+            # A child of app:service
+            if tag == NS['sword'] % "version":
+                self.version = element.text
+            elif tag == NS['sword'] % "maxUploadSize":
+                self.maxUploadSize = element.text
+            elif tag == NS['app'] % "workspace":
+                self.workspace.collections.done = True
+                self.workspace = None
+                self._discard(element)
+        elif len(self.stack) == 2 and self.workspace is not None:
+            # A child of app:workspace
+            if tag == NS['atom'] % "title" and not self.workspace._has_title:
+                self.workspace._title = element.text
+                self.workspace._has_title = True
+                sd_l.debug("Found workspace '%s'" % element.text)
+                if self.indexer is not None:
+                    for c in self.workspace.collections._items:
+                        self.indexer(element.text, c)
+            elif tag == NS['app'] % "collection":
+                c = SDCollection()
+                c.load_from_etree(element, keep_dom=False)
+                if self.retain:
+                    self.workspace.collections._items.append(c)
+                    if self.indexer is not None and self.workspace._has_title:
+                        self.indexer(self.workspace._title, c)
+                else:
+                    self.last_collection = c
+                self._discard(element)
+        return True
+
+    def _discard(self, element):
+        """Drop an element that has been read, and all it contains, from the tree being built."""
+        element.clear()
+        self.stack[-1].remove(element)
+
 class ServiceDocument(object):
-    def __init__(self, xml_response=None, sd_uri=None):
+    def __init__(self, xml_response=None, sd_uri=None, streaming=False, retain_collections=True):
         self.sd_uri = sd_uri     # Used mainly for debugging and logging
         self.parsed = False
         self.valid = False
@@ -67,10 +262,25 @@ class ServiceDocument(object):
         self.version = None        # Default to an empty string before attempting to parse
         self.workspaces = []     # Once enumerated, this will be a list of tuples, 
                                  # of the form: ("Workspace Title", [list of SDCollection instances])
+                                 # or, if `streaming`, a `Lazy_List` of `Streamed_Workspace`s
+        self.streaming = streaming
+        self.retain_collections = retain_collections     # Only `False` for a streamed document - see `iter_collections`
+        self.stream = None
+        self._reset_indexes()
         if xml_response:
             self.load_document(xml_response)
 
     def load_document(self, xml_response):
+        """Parse the service document in `xml_response` (a bytestring or, if it is to be streamed, a file-like object
+        as well).
+
+        If `self.streaming` is set, it is read with `iterparse`, only as far as the first app:workspace to begin with;
+        the rest is read as `self.workspaces` is used. The header elements (sword:version and sword:maxUploadSize) must
+        come before the first workspace to be taken into account, and `self.service_dom` is `None`.
+
+        If `self.retain_collections` is also `False`, the collections are not kept as they are read: the workspaces'
+        lists of collections stay empty, the lookups (`find_collection` etc) find nothing, and the collections can
+        only be gone through once, with `iter_collections`."""
         #try:
         if True:
             if self.sd_uri:
@@ -78,7 +288,15 @@ class ServiceDocument(object):
             else:
                 sd_l.debug("Attempting to load service document")
             self.raw_response = xml_response
-            self.service_dom = etree.fromstring(xml_response)
+            self._reset_indexes()
+            if self.streaming:
+                self.service_dom = None
+                self.stream = Service_Document_Stream(xml_response, retain=self.retain_collections)
+                self.stream.workspaces._fill(0)
+            else:
+                if hasattr(xml_response, 'read'):
+                    xml_response = xml_response.read()
+                self.service_dom = etree.fromstring(xml_response)
             self.parsed = True
             self.valid = self.validate()
             sd_l.info("Initial SWORD2 validation checks on service document - Valid document? %s" % self.valid)
@@ -99,7 +317,10 @@ class ServiceDocument(object):
         # The SWORD server MUST specify the sword:version element with a value of 2.0
         # -- MUST have sword:version element
         # -- MUST have value of '2.0'
-        self.version = get_text(self.service_dom, NS['sword'] % "version")
+        if self.stream is not None:
+            self.version = self.stream.version
+        else:
+            self.version = get_text(self.service_dom, NS['sword'] % "version")
         if self.version:
             if self.version != "2.0":
                 # Not a SWORD2 server...
@@ -111,7 +332,10 @@ class ServiceDocument(object):
             valid = False
         
         # The SWORD server MAY specify the sword:maxUploadSize (in kB) of content that can be uploaded in one request [SWORD003] as a child of the app:service element. If provided this MUST contain an integer.
-        maxupload = get_text(self.service_dom, NS['sword'] % "maxUploadSize")
+        if self.stream is not None:
+            maxupload = self.stream.maxUploadSize
+        else:
+            maxupload = get_text(self.service_dom, NS['sword'] % "maxUploadSize")
         if maxupload:
             try:
                 self.maxUploadSize = int(maxupload)
@@ -122,8 +346,11 @@ class ServiceDocument(object):
                 valid = False
         
         # Check for the first workspace for a collection element, just to make sure there is something there.
-        test_workspace = self.service_dom.find(NS['app'] % "workspace")
-        if test_workspace != None:
+        if self.stream is not None:
+            found_workspace = bool(self.stream.workspaces._items)
+        else:
+            found_workspace = self.service_dom.find(NS['app'] % "workspace") != None
+        if found_workspace:
             sd_l.debug("At least one app:workspace found, with at least one app:collection within it.")
         else:
             valid = False
@@ -139,6 +366,13 @@ class ServiceDocument(object):
         if self.sd_uri:
             sd_l.info("Enumerating workspaces and collections from the service document for %s" % self.sd_uri)
         
+        if self.stream is not None:
+            # Filled in, and indexed, as it is read
+            self.workspaces = self.stream.workspaces
+            if self.stream.retain:
+                self.stream.set_indexer(self._index_collection)
+            return
+
         # Reset the internally cached set
         self.workspaces = []
         for workspace in self.service_dom.findall(NS['app'] % "workspace"):
@@ -151,5 +385,83 @@ class ServiceDocument(object):
                 c.load_from_etree(collection_element)
                 
                 collections.append(c)
+                self._index_collection(workspace_title, c)
             self.workspaces.append( (workspace_title, collections) )   # Add tuple
 
+    def _reset_indexes(self):
+        self.by_title = {}              # (workspace title, collection title) -> `SDCollection` (the first with them)
+        self.by_href = {}               # Col-IRI -> `SDCollection`
+        self.by_accept = {}             # MIME type (from <accept>) -> `list` of `SDCollection`s
+        self.by_accept_multipart = {}   # MIME type (from <accept alternate="multipart-related">) -> `list`
+        self.by_packaging = {}          # sword:acceptPackaging format -> `list` of `SDCollection`s
+
+    def _index_collection(self, workspace_title, c):
+        """Add a collection to the lookup indexes."""
+        self.by_title.setdefault((workspace_title, c.title), c)
+        if c.href:
+            self.by_href.setdefault(c.href, c)
+        for mimetype in c.accept:
+            self.by_accept.setdefault(mimetype, []).append(c)
+        for mimetype in c.accept_multipart:
+            self.by_accept_multipart.setdefault(mimetype, []).append(c)
+        for packaging in c.acceptPackaging or []:
+            self.by_packaging.setdefault(packaging, []).append(c)
+
+    def _read_until(self, index, key):
+        """`index[key]`, or `None`. A streamed document is read on until the key turns up or the document ends."""
+        if self.stream is not None and self.stream.indexer is not None:
+            while key not in index and self.stream.step():
+                pass
+        return index.get(key)
+
+    def _read_all(self):
+        if self.stream is not None and self.stream.indexer is not None:
+            while self.stream.step():
+                pass
+
+    def iter_collections(self):
+        """Yields (workspace title, `SDCollection`) for each collection in the document, in order.
+
+        For a streamed document whose collections are not retained, each is read only as it is asked for, and is not
+        kept afterwards - so this can only be done once. The workspace title is `None` for any collections that come
+        before the atom:title of their workspace."""
+        if self.stream is None or self.stream.retain:
+            for workspace_title, collections in self.workspaces:
+                for c in collections:
+                    yield workspace_title, c
+            return
+        stream = self.stream
+        while stream.step():
+            if stream.last_collection is not None:
+                c = stream.last_collection
+                stream.last_collection = None
+                yield stream.workspace._title, c
+
+    def find_collection(self, workspace, collection):
+        """The `SDCollection` titled `collection` in the workspace titled `workspace`, or `None`."""
+        return self._read_until(self.by_title, (workspace, collection))
+
+    def get_collection(self, href):
+        """The `SDCollection` with the Col-IRI `href`, or `None`."""
+        return self._read_until(self.by_href, href)
+
+    def collections_accepting(self, mimetype, multipart=False):
+        """The collections that take deposits of `mimetype` - listing it, its major type (eg 'image/*') or '*/*' in
+        their <accept> elements (or their multipart-related ones, if `multipart` is `True`), in that order."""
+        self._read_all()
+        index = self.by_accept
+        if multipart:
+            index = self.by_accept_multipart
+        found = []
+        seen = set()
+        for accepted in (mimetype, mimetype.split("/", 1)[0] + "/*", "*/*"):
+            for c in index.get(accepted, []):
+                if id(c) not in seen:
+                    seen.add(id(c))
+                    found.append(c)
+        return found
+
+    def collections_accepting_packaging(self, packaging):
+        """The collections that list `packaging` in their sword:acceptPackaging elements."""
+        self._read_all()
+        return list(self.by_packaging.get(packaging, []))
@@ -16,11 +16,18 @@ from base64 import b64encode
 from mimetools import Message
 
 try:
-    from hashlib import md5
+    from hashlib import md5, new as new_hash
 except ImportError:
     import md5
+    def new_hash(name):
+        if name != 'md5':
+            raise ValueError("Only 'md5' is available without hashlib")
+        return md5.new()
 
 import mimetypes
+import mmap
+import os
+import io
 
 NS = {}
 NS['dcterms'] = "{http://purl.org/dc/terms/}%s"
@@ -48,27 +55,101 @@ def get_text(parent, tag, plural = False):
             text = [text, t]
     return text
 
-def get_md5(data):
-    """Takes either a `str` or a file-like object and passes back a tuple containing (md5sum, filesize)
+# Amount handed to the hash functions at once. hashlib releases the GIL while it works on anything this size, so
+# other threads can run while a payload is hashed.
+HASH_CHUNK_SIZE = 8 * 1024 * 1024   # 8Mb
+
+def map_file(data):
+    """A read-only `mmap` of the whole of a regular file object, or `None` if the data cannot be mapped."""
+    if not isinstance(data, (file, io.IOBase)):
+        return None
+    try:
+        fd = data.fileno()
+        if os.fstat(fd).st_size == 0:
+            return None     # empty files cannot be mapped
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError, mmap.error):
+        return None
+
+def get_digests(data, algorithms=('md5',)):
+    """Takes either a `str` or a file-like object and passes back a tuple containing ({algorithm: hexdigest}, filesize)
     
-    The file is streamed as 1Mb chunks so should work for large files. File-like object must support `seek()`
+    The data is only read once, however many algorithms are asked for (any name `hashlib.new` accepts, eg 'md5',
+    'sha1', 'sha256'). Regular files are read through `mmap`, other file-like objects are streamed as 8Mb chunks.
+    Either way, the file must support `seek()` and is left rewound to its start.
     """
+    hashes = [(name, new_hash(name)) for name in algorithms]
     if hasattr(data, "read") and hasattr(data, 'seek'):
-        data.seek(0)
-        m = md5()
-        chunk = data.read(1024*1024)   # 1Mb
         f_size = 0
-        while(chunk):
-            f_size += len(chunk)
-            m.update(chunk)
-            chunk = data.read(1024*1024)
+        mapped = map_file(data)
+        if mapped is not None:
+            try:
+                f_size = len(mapped)
+                for offset in xrange(0, f_size, HASH_CHUNK_SIZE):
+                    chunk = buffer(mapped, offset, HASH_CHUNK_SIZE)
+                    for name, h in hashes:
+                        h.update(chunk)
+            finally:
+                mapped.close()
+        else:
+            data.seek(0)
+            chunk = data.read(HASH_CHUNK_SIZE)
+            while(chunk):
+                f_size += len(chunk)
+                for name, h in hashes:
+                    h.update(chunk)
+                chunk = data.read(HASH_CHUNK_SIZE)
         data.seek(0)
-        return m.hexdigest(), f_size
     else:       # normal str
-        m = md5()
         f_size = len(data)
-        m.update(data)
-        return m.hexdigest(), f_size
+        for name, h in hashes:
+            h.update(data)
+    return dict([(name, h.hexdigest()) for name, h in hashes]), f_size
+
+# Payloads that have to be spooled are kept in memory up to this size, and written to a temporary file beyond it
+DEFAULT_SPOOL_THRESHOLD = 8 * 1024 * 1024     # 8Mb
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+def is_seekable(data):
+    """Whether a file-like object can be rewound - pipes, sockets and the like cannot."""
+    if not (hasattr(data, 'read') and hasattr(data, 'seek') and hasattr(data, 'tell')):
+        return False
+    try:
+        data.tell()
+    except (IOError, OSError):
+        return False
+    return True
+
+def spool(data, threshold=DEFAULT_SPOOL_THRESHOLD, algorithms=('md5',)):
+    """Copies a file-like object that cannot be rewound (eg a pipe), or an iterable of bytestrings, into a
+    `tempfile.SpooledTemporaryFile` - which is held in memory up to `threshold` bytes, and moved to a temporary file
+    beyond that. The digests are worked out as the data is copied, so it is only read once.
+    
+    Returns a tuple of (spooled file, rewound to its start, {algorithm: hexdigest}, size)"""
+    from tempfile import SpooledTemporaryFile
+    
+    hashes = [(name, new_hash(name)) for name in algorithms]
+    spooled = SpooledTemporaryFile(max_size=threshold)
+    if hasattr(data, 'read'):
+        chunks = iter(lambda: data.read(SPOOL_CHUNK_SIZE), "")
+    else:
+        chunks = iter(data)
+    f_size = 0
+    for chunk in chunks:
+        f_size += len(chunk)
+        for name, h in hashes:
+            h.update(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled, dict([(name, h.hexdigest()) for name, h in hashes]), f_size
+
+def get_md5(data):
+    """Takes either a `str` or a file-like object and passes back a tuple containing (md5sum, filesize)
+    
+    The file is read once, through `get_digests`, so should work for large files. File-like object must support `seek()`
+    """
+    digests, f_size = get_digests(data)
+    return digests['md5'], f_size
         
 
 class Timer(object):
@@ -178,9 +259,10 @@ def get_content_type(filename):
 
 def create_multipart_related(payloads):
     """ Expected: list of dicts with keys 'key', 'type'='content type','filename'=optional,'data'=payload, 'headers'={} 
+    and optionally 'encoding'='base64' or 'binary' (the 'payload' part is base64-encoded unless this says otherwise)
     
-    TODO: More mem-efficient to spool this to disc rather than hold in RAM, but until Httplib2 bug gets fixed (issue 151)
-    this might be in vain.
+    Builds the whole message in RAM - `sword2.multipart.Multipart_Related` produces the same kind of message as it is
+    read instead, and is what `sword2.Connection` uses for its multipart deposits.
     
     Can handle more than just two files. 
     
@@ -216,7 +298,9 @@ def create_multipart_related(payloads):
 
         # Attach payload
         part.set_payload(payload['data'])
-        if payload['key'] == 'payload':
+        if payload.get('encoding') == 'binary':
+            part.add_header('Content-Transfer-Encoding', 'binary')
+        elif payload['key'] == 'payload' or payload.get('encoding') == 'base64':
             Encoders.encode_base64(part)
 
         multipart.attach(part)
@@ -234,9 +318,206 @@ def create_multipart_related(payloads):
 
     return content_type, message_body
 
-def curl_request(http_object, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+def parse_curl_headers(header_text):
+    """Turns the raw response header text collected from a cURL transfer into an `httplib2.Response`.
+    
+    cURL hands over every header block it receives, so interim responses (eg '100 Continue') are skipped and
+    only the final block is used."""
+    import httplib2
+
+    blocks = [b for b in header_text.replace('\r\n', '\n').split('\n\n') if b.strip()]
+    if not blocks:
+        raise ValueError, "Invalid http response from cURL."
+    lines = blocks[-1].strip().split('\n')
+    http_response = lines[0].split(None, 2)
+    if http_response[0][:5].lower() != 'http/':
+        raise ValueError, "Invalid http response from cURL."
+    headers = []
+    for line in lines[1:]:
+        if ':' in line:
+            k, v = line.split(':', 1)
+            headers.append((k.strip().lower(), v.strip()))
+    version = {'1.0': 10, '1.1': 11}.get(http_response[0][5:], 11)
+    status = http_response[1]
+    if len(http_response) > 2:
+        reason = http_response[2]
+    else:
+        reason = ""
+    headers.append(('status', status))
+    return_headers = httplib2.Response(dict(headers))
+    return_headers.version = version
+    return_headers.status = int(status)
+    return_headers.reason = reason
+    return return_headers
+
+def get_credentials(http_object, uri):
+    """Finds the (user name, password) added to an `httplib2.Http` object with `add_credentials` that apply to `uri`,
+    or `None` if there are none."""
+    credentials = getattr(http_object, 'credentials', None)
+    if credentials is None:
+        return None
+    from urlparse import urlsplit
+    host = urlsplit(str(uri)).hostname
+    for domain, name, password in credentials.credentials:
+        if not domain or domain == host:
+            return name, password
+    return None
+
+class Response_Sink(object):
+    """Receives the response of a cURL transfer, writing a successful (2xx) body to `sink` as it arrives rather than
+    holding it in memory.
+    
+    sink            -- a file path, or a writable file-like object. A path is only opened (truncating any existing
+                       file) once a successful response starts to arrive, so a failed request leaves it untouched.
+    chunk_callback  -- optional callable, called as `chunk_callback(chunk, bytes_received)` for every chunk written
+                       to the sink.
+    
+    The bodies of any other responses (errors, authentication challenges) are small and kept in `self.buffer`, so
+    that they can be handled as usual. `self.size` is the number of bytes written to the sink, and
+    `self.response_headers` holds the (lowercased) headers of the latest response.
+    
+    `bytes_received` counts from `self.offset`, which subclasses resuming a partial download set to the number of
+    bytes already held."""
+    def __init__(self, sink, chunk_callback=None):
+        import StringIO
+        self.sink = sink
+        self.chunk_callback = chunk_callback
+        self.headers = StringIO.StringIO()
+        self.buffer = StringIO.StringIO()
+        self.status = None
+        self.response_headers = {}
+        self.size = 0
+        self.offset = 0
+        self._file = None
+        if isinstance(sink, basestring):
+            self.path = sink
+        else:
+            self.path = getattr(sink, 'name', None)
+
+    def _successful(self):
+        return self.status is not None and 200 <= self.status < 300
+
+    def header(self, line):
+        if line[:5].lower() == 'http/':
+            # A new response (eg after a '100 Continue' or an authentication challenge) - forget the last one's body
+            import StringIO
+            self.status = int(line.split()[1])
+            self.response_headers = {}
+            self.buffer = StringIO.StringIO()
+        elif ':' in line:
+            k, v = line.split(':', 1)
+            self.response_headers[k.strip().lower()] = v.strip()
+        self.headers.write(line)
+
+    def _open(self):
+        if self._file is None:
+            if isinstance(self.sink, basestring):
+                self._file = open(self.sink, 'wb')
+            else:
+                self._file = self.sink
+        return self._file
+
+    def write(self, chunk):
+        if not self._successful():
+            self.buffer.write(chunk)
+            return
+        self._open().write(chunk)
+        self.size += len(chunk)
+        if self.chunk_callback is not None:
+            self.chunk_callback(chunk, self.offset + self.size)
+
+    def getvalue(self):
+        """The body of an unsuccessful response (the body of a successful one is in the sink)."""
+        return self.buffer.getvalue()
+
+    def close(self):
+        """Finish writing to the sink. Files opened from a path are closed; file-like objects are flushed but left
+        open for the caller."""
+        if self._successful():
+            f = self._open()
+            if f is self.sink:
+                if hasattr(f, 'flush'):
+                    f.flush()
+                return
+        if self._file is not None and self._file is not self.sink:
+            self._file.close()
+
+def setup_curl(curl, uri, method='GET', body=None, headers=None, credentials=None, response_sink=None):
+    """Sets the options on a `pycurl.Curl` handle for a single request, without performing it.
+    
+    Any HTTP method can be given. The `body` can be a bytestring or a file-like object supporting `read()`. When
+    the length of a file-like body is known, it should be given in the 'Content-Length' header.
+    
+    `credentials` -- optional (user name, password) tuple, used to answer any HTTP authentication challenge.
+    
+    `response_sink` -- optional `Response_Sink` to stream a successful response body to.
+    
+    Returns a tuple of two `StringIO` objects, which will collect the response headers and the response body
+    respectively. With a `response_sink`, the sink itself is returned in place of the second, and `getvalue()` on
+    it gives only the body of an unsuccessful response."""
+    import pycurl, StringIO
+
+    if headers is None:
+        headers = {}
+    curl.setopt(curl.URL, str(uri))
+    if body is not None:
+        if hasattr(body, 'read'):
+            # Create stream for transmission
+            stream = body
+            body_length = -1
+            for k, v in headers.iteritems():
+                if k.lower() == 'content-length':
+                    body_length = int(v)
+        else:
+            stream = StringIO.StringIO(body)
+            body_length = len(body)
+        curl.setopt(curl.READFUNCTION, stream.read)
+        if hasattr(stream, 'seek'):
+            # Allows cURL to rewind the body and send it again after an authentication challenge
+            def seek(offset, origin):
+                stream.seek(offset, origin)
+                return 0
+            curl.setopt(curl.SEEKFUNCTION, seek)
+    if method == 'GET':
+        curl.setopt(curl.HTTPGET, 1)
+    elif method == 'HEAD':
+        curl.setopt(curl.NOBODY, 1)
+    elif method == 'POST':
+        curl.setopt(curl.POST, 1)
+        if body is None:
+            curl.setopt(curl.POSTFIELDSIZE, 0)
+        elif body_length >= 0:
+            curl.setopt(curl.POSTFIELDSIZE_LARGE, body_length)
+    else:
+        if body is not None:
+            curl.setopt(curl.UPLOAD, 1)
+            if body_length >= 0:
+                curl.setopt(curl.INFILESIZE_LARGE, body_length)
+        if method != 'PUT':
+            curl.setopt(curl.CUSTOMREQUEST, str(method))
+    curl.setopt(curl.VERBOSE, 0) # Change for verbose / debug output
+    curl.setopt(curl.HTTPHEADER, [(k + ': ' + v) for k,v in headers.iteritems()])
+    if credentials:
+        curl.setopt(curl.USERPWD, "%s:%s" % credentials)
+        curl.setopt(curl.HTTPAUTH, pycurl.HTTPAUTH_ANY)
+
+    if response_sink is not None:
+        curl.setopt(curl.HEADERFUNCTION, response_sink.header)
+        curl.setopt(curl.WRITEFUNCTION, response_sink.write)
+        return response_sink.headers, response_sink
+
+    # Create stream for response headers and data
+    response_headers = StringIO.StringIO()
+    curl.setopt(curl.HEADERFUNCTION, response_headers.write)
+    response_data = StringIO.StringIO()
+    curl.setopt(curl.WRITEFUNCTION, response_data.write)
+    return response_headers, response_data
+
+def curl_request(http_object, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None,
+                 curl_pool=None, response_sink=None):
     """
-    request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None)
+    request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None, curl_pool=None,
+            response_sink=None)
         Performs a single HTTP request.
         The 'uri' is the URI of the HTTP resource and can begin 
         with either 'http' or 'https'. The value of 'uri' must be an absolute URI.
@@ -245,7 +526,9 @@ def curl_request(http_object, uri, method='GET', body=None, headers=None, redire
         There is no restriction on the methods allowed.
         
         The 'body' is the entity body to be sent with the request. It is a string
-        object.
+        object, or a file-like object supporting `read()` and `seek()`, which is streamed
+        rather than read into memory. The length of a file-like body should be given in
+        the 'Content-Length' header.
         
         Any extra headers that are to be sent with the request should be provided in the
         'headers' dictionary.
@@ -253,115 +536,54 @@ def curl_request(http_object, uri, method='GET', body=None, headers=None, redire
         The maximum number of redirect to follow before raising an 
         exception is 'redirections. The default is 5.
         
+        If a `sword2.curl_pool.Curl_Pool` is passed as 'curl_pool', the cURL handle (and so its open
+        keep-alive connection) is taken from and returned to the pool rather than being created and
+        closed for this one request. Requests handed to `http_object` reuse its own connections.
+        
+        If a `sword2.utils.Response_Sink` is passed as 'response_sink', a successful response body
+        is written to it as it arrives instead of being returned.
+        
         The return value is a tuple of (response, content), the first 
         being and instance of the 'Response' class, the second being 
         a string that contains the response entity body.
     """
 
-    import pycurl, httplib2, StringIO
+    import pycurl, StringIO
 
-    iHttpObject = http_object
-    iUri = uri
-    iMethod = method
-    iBody = body
-    iHeaders = headers
-    iRedirections = redirections
-    iConnectionType = connection_type
+    if headers is None:
+        headers = {}
 
-    if (iMethod == 'GET') and (iBody is None):
-        curl = pycurl.Curl()
-        curl.setopt(curl.URL, str(iUri))
-        curl.setopt(curl.HTTPGET, 1)
-        curl.setopt(curl.VERBOSE, 0) # Change for verbose / debug output
-        curl.setopt(curl.HTTPHEADER, [(k + ': ' + v) for k,v in iHeaders.iteritems()])
-        
-        # Create stream for response headers and data
-        response_headers = StringIO.StringIO()
-        curl.setopt(curl.HEADERFUNCTION, response_headers.write)
-        response_data = StringIO.StringIO()
-        curl.setopt(curl.WRITEFUNCTION, response_data.write)
-
-        curl.perform()
-
-        # Build response
-        response_headers.seek(0)
-        headers = response_headers.read().strip()
-        if '\r\n' in headers:
-            headers = headers.split('\r\n')
-        else:
-            headers = headers.split('\n')
-        http_response = headers[0].split(None, 2)
-        del headers[0]
-        headers = [(x[0].lower(), x[1]) for x in [x.split(': ') for x in headers]]
-        if http_response[0][:5].lower() != 'http/':
-            raise ValueError, "Invalid http response from cURL."
-        version = {'1.0': 10, '1.1': 11}[http_response[0][5:]]
-        status = http_response[1]
-        reason = http_response[2]
-        headers.append(('status', status))
-        return_headers = httplib2.Response(dict(headers))
-        return_headers.version = version
-        return_headers.status = int(status)
-        return_headers.reason = reason
-
-        response_data.seek(0)
-        return_content = response_data.read()
-        curl.close()
+    # File-like bodies are always streamed by cURL, which can rewind them to answer an authentication challenge
+    if response_sink is None and not hasattr(body, 'read') and \
+       not (((method == 'GET') and (body is None)) or ((method == 'POST') and (body is not None))):
+        return http_object.request(uri, method=method, body=body, headers=headers,
+                                   redirections=redirections, connection_type=connection_type)
 
-        return return_headers, return_content
-    elif (iMethod == 'POST') and (iBody is not None):
+    if curl_pool is not None:
+        curl = curl_pool.acquire(uri)
+    else:
         curl = pycurl.Curl()
-        curl.setopt(curl.URL, str(iUri))
-        curl.setopt(curl.POST, 1)
-
-        # Create stream for transmission
-        stream = StringIO.StringIO(iBody)
-        curl.setopt(curl.READFUNCTION, stream.read)
-
-        curl.setopt(curl.VERBOSE, 0) # Change for verbose / debug output
-        curl.setopt(curl.HTTPHEADER, [(k + ': ' + v) for k,v in iHeaders.iteritems()])
-
-        # Create stream for response headers and data
-        response_headers = StringIO.StringIO()
-        curl.setopt(curl.HEADERFUNCTION, response_headers.write)
-        response_data = StringIO.StringIO()
-        curl.setopt(curl.WRITEFUNCTION, response_data.write)
+    response_headers, response_data = setup_curl(curl, uri, method, body, headers,
+                                                 credentials=get_credentials(http_object, uri),
+                                                 response_sink=response_sink)
 
+    try:
         curl.perform()
-
-        # Build response
-
-        response_headers.seek(0)
-
-        headers = response_headers.read().strip()
-        if '\r\n' in headers:
-            headers = headers.split('\r\n')
+    except pycurl.error:
+        if curl_pool is not None:
+            curl_pool.discard(curl)
         else:
-            headers = headers.split('\n')
-        print('HEADERS IS '+str(headers))
-        http_response = headers[0].split(None, 2)
-        del headers[0]
-        if(http_response[1] == '100'):
-            del headers[0]
-            http_response=headers[0].split(None,2)
-            del headers[0]
-        headers = [(x[0].lower(), x[1]) for x in [x.split(': ') for x in headers]]
-        if http_response[0][:5].lower() != 'http/':
-            raise ValueError, "Invalid http response from cURL."
-        version = {'1.0': 10, '1.1': 11}[http_response[0][5:]]
-        status = http_response[1]
-        reason = http_response[2]
-        headers.append(('status', status))
-        return_headers = httplib2.Response(dict(headers))
-        return_headers.version = version
-        return_headers.status = int(status)
-        return_headers.reason = reason
-
-        response_data.seek(0)
-        return_content = response_data.read()
+            curl.close()
+        raise
+    finally:
+        if response_sink is not None:
+            response_sink.close()
+
+    if curl_pool is not None:
+        curl_pool.release(uri, curl)
+    else:
         curl.close()
 
-        return return_headers, return_content
-    else:
-        return iHttpObject.request(iUri, method=iMethod, body=iBody, headers=iHeaders,
-                                   redirections=iRedirections, connection_type=iConnectionType)
+    # Build response
+    return_headers = parse_curl_headers(response_headers.getvalue())
+    return return_headers, response_data.getvalue()
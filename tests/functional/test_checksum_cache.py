@@ -0,0 +1,110 @@
+from . import TestController
+
+from sword2 import Connection
+from sword2.checksum_cache import Checksum_Cache, hash_files
+from sword2.utils import get_md5
+
+from .test_request_engine import Deposit_Server
+
+from StringIO import StringIO
+from threading import Thread
+import __builtin__
+import tempfile
+import os
+import sword2.connection
+
+def make_file(data):
+    fd, path = tempfile.mkstemp()
+    os.write(fd, data)
+    os.close(fd)
+    return path
+
+class TestChecksumCache(TestController):
+    def test_01_unchanged_file_is_cached(self):
+        path = make_file("hello world")
+        cache = Checksum_Cache()
+        assert cache.get_md5(open(path, "rb")) == get_md5("hello world")
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert cache.get_md5(open(path, "rb")) == get_md5("hello world")
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_02_changed_file_is_hashed_again(self):
+        path = make_file("hello world")
+        cache = Checksum_Cache()
+        cache.get_md5(open(path, "rb"))
+        f = open(path, "ab")
+        f.write("!")
+        f.close()
+        assert cache.get_md5(open(path, "rb")) == get_md5("hello world!")
+        assert cache.misses == 2
+
+    def test_03_other_payloads_are_not_cached(self):
+        cache = Checksum_Cache()
+        assert cache.get_md5("hello") == get_md5("hello")
+        assert cache.get_md5(StringIO("hello")) == get_md5("hello")
+        assert len(cache) == 0
+
+    def test_04_persisted_between_runs(self):
+        path = make_file("persistent")
+        store = os.path.join(tempfile.mkdtemp(), "checksums")
+        cache = Checksum_Cache(store)
+        cache.get_md5(open(path, "rb"))
+        cache.close()
+        cache = Checksum_Cache(store)
+        assert cache.get_md5(open(path, "rb")) == get_md5("persistent")
+        assert cache.hits == 1
+        cache.close()
+
+    def test_05_used_by_connection(self):
+        path = make_file("deposit me")
+        conn = Connection("http://example.org/service", checksum_cache=Checksum_Cache())
+        for i in range(2):
+            request = conn._prepare_request("http://example.org/em-iri", payload=open(path, "rb"),
+                                            filename="foo.txt", mimetype="text/plain")
+            assert request['headers']['Content-MD5'] == get_md5("deposit me")[0]
+            assert request['headers']['Content-Length'] == "10"
+        assert conn.checksum_cache.hits == 1
+
+    def test_06_hash_files_in_a_pool(self):
+        paths = [make_file("file %s" % i) for i in range(5)]
+        cache = Checksum_Cache()
+        sums = hash_files(paths, algorithms=('md5', 'sha1'), processes=2, cache=cache)
+        assert len(sums) == 5
+        for i, path in enumerate(paths):
+            digests, size = sums[path]
+            assert digests['md5'] == get_md5("file %s" % i)[0]
+            assert size == len("file %s" % i)
+        assert len(cache) == 5
+        # Already cached, so not hashed again
+        hash_files(paths, algorithms=('md5',), processes=2, cache=cache)
+        assert cache.hits == 5
+
+    def test_07_add_files_opens_only_files_being_sent(self):
+        paths = [make_file("file %s" % i) for i in range(7)]
+        opened = []
+        most_open = [0]
+        def tracking_open(path, mode='r'):
+            f = __builtin__.open(path, mode)
+            opened.append(f)
+            most_open[0] = max(most_open[0], len([o for o in opened if not o.closed]))
+            return f
+        server = Deposit_Server()
+        serving = Thread(target=server.serve_forever)
+        serving.daemon = True
+        serving.start()
+        sword2.connection.open = tracking_open
+        try:
+            conn = Connection(server.iri + "/sd-iri")
+            receipts = conn.add_files_to_resource(server.iri + "/em-iri/1", paths, mimetype="text/plain",
+                                                  processes=2, max_concurrent=2)
+        finally:
+            del sword2.connection.open
+            server.shutdown()
+            server.server_close()
+        assert [r.code for r in receipts] == [201] * 7
+        assert sorted(server.md5s) == sorted([get_md5("file %s" % i)[0] for i in range(7)])
+        assert len(opened) == 7
+        assert most_open[0] <= 2
+        assert not [f for f in opened if not f.closed]
+        # No cache was set up for the call
+        assert conn.checksum_cache is None
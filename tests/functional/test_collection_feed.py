@@ -0,0 +1,95 @@
+from . import TestController
+
+from sword2 import Collection_Feed, Connection
+from sword2.deposit_receipt import Compact_Deposit_Receipt
+import sword2.collection
+
+import httplib2
+
+def page(n, next_href=None):
+    link = ""
+    if next_href:
+        link = '<link rel="next" href="%s"/>' % next_href
+    entries = "".join(['<entry><title>Item %s-%s</title><link rel="edit" href="http://example.org/edit/%s-%s"/>'
+                       '</entry>' % (n, i, n, i) for i in range(2)])
+    return '<feed xmlns="http://www.w3.org/2005/Atom">%s%s</feed>' % (link, entries)
+
+class Fake_Server(object):
+    """Stands in for `curl_request`, serving pages that have an ETag each"""
+    def __init__(self, pages):
+        self.pages = pages      # Key = IRI, Value = (ETag, XML)
+        self.requests = []
+
+    def __call__(self, http_object, uri, method='GET', headers=None, curl_pool=None):
+        self.requests.append((uri, headers))
+        etag, xml = self.pages[uri]
+        if headers.get('If-None-Match') == etag:
+            resp = httplib2.Response({'status':'304', 'etag':etag})
+            return resp, ""
+        return httplib2.Response({'status':'200', 'etag':etag}), xml
+
+class TestCollectionFeed(TestController):
+    def setUp(self):
+        self.server = Fake_Server({"http://example.org/col/1":('"a"', page(1, "2")),
+                                   "http://example.org/col/2":('"b"', page(2, "3")),
+                                   "http://example.org/col/3":('"c"', page(3))})
+        self.curl_request = sword2.collection.curl_request
+        sword2.collection.curl_request = self.server
+
+    def tearDown(self):
+        sword2.collection.curl_request = self.curl_request
+
+    def test_01_from_xml(self):
+        feed = Collection_Feed("http://example.org/col/3", feed_xml=page(3))
+        assert [e.edit for e in feed] == ["http://example.org/edit/3-0", "http://example.org/edit/3-1"]
+        assert self.server.requests == []
+
+    def test_02_pages_followed_lazily(self):
+        feed = Collection_Feed("http://example.org/col/1", headers={'On-Behalf-Of':'someone'})
+        entries = iter(feed)
+        assert entries.next().title == "Item 1-0"
+        assert [uri for uri, headers in self.server.requests] == ["http://example.org/col/1"]
+        assert self.server.requests[0][1]['On-Behalf-Of'] == 'someone'
+        assert [e.edit for e in entries] == ["http://example.org/edit/%s-%s" % (n, i)
+                                             for n in (1, 2, 3) for i in range(2)][1:]
+        assert feed.fetched == 3
+
+    def test_03_revalidated_from_cache(self):
+        feed = Collection_Feed("http://example.org/col/1")
+        first = [e.edit for e in feed.entries(Compact_Deposit_Receipt, lazy=True)]
+        self.server.pages["http://example.org/col/3"] = ('"d"', page(3).replace("Item 3-1", "Changed"))
+        second = list(feed)
+        assert [e.edit for e in second] == first
+        assert second[-1].title == "Changed"
+        assert [headers.get('If-None-Match') for uri, headers in self.server.requests[3:]] == ['"a"', '"b"', '"c"']
+        assert (feed.fetched, feed.revalidated) == (4, 2)
+
+    def test_04_page_cache_bounded(self):
+        feed = Collection_Feed("http://example.org/col/1", max_cached_pages=2)
+        list(feed)
+        assert feed._cached.keys() == ["http://example.org/col/2", "http://example.org/col/3"]
+        list(feed)
+        assert feed.revalidated == 0
+
+    def test_05_from_connection(self):
+        conn = Connection("http://example.org/service-doc", user_name="sword", user_pass="secret",
+                          on_behalf_of="someone", always_authenticate=True)
+        feed = conn.get_collection_feed(col_iri="http://example.org/col/3")
+        assert conn.get_collection_feed(col_iri="http://example.org/col/3") is feed
+        assert len(list(feed)) == 2
+        headers = self.server.requests[0][1]
+        assert headers['On-Behalf-Of'] == "someone"
+        assert headers['Authorization'] == "Basic c3dvcmQ6c2VjcmV0"
+
+    def test_06_without_collections_ordereddict(self):
+        # As on Python 2.6
+        from sword2.compatible_libs import Ordered_Dict
+        real = sword2.collection.OrderedDict
+        sword2.collection.OrderedDict = Ordered_Dict
+        try:
+            feed = Collection_Feed("http://example.org/col/1", max_cached_pages=2)
+            assert isinstance(feed._cached, Ordered_Dict)
+            self.test_04_page_cache_bounded()
+        finally:
+            sword2.collection.OrderedDict = real
+
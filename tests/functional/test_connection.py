@@ -58,6 +58,15 @@ long_service_doc = '''<?xml version="1.0" ?>
     </workspace>
 </service>'''
 
+def statement_page(n, next_href=None):
+    links = '<link rel="first" href="http://example.org/state/1"/>'
+    if next_href:
+        links += '<link rel="next" href="%s"/>' % next_href
+    entries = "".join(['<entry><content type="application/zip" src="http://example.org/cont/%s-%s"/>'
+                       '<link rel="edit" href="http://example.org/edit/%s-%s"/></entry>' % (n, i, n, i)
+                       for i in range(3)])
+    return '<feed xmlns="http://www.w3.org/2005/Atom">%s%s</feed>' % (links, entries)
+
 class TestConnection(TestController):
     def test_01_blank_init(self):
         conn = Connection("http://example.org/service-doc")
@@ -85,3 +94,125 @@ class TestConnection(TestController):
         assert len(conn.history) == 2
         assert conn.history[0]['type'] == "init"
         assert conn.history[1]['type'] == "SD Parse"
+
+    def test_04_file_payload_is_streamed(self):
+        from StringIO import StringIO
+        conn = Connection("http://example.org/service-doc")
+        payload = StringIO("Hello world")
+        request = conn._prepare_request("http://example.org/em-iri/1", payload=payload, filename="hello.txt",
+                                        mimetype="text/plain", method="PUT")
+        # The file handle itself is sent, rewound and ready to be read by the transport
+        assert request['body'] is payload
+        assert payload.tell() == 0
+        assert request['headers']['Content-Length'] == "11"
+        assert request['headers']['Content-MD5'] == "3e25960a79dbc69b674cd4ec67a72c62"
+
+    def test_05_collection_lookup(self):
+        conn = Connection("http://example.org/service-doc")
+        assert conn._find_col_iri("Sub-site", "Collection 46") == None
+        conn.load_service_document(long_service_doc)
+        assert conn._find_col_iri("Sub-site", "Collection 46") == "http://swordapp.org/col-iri/46"
+        assert conn._find_col_iri("Main Site", "Collection 46") == None
+        assert conn._find_col_iri("Sub-site", "Collection 46", "http://example.org/col") == "http://example.org/col"
+
+    def test_06_packaging_not_accepted(self):
+        from sword2.exceptions import PackagingFormatNotAvailable
+        from sword2 import Error_Document
+        # Not checked unless asked for
+        conn = Connection("http://example.org/service-doc")
+        conn.load_service_document(long_service_doc)
+        assert conn._packaging_accepted("http://swordapp.org/col-iri/46",
+                                        "http://purl.org/net/sword/package/METSDSpaceSIP")
+        conn = Connection("http://example.org/service-doc", check_packaging=True)
+        conn.load_service_document(long_service_doc)
+        # Refused before any request is made
+        try:
+            conn.create(workspace="Sub-site", collection="Collection 46", payload="data", mimetype="application/zip",
+                        filename="package.zip", packaging="http://purl.org/net/sword/package/METSDSpaceSIP")
+            assert False, "PackagingFormatNotAvailable was not raised"
+        except PackagingFormatNotAvailable, e:
+            assert e.response.status == 415
+        conn.raise_except = False
+        e = conn.create(workspace="Sub-site", collection="Collection 46", payload="data", mimetype="application/zip",
+                        filename="package.zip", packaging="http://purl.org/net/sword/package/METSDSpaceSIP")
+        assert isinstance(e, Error_Document)
+        assert e.code == 415
+        assert len(conn.history) == 2
+        assert conn._packaging_accepted("http://swordapp.org/col-iri/43",
+                                        "http://purl.org/net/sword/package/METSDSpaceSIP")
+        assert conn._packaging_accepted("http://example.org/unknown-col", "http://example.org/any")
+
+    def test_07_statement_pages(self):
+        import httplib2
+        import threading
+        import sword2.connection
+        pages = {"http://example.org/state/1":statement_page(1, "2"),
+                 "http://example.org/state/2":statement_page(2, "http://example.org/state/3"),
+                 "http://example.org/state/3":statement_page(3)}
+        requested = []
+        def curl_request(http_object, uri, method='GET', headers=None, curl_pool=None):
+            requested.append((uri, threading.current_thread().name != "MainThread", curl_pool))
+            assert headers['Accept'] == "application/atom+xml;type=feed"
+            return httplib2.Response({'status':'200'}), pages[uri]
+        real_curl_request = sword2.connection.curl_request
+        sword2.connection.curl_request = curl_request
+        try:
+            for prefetch in (True, False):
+                conn = Connection("http://example.org/service-doc", lazy_receipts=True)
+                del requested[:]
+                entries = conn.iter_statement_entries("http://example.org/state/1", prefetch=prefetch)
+                first = entries.next()
+                assert first.edit == "http://example.org/edit/1-0"
+                # Only the next page has been asked for (or none yet, without prefetching)
+                assert requested[0][0] == "http://example.org/state/1"
+                assert len(requested) <= 2
+                rest = list(entries)
+                assert [e.cont_iri for e in [first] + rest] == ["http://example.org/cont/%s-%s" % (n, i)
+                                                                for n in (1, 2, 3) for i in range(3)]
+                assert [iri for iri, _, _ in requested] == ["http://example.org/state/%s" % n for n in (1, 2, 3)]
+                # Pages fetched in the background have a cURL handle of their own
+                assert [(in_background, pool is None) for _, in_background, pool in requested[1:]] == \
+                    [(prefetch, prefetch)] * 2
+                # ... and are logged once they are reached
+                assert [h['payload']['page_iri'] for h in conn.history[1:]] == \
+                    ["http://example.org/state/%s" % n for n in (1, 2, 3)]
+                pagelist = list(conn.iter_statement_pages("http://example.org/state/1", prefetch=prefetch))
+                assert [(p.iri, p.first, p.next) for p in pagelist] == [
+                    ("http://example.org/state/1", "http://example.org/state/1", "2"),
+                    ("http://example.org/state/2", "http://example.org/state/1", "http://example.org/state/3"),
+                    ("http://example.org/state/3", "http://example.org/state/1", None)]
+                assert [p.entries for p in pagelist] == [[], [], []]
+        finally:
+            sword2.connection.curl_request = real_curl_request
+
+    def test_08_streamed_service_document_history(self):
+        conn = Connection("http://example.org/service-doc", stream_service_document=True)
+        conn.load_service_document(long_service_doc)
+        assert conn.history[1]['type'] == "SD Parse"
+        assert conn.history[1]['payload']['streamed'] == True
+        assert 'workspaces_found' not in conn.history[1]['payload']
+        # Logging the parse did not read the rest of the document
+        assert not conn.sd.stream.finished
+        assert [title for title, collections in conn.workspaces] == ["Main Site", "Sub-site"]
+
+    def test_09_statement_page_not_xml(self):
+        import httplib2
+        import sword2.connection
+        from sword2 import Sword_Statement
+        assert list(Sword_Statement('<html>', build_entries=False).iter_entries()) == []
+        pages = {"http://example.org/state/1":statement_page(1, "2"),
+                 "http://example.org/state/2":"<html><body>Service unavailable<br></body></html>"}
+        def curl_request(http_object, uri, method='GET', headers=None, curl_pool=None):
+            return httplib2.Response({'status':'200'}), pages[uri]
+        real_curl_request = sword2.connection.curl_request
+        sword2.connection.curl_request = curl_request
+        try:
+            for prefetch in (True, False):
+                conn = Connection("http://example.org/service-doc")
+                # The page that could not be parsed ends the statement
+                assert [e.edit for e in conn.iter_statement_entries("http://example.org/state/1", prefetch=prefetch)] \
+                    == ["http://example.org/edit/1-%s" % i for i in range(3)]
+                assert [p.iri for p in conn.iter_statement_pages("http://example.org/state/2")] == []
+        finally:
+            sword2.connection.curl_request = real_curl_request
+
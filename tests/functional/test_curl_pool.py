@@ -0,0 +1,84 @@
+from . import TestController
+
+from sword2.curl_pool import Curl_Pool, host_key
+
+from time import sleep
+
+class TestCurlPool(TestController):
+    def test_01_host_key(self):
+        assert host_key("http://Example.org/sd-uri") == ("http", "example.org", 80)
+        assert host_key("https://example.org/col-iri/1") == ("https", "example.org", 443)
+        assert host_key("http://example.org:8080/col-iri/1") == ("http", "example.org", 8080)
+
+    def test_02_reuse_same_host(self):
+        pool = Curl_Pool()
+        curl = pool.acquire("http://example.org/a")
+        pool.release("http://example.org/a", curl)
+        assert pool.idle_count("http://example.org/b") == 1
+        again = pool.acquire("http://example.org/b")
+        assert again is curl
+        assert pool.created == 1
+        assert pool.reused == 1
+        pool.release("http://example.org/b", again)
+        pool.close()
+        assert len(pool) == 0
+
+    def test_03_no_reuse_across_hosts(self):
+        pool = Curl_Pool()
+        curl = pool.acquire("http://example.org/a")
+        pool.release("http://example.org/a", curl)
+        other = pool.acquire("http://example.com/a")
+        assert other is not curl
+        assert pool.idle_count("http://example.org/") == 1
+        pool.release("http://example.com/a", other)
+        pool.close()
+
+    def test_04_max_size(self):
+        pool = Curl_Pool(max_size=2)
+        handles = [pool.acquire("http://example.org/") for i in range(3)]
+        for curl in handles:
+            pool.release("http://example.org/", curl)
+        assert pool.idle_count("http://example.org/") == 2
+        assert pool.evicted == 1
+        pool.close()
+
+    def test_05_idle_eviction(self):
+        pool = Curl_Pool(idle_timeout=0.05)
+        curl = pool.acquire("http://example.org/")
+        pool.release("http://example.org/", curl)
+        sleep(0.1)
+        pool.evict_idle()
+        assert len(pool) == 0
+        assert pool.evicted == 1
+        fresh = pool.acquire("http://example.org/")
+        assert pool.created == 2
+        pool.release("http://example.org/", fresh)
+        pool.close()
+
+    def test_06_release_drops_callbacks(self):
+        import pycurl
+        import weakref
+        class Sink(object):
+            def write(self, data):
+                pass
+        pool = Curl_Pool()
+        curl = pool.acquire("http://example.org/")
+        sink = Sink()
+        curl.setopt(pycurl.WRITEFUNCTION, sink.write)
+        curl.setopt(pycurl.HEADERFUNCTION, sink.write)
+        pool.release("http://example.org/", curl)
+        watch = weakref.ref(sink)
+        del sink
+        assert watch() is None
+        pool.close()
+
+    def test_07_release_evicts_idle(self):
+        pool = Curl_Pool(idle_timeout=0.05)
+        stale = pool.acquire("http://example.org/")
+        pool.release("http://example.org/", stale)
+        sleep(0.1)
+        other = pool.acquire("http://example.com/")
+        pool.release("http://example.com/", other)
+        assert pool.idle_count("http://example.org/") == 0
+        assert pool.idle_count("http://example.com/") == 1
+        pool.close()
@@ -1,6 +1,6 @@
 from . import TestController
 
-from sword2.deposit_receipt import Deposit_Receipt
+from sword2.deposit_receipt import Deposit_Receipt, Compact_Deposit_Receipt
 from sword2.utils import NS
 
 DR = """<?xml version="1.0" ?>
@@ -91,3 +91,39 @@ class TestDepositReceipt(TestController):
         assert "http://purl.org/net/sword/package/BagIt" in dr.packaging
         assert len(dr.packaging) == 1
     
+
+    def test_05_compact_receipt(self):
+        dr = Deposit_Receipt(DR)
+        compact = Compact_Deposit_Receipt(DR, keep_dom=False)
+        assert not hasattr(compact, '__dict__')
+        assert compact.dom is None
+        for field in Deposit_Receipt.RECORD_FIELDS:
+            assert getattr(compact, field) == getattr(dr, field), field
+        assert [c.term for c in compact.categories] == [c.term for c in dr.categories]
+        assert [c.dom for c in compact.categories] == [None] * len(compact.categories)
+        assert str(compact) == str(dr)
+
+    def test_06_lazy_receipt(self):
+        dr = Deposit_Receipt(DR)
+        lazy = Deposit_Receipt(DR, lazy=True)
+        assert lazy.edit == dr.edit
+        assert lazy.cont_iri == dr.cont_iri
+        assert lazy.se_iri == dr.se_iri
+        assert lazy.links == dr.links
+        assert lazy._pending is not None
+        assert lazy.packaging == dr.packaging
+        assert lazy._pending is None
+        for field in Deposit_Receipt.RECORD_FIELDS:
+            assert getattr(lazy, field) == getattr(dr, field), field
+        assert str(lazy) == str(dr)
+
+    def test_07_lazy_compact_receipt(self):
+        dr = Deposit_Receipt(DR)
+        lazy = Compact_Deposit_Receipt(DR, keep_dom=False, lazy=True)
+        assert lazy.dom is not None     # kept until the rest has been read
+        lazy.treatment = "Overridden"
+        assert lazy.dom is None
+        assert lazy.treatment == "Overridden"
+        assert lazy.metadata == dr.metadata
+        assert [c.term for c in lazy.categories] == [c.term for c in dr.categories]
+        assert [c.dom for c in lazy.categories] == [None] * len(lazy.categories)
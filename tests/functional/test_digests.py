@@ -0,0 +1,52 @@
+from . import TestController
+
+from sword2 import Connection, get_digests, get_md5
+from sword2.checksum_cache import Checksum_Cache
+
+from StringIO import StringIO
+import hashlib
+import tempfile
+import os
+
+DATA = "".join([chr(i % 251) for i in range(100000)])
+
+def make_file(data):
+    fd, path = tempfile.mkstemp()
+    os.write(fd, data)
+    os.close(fd)
+    return path
+
+class TestDigests(TestController):
+    def test_01_all_digests_in_one_pass(self):
+        expected = {'md5':hashlib.md5(DATA).hexdigest(),
+                    'sha1':hashlib.sha1(DATA).hexdigest(),
+                    'sha256':hashlib.sha256(DATA).hexdigest()}
+        algorithms = ('md5', 'sha1', 'sha256')
+        assert get_digests(DATA, algorithms) == (expected, len(DATA))
+        assert get_digests(StringIO(DATA), algorithms) == (expected, len(DATA))
+        f = open(make_file(DATA), "rb")
+        f.read(10)
+        assert get_digests(f, algorithms) == (expected, len(DATA))
+        assert f.tell() == 0
+
+    def test_02_empty_file(self):
+        f = open(make_file(""), "rb")
+        assert get_md5(f) == (hashlib.md5("").hexdigest(), 0)
+
+    def test_03_cache_adds_missing_digests(self):
+        path = make_file(DATA)
+        cache = Checksum_Cache()
+        cache.get_digests(open(path, "rb"))
+        digests, size = cache.get_digests(open(path, "rb"), ('md5', 'sha1'))
+        assert digests['sha1'] == hashlib.sha1(DATA).hexdigest()
+        assert cache.misses == 2
+        cache.get_digests(open(path, "rb"), ('sha1',))
+        assert cache.hits == 1
+
+    def test_04_digests_in_history(self):
+        conn = Connection("http://example.org/service", payload_digests=('sha256',))
+        request = conn._prepare_request("http://example.org/em-iri", payload=DATA,
+                                        filename="foo.bin", mimetype="application/octet-stream")
+        assert request['headers']['Content-MD5'] == hashlib.md5(DATA).hexdigest()
+        assert request['history']['digests'] == {'md5':hashlib.md5(DATA).hexdigest(),
+                                                 'sha256':hashlib.sha256(DATA).hexdigest()}
@@ -0,0 +1,63 @@
+from . import TestController
+
+from sword2.download import parse_content_range, response_validator, read_validator, \
+                            Resumable_Sink, Segment_Sink
+
+import tempfile
+import os
+
+def respond(sink, status_line, headers, *chunks):
+    sink.header(status_line + "\r\n")
+    for k, v in headers.iteritems():
+        sink.header("%s: %s\r\n" % (k, v))
+    sink.header("\r\n")
+    results = [sink.write(chunk) for chunk in chunks]
+    sink.close()
+    return results
+
+class TestDownload(TestController):
+    def test_01_parse_content_range(self):
+        assert parse_content_range("bytes 0-1023/4096") == (0, 1023, 4096)
+        assert parse_content_range("bytes 10-19/*") == (10, 19, None)
+        assert parse_content_range(None) is None
+        assert parse_content_range("garbage") is None
+
+    def test_02_response_validator(self):
+        assert response_validator({'etag':'"abc"', 'last-modified':'Mon, 01 Jan 2001 00:00:00 GMT'}) == '"abc"'
+        assert response_validator({'etag':'W/"abc"', 'last-modified':'Mon, 01 Jan 2001 00:00:00 GMT'}) == \
+               'Mon, 01 Jan 2001 00:00:00 GMT'
+        assert response_validator({}) is None
+
+    def test_03_resume_appends_partial_content(self):
+        path = os.path.join(tempfile.mkdtemp(), "package.zip")
+        open(path, "wb").write("hello")
+        sink = Resumable_Sink(path, offset=5)
+        respond(sink, "HTTP/1.1 206 Partial Content", {'Content-Range':'bytes 5-9/10', 'ETag':'"v1"'}, "world")
+        assert open(path, "rb").read() == "helloworld"
+        assert sink.offset + sink.size == 10
+        assert read_validator(path) == '"v1"'
+
+    def test_04_full_response_replaces_partial_file(self):
+        path = os.path.join(tempfile.mkdtemp(), "package.zip")
+        open(path, "wb").write("stale data")
+        sink = Resumable_Sink(path, offset=10)
+        respond(sink, "HTTP/1.1 200 OK", {'ETag':'"v2"'}, "new")
+        assert open(path, "rb").read() == "new"
+        assert sink.offset == 0
+        assert read_validator(path) == '"v2"'
+
+    def test_05_segment_written_in_place(self):
+        path = os.path.join(tempfile.mkdtemp(), "package.zip")
+        open(path, "wb").write("." * 10)
+        sink = Segment_Sink(path, 3, 5)
+        respond(sink, "HTTP/1.1 206 Partial Content", {'Content-Range':'bytes 3-5/10'}, "abc")
+        assert sink.complete()
+        assert open(path, "rb").read() == "...abc...."
+
+    def test_06_segment_rejects_whole_resource(self):
+        path = os.path.join(tempfile.mkdtemp(), "package.zip")
+        open(path, "wb").write("." * 10)
+        sink = Segment_Sink(path, 3, 5)
+        assert respond(sink, "HTTP/1.1 200 OK", {}, "0123456789") == [0]
+        assert not sink.complete()
+        assert open(path, "rb").read() == "." * 10
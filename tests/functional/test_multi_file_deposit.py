@@ -0,0 +1,49 @@
+from . import TestController
+
+from sword2 import Connection, Entry
+from sword2.utils import get_md5
+
+from StringIO import StringIO
+from email.parser import Parser
+
+class TestMultiFileDeposit(TestController):
+    def _request(self, **kw):
+        conn = Connection("http://example.org/service", **kw)
+        files = [{'payload':"first file", 'filename':"a.txt", 'mimetype':"text/plain"},
+                 {'payload':StringIO("<second/>"), 'filename':"b.xml"},
+                 {'payload':StringIO("PK\x03\x04 third"), 'filename':"c.zip",
+                  'packaging':"http://purl.org/net/sword/package/SimpleZip"}]
+        return conn._prepare_request("http://example.org/col-iri", metadata_entry=Entry(title="Foo", id="foo:1"),
+                                     files=files, request_type="Col_IRI POST")
+
+    def test_01_one_part_per_file(self):
+        request = self._request()
+        body = request['body']
+        assert request['headers']['Content-Length'] == str(len(body))
+        message = Parser().parsestr("Content-Type: %s\r\n\r\n%s" % (body.content_type, body.getvalue()))
+        parts = message.get_payload()
+        assert len(parts) == 4
+        assert 'name="atom"' in parts[0]['Content-Disposition']
+        assert [p.get_filename() for p in parts[1:]] == ["a.txt", "b.xml", "c.zip"]
+        assert [p.get_payload(decode=True) for p in parts[1:]] == ["first file", "<second/>", "PK\x03\x04 third"]
+        assert [p['Content-MD5'] for p in parts[1:]] == [get_md5(d)[0] for d in
+                                                          ["first file", "<second/>", "PK\x03\x04 third"]]
+        assert parts[2]['Content-Type'] == "application/xml"
+        assert parts[1]['Packaging'] is None
+        assert parts[3]['Packaging'] == "http://purl.org/net/sword/package/SimpleZip"
+        assert len(request['history']['multipart']) == 4
+
+    def test_02_binary_parts_and_digests(self):
+        request = self._request(multipart_encoding="binary", payload_digests=('sha256',))
+        value = request['body'].getvalue()
+        assert "first file" in value and "<second/>" in value
+        assert len(request['history']['digests']) == 3
+        assert 'sha256' in request['history']['digests'][0]
+
+    def test_03_needs_files(self):
+        conn = Connection("http://example.org/service")
+        try:
+            conn.create_with_files(col_iri="http://example.org/col-iri", metadata_entry=Entry(title="Foo"))
+            assert False, "expected an Exception"
+        except Exception, e:
+            assert "at least one file" in str(e)
@@ -0,0 +1,129 @@
+from . import TestController
+
+from sword2.multipart import Multipart_Related, base64_length
+
+from StringIO import StringIO
+from email.parser import Parser
+from base64 import b64encode
+from tempfile import NamedTemporaryFile
+
+ATOM = '<?xml version="1.0"?><entry xmlns="http://www.w3.org/2005/Atom"><title>Foo</title></entry>'
+
+def parse(body):
+    message = "Content-Type: %s\r\n\r\n%s" % (body.content_type, body.getvalue())
+    return Parser().parsestr(message)
+
+class TestMultipartRelated(TestController):
+    def _body(self, data, encoding=None):
+        return Multipart_Related([{'key':'atom',
+                                   'type':'application/atom+xml; charset="utf-8"',
+                                   'data':ATOM},
+                                  {'key':'payload',
+                                   'type':'application/zip',
+                                   'filename':'package.zip',
+                                   'data':data,
+                                   'headers':{'Packaging':'http://purl.org/net/sword/package/SimpleZip'},
+                                   'encoding':encoding}])
+
+    def test_01_base64_length(self):
+        for size in [0, 1, 2, 3, 56, 57, 58, 114, 1000]:
+            encoded = "\r\n".join([b64encode("x" * size)[i:i+76] for i in range(0, len(b64encode("x" * size)), 76)])
+            if size:
+                encoded += "\r\n"
+            assert base64_length(size) == len(encoded)
+
+    def test_02_content_length_is_exact(self):
+        for size in [0, 1, 57, 1000, 57 * 16384 + 5]:
+            body = self._body(StringIO("a" * size))
+            assert len(body.getvalue()) == len(body)
+
+    def test_03_parts_round_trip(self):
+        data = "".join([chr(i % 256) for i in range(5000)])
+        body = self._body(StringIO(data))
+        message = parse(body)
+        assert message.is_multipart()
+        atom, payload = message.get_payload()
+        assert atom.get_payload() == ATOM
+        assert 'name="atom"' in atom['Content-Disposition']
+        assert payload['Content-Transfer-Encoding'] == "base64"
+        assert payload['Packaging'] == "http://purl.org/net/sword/package/SimpleZip"
+        assert payload.get_filename() == "package.zip"
+        assert payload.get_payload(decode=True) == data
+
+    def test_04_read_in_chunks_and_rewind(self):
+        body = self._body("z" * 3000)
+        whole = body.getvalue()
+        chunks = []
+        chunk = body.read(100)
+        while chunk:
+            chunks.append(chunk)
+            chunk = body.read(100)
+        assert "".join(chunks) == whole
+        assert body.tell() == len(body)
+        body.seek(0)
+        assert body.read() == whole
+
+    def test_05_binary_encoding(self):
+        data = "".join([chr(i % 256) for i in range(5000)])
+        body = self._body(StringIO(data), encoding="binary")
+        assert len(body.getvalue()) == len(body)
+        assert data in body.getvalue()
+        message = parse(body)
+        atom, payload = message.get_payload()
+        assert payload['Content-Transfer-Encoding'] == "binary"
+        assert payload.get_payload() == data
+
+    def test_06_unknown_encoding(self):
+        try:
+            self._body("z", encoding="quoted-printable")
+            assert False, "expected a ValueError"
+        except ValueError:
+            pass
+
+    def test_07_mapped_file_segments(self):
+        data = "".join([chr(i % 251) for i in range(200000)])
+        f = NamedTemporaryFile()
+        f.write(data)
+        f.flush()
+        body = self._body(open(f.name, 'rb'), encoding="binary")
+        assert [kind for kind, source, length in body._segments].count('mmap') == 1
+        whole = body.getvalue()
+        assert len(whole) == len(body)
+        assert "".join([str(b) for b in body.buffers()]) == whole
+        chunks = []
+        chunk = body.read(16384)
+        while chunk:
+            chunks.append(chunk)
+            chunk = body.read(16384)
+        assert "".join(chunks) == whole
+        # Anywhere outside a base64 encoded part can be sought to
+        body.seek(-1000, 2)
+        assert body.read() == whole[-1000:]
+        body.seek(12345)
+        assert body.read(50000) == whole[12345:62345]
+        body.close()
+
+    def test_08_no_seek_into_base64(self):
+        body = self._body("z" * 3000)
+        whole = body.getvalue()
+        start = whole.index("Content-Transfer-Encoding: base64") + len("Content-Transfer-Encoding: base64\r\n\r\n")
+        body.seek(start)
+        assert body.read() == whole[start:]
+        try:
+            body.seek(start + 10)
+            assert False, "expected an IOError"
+        except IOError:
+            pass
+
+    def test_09_empty_payload(self):
+        for encoding in ("base64", "binary"):
+            for data in ("", StringIO("")):
+                body = self._body(data, encoding=encoding)
+                whole = body.getvalue()
+                assert len(whole) == len(body)
+                # The part's headers are still closed off by a blank line before the next delimiter
+                assert ("Content-Transfer-Encoding: %s\r\n\r\n\r\n--" % encoding) in whole
+                atom, payload = parse(body).get_payload()
+                assert atom.get_payload() == ATOM
+                assert payload['Content-Transfer-Encoding'] == encoding
+                assert payload.get_payload(decode=(encoding == "base64")) == ""
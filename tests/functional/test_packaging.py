@@ -0,0 +1,101 @@
+from . import TestController
+
+from sword2 import Zip_Stream
+from sword2.utils import get_md5
+from sword2.packaging import is_compressed, BLOCK_SIZE
+
+from StringIO import StringIO
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+import tempfile
+import os
+
+def make_tree():
+    root = tempfile.mkdtemp()
+    os.mkdir(os.path.join(root, "data"))
+    files = {"manifest.xml":"<manifest/>",
+             "data/a.txt":"a" * 100000,
+             "data/b.bin":"".join([chr(i % 256) for i in range(5000)]),
+             "data/empty":""}
+    for name, data in files.iteritems():
+        f = open(os.path.join(root, name), "wb")
+        f.write(data)
+        f.close()
+    return root, files
+
+class TestPackaging(TestController):
+    def test_01_directory_round_trip(self):
+        root, files = make_tree()
+        package = Zip_Stream(root)
+        archive = ZipFile(StringIO(package.read()))
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == sorted(files.keys())
+        for name, data in files.iteritems():
+            assert archive.read(name) == data
+
+    def test_02_rewind_gives_the_same_bytes(self):
+        root, files = make_tree()
+        package = Zip_Stream(root)
+        md5, size = get_md5(package)
+        data = package.read()
+        assert len(data) == size == len(package)
+        assert get_md5(data)[0] == md5
+
+    def test_03_length_before_reading(self):
+        root, files = make_tree()
+        package = Zip_Stream(root, compression=ZIP_STORED)
+        length = len(package)
+        assert package.tell() == 0
+        assert len(package.read()) == length
+
+    def test_04_named_members(self):
+        root, files = make_tree()
+        package = Zip_Stream([(os.path.join(root, "manifest.xml"), "meta/manifest.xml"),
+                              os.path.join(root, "data", "a.txt")])
+        archive = ZipFile(StringIO(package.read()))
+        assert archive.namelist() == ["meta/manifest.xml", "a.txt"]
+
+    def test_05_changed_source_is_detected(self):
+        root, files = make_tree()
+        package = Zip_Stream(root)
+        get_md5(package)
+        f = open(os.path.join(root, "manifest.xml"), "wb")
+        f.write("<changed/>")
+        f.close()
+        try:
+            package.read()
+            assert False, "expected an IOError"
+        except IOError:
+            pass
+
+    def test_06_parallel_blocks(self):
+        root, files = make_tree()
+        big = "".join(["line %s of a long text file\n" % i for i in range(3 * BLOCK_SIZE // 20)])
+        f = open(os.path.join(root, "data", "big.txt"), "wb")
+        f.write(big)
+        f.close()
+        files["data/big.txt"] = big
+        package = Zip_Stream(root, threads=4)
+        md5, size = get_md5(package)
+        data = package.read()
+        assert get_md5(data) == (md5, size)
+        archive = ZipFile(StringIO(data))
+        assert archive.testzip() is None
+        for name, content in files.iteritems():
+            assert archive.read(name) == content
+        assert archive.getinfo("data/big.txt").compress_type == ZIP_DEFLATED
+        assert archive.getinfo("data/big.txt").compress_size < len(big) / 4
+
+    def test_07_compressed_members_are_stored(self):
+        root, files = make_tree()
+        for name, data in [("photo.jpg", "not really a jpeg"), ("scan", "\xff\xd8\xff\xe0" + "x" * 1000)]:
+            f = open(os.path.join(root, name), "wb")
+            f.write(data)
+            f.close()
+        assert is_compressed(os.path.join(root, "photo.jpg"))
+        assert is_compressed(os.path.join(root, "scan"))
+        assert not is_compressed(os.path.join(root, "manifest.xml"))
+        archive = ZipFile(StringIO(Zip_Stream(root).read()))
+        assert archive.getinfo("photo.jpg").compress_type == ZIP_STORED
+        assert archive.getinfo("scan").compress_type == ZIP_STORED
+        assert archive.getinfo("data/a.txt").compress_type == ZIP_DEFLATED
+        assert archive.read("scan") == "\xff\xd8\xff\xe0" + "x" * 1000
@@ -0,0 +1,148 @@
+from . import TestController
+
+from sword2 import Connection
+from sword2.deposit_receipt import Deposit_Receipt
+from sword2.receipt_cache import Receipt_Cache, SQLite_Receipt_Cache
+from sword2.compatible_libs import Ordered_Dict
+import sword2.receipt_cache
+
+from .test_deposit_receipt import DR
+
+from tempfile import mkdtemp
+import shutil
+import json
+import time
+import os
+
+def receipt(n, cont=True):
+    d = Deposit_Receipt()
+    d.edit = "http://example.org/edit/%s" % n
+    d.se_iri = "http://example.org/se/%s" % n
+    if cont:
+        d.cont_iri = "http://example.org/cont/%s" % n
+    return d
+
+class TestReceiptCache(TestController):
+    def test_01_indexes(self):
+        cache = Receipt_Cache()
+        d = receipt(1)
+        cache.put(d)
+        assert cache.get("http://example.org/edit/1") is d
+        assert cache.get_by_cont_iri("http://example.org/cont/1") is d
+        assert cache.get_by_se_iri("http://example.org/se/1") is d
+        assert cache.get("http://example.org/edit/2") is None
+        assert cache.stats()['hits'] == 3
+        assert cache.stats()['misses'] == 1
+
+    def test_02_lru_eviction_clears_indexes(self):
+        cache = Receipt_Cache(max_size=2)
+        for n in range(3):
+            cache.put(receipt(n))
+        assert len(cache) == 2
+        assert cache.evictions == 1
+        assert cache.get_by_cont_iri("http://example.org/cont/0") is None
+        assert cache.get_by_se_iri("http://example.org/se/0") is None
+        assert "http://example.org/cont/0" not in cache.keys('cont')
+        # Using a receipt keeps it from being the next one dropped
+        cache.get("http://example.org/edit/1")
+        cache.put(receipt(3))
+        assert cache.get("http://example.org/edit/1") is not None
+        assert cache.get("http://example.org/edit/2") is None
+
+    def test_03_replacing_a_receipt(self):
+        cache = Receipt_Cache()
+        cache.put(receipt(1))
+        newer = receipt(1, cont=False)
+        cache.put(newer)
+        assert len(cache) == 1
+        assert cache.get("http://example.org/edit/1") is newer
+        assert cache.get_by_cont_iri("http://example.org/cont/1") is None
+
+    def test_04_ttl(self):
+        cache = Receipt_Cache(ttl=0.05)
+        cache.put(receipt(1))
+        cache.put(receipt(2))
+        assert cache.get_by_cont_iri("http://example.org/cont/1") is not None
+        time.sleep(0.1)
+        assert cache.get_by_cont_iri("http://example.org/cont/1") is None
+        assert cache.purge_expired() == 1
+        assert len(cache) == 0
+        assert cache.expirations == 2
+        assert cache.keys('se') == []
+
+    def test_05_connection_views(self):
+        conn = Connection("http://example.org/service", receipt_cache_size=2)
+        for n in range(3):
+            conn._cache_deposit_receipt(receipt(n))
+        assert sorted(conn.edit_iris.keys()) == ["http://example.org/edit/1", "http://example.org/edit/2"]
+        assert "http://example.org/cont/2" in conn.cont_iris
+        assert conn.se_iris["http://example.org/se/1"].edit == "http://example.org/edit/1"
+        assert "http://example.org/edit/1" in conn.cached_at
+        del conn.cont_iris["http://example.org/cont/1"]
+        assert len(conn.receipts) == 1
+        assert conn.receipts.stats()['evictions'] == 1
+
+    def test_06_record_round_trip(self):
+        d = Deposit_Receipt(xml_deposit_receipt=DR)
+        copy = Deposit_Receipt.from_record(json.loads(json.dumps(d.to_record())))
+        for field in ['edit', 'edit_media', 'se_iri', 'cont_iri', 'title', 'packaging', 'treatment', 'links',
+                      'metadata', 'content']:
+            assert getattr(copy, field) == getattr(d, field), field
+        assert isinstance(copy.edit, str)
+        assert [(c.term, c.scheme, c.label) for c in copy.categories] == \
+               [(c.term, c.scheme, c.label) for c in d.categories]
+
+    def test_07_sqlite_shared_between_instances(self):
+        path = os.path.join(mkdtemp(), "receipts.db")
+        try:
+            first = SQLite_Receipt_Cache(path, max_size=2)
+            second = SQLite_Receipt_Cache(path, max_size=2)
+            first.put(receipt(1))
+            found = second.get_by_cont_iri("http://example.org/cont/1")
+            assert found.edit == "http://example.org/edit/1"
+            assert second.get_by_se_iri("http://example.org/se/1").cont_iri == "http://example.org/cont/1"
+            second.put(receipt(2))
+            first.get("http://example.org/edit/1")
+            first.put(receipt(3))
+            assert len(second) == 2
+            assert first.evictions == 1
+            assert second.get("http://example.org/edit/2") is None
+            assert sorted(second.keys('cont')) == ["http://example.org/cont/1", "http://example.org/cont/3"]
+            first.close()
+            second.close()
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_08_connection_with_sqlite_path(self):
+        path = os.path.join(mkdtemp(), "receipts.db")
+        try:
+            conn = Connection("http://example.org/service", receipt_cache=path)
+            conn._cache_deposit_receipt(receipt(1))
+            other = Connection("http://example.org/service", receipt_cache=path)
+            assert "http://example.org/cont/1" in other.cont_iris
+            conn.close()
+            other.close()
+            assert len(other.receipts) == 0
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_09_without_collections_ordereddict(self):
+        # As on Python 2.6
+        d = Ordered_Dict([("c", 1), ("a", 2)])
+        d["b"] = 3
+        d["c"] = 4
+        assert d.keys() == ["c", "a", "b"]
+        del d["a"]
+        assert d.items() == [("c", 4), ("b", 3)]
+        assert d.popitem(last=False) == ("c", 4)
+        assert d.pop("x", None) is None
+        d.clear()
+        assert d.keys() == [] and len(d) == 0
+        real = sword2.receipt_cache.OrderedDict
+        sword2.receipt_cache.OrderedDict = Ordered_Dict
+        try:
+            self.test_02_lru_eviction_clears_indexes()
+            self.test_04_ttl()
+        finally:
+            sword2.receipt_cache.OrderedDict = real
+
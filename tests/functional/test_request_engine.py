@@ -0,0 +1,184 @@
+from . import TestController
+
+from sword2 import Connection, Request_Engine, Entry
+
+from .test_connection import long_service_doc
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
+import time
+import sword2.request_engine
+
+RECEIPT = """<?xml version="1.0"?>
+<entry xmlns="http://www.w3.org/2005/Atom">
+    <title>Deposit</title>
+    <link rel="edit" href="http://example.org/edit-iri%s"/>
+</entry>"""
+
+class Deposit_Server(ThreadingMixIn, HTTPServer):
+    """A local server that answers every POST with a deposit receipt, slowly enough to see how many requests are
+    in flight at once"""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), Deposit_Handler)
+        self.lock = Lock()
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.paths = []
+        self.md5s = []
+        self.iri = "http://127.0.0.1:%s" % self.server_address[1]
+
+class Deposit_Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.lock.acquire()
+        server.in_flight += 1
+        server.most_in_flight = max(server.most_in_flight, server.in_flight)
+        server.paths.append(self.path)
+        server.md5s.append(self.headers.get('Content-MD5'))
+        server.lock.release()
+        time.sleep(0.05)
+        server.lock.acquire()
+        server.in_flight -= 1
+        server.lock.release()
+        body = RECEIPT % self.path
+        self.send_response(201)
+        self.send_header("Content-Type", "application/atom+xml;type=entry")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestRequestEngine(TestController):
+    def test_01_submit_queues_without_sending(self):
+        conn = Connection("http://example.org/service-doc")
+        engine = Request_Engine(conn, max_concurrent=4)
+        ticket = engine.submit("create", col_iri="http://example.org/col-iri/1",
+                               metadata_entry=Entry(title="Foo", id="foo:1"))
+        assert ticket == 0
+        assert engine.pending() == 1
+        # Nothing has been sent, so only the init is in the history
+        assert len(conn.history) == 1
+
+    def test_02_submitted_request_matches_connection_method(self):
+        conn = Connection("http://example.org/service-doc", on_behalf_of="someone")
+        engine = Request_Engine(conn)
+        engine.submit("update_files_for_resource", payload="Hello", filename="hello.txt", mimetype="text/plain",
+                      edit_media_iri="http://example.org/em-iri/1")
+        _, request = engine._queue[0]
+        assert request['method'] == "PUT"
+        assert request['target_iri'] == "http://example.org/em-iri/1"
+        assert request['headers']['On-Behalf-Of'] == "someone"
+        assert request['headers']['Content-Length'] == "5"
+        assert request['description'] == "EM_IRI PUT: simple resource request"
+
+    def test_03_unresolved_collection_is_not_queued(self):
+        conn = Connection("http://example.org/service-doc")
+        conn.load_service_document(long_service_doc)
+        engine = Request_Engine(conn)
+        assert engine.submit("create", workspace="Main Site", collection="No such collection",
+                             metadata_entry=Entry(title="Foo")) is None
+        assert engine.submit("create", workspace="Main Site", collection="Collection 43",
+                             metadata_entry=Entry(title="Foo")) == 0
+        _, request = engine._queue[0]
+        assert request['target_iri'] == "http://swordapp.org/col-iri/43"
+
+    def test_04_only_request_operations_queued(self):
+        conn = Connection("http://example.org/service-doc")
+        engine = Request_Engine(conn)
+        for operation in ("get_resource", "get_atom_sword_statement", "get_service_document", "close"):
+            try:
+                engine.submit(operation, "http://example.org/cont-iri/1")
+                assert False, "%s was queued" % operation
+            except ValueError:
+                pass
+        assert engine.pending() == 0
+
+    def test_05_submit_leaves_connection_alone(self):
+        conn = Connection("http://example.org/service-doc")
+        engine = Request_Engine(conn)
+        engine.submit("create", col_iri="http://example.org/col-iri/1", metadata_entry=Entry(title="Foo"))
+        assert '_make_request' not in vars(conn)
+        assert len(conn.history) == 1
+
+    def test_06_collect_over_multi_handle(self):
+        server = Deposit_Server()
+        serving = Thread(target=server.serve_forever)
+        serving.daemon = True
+        serving.start()
+        try:
+            conn = Connection(server.iri + "/sd-iri")
+            engine = Request_Engine(conn, max_concurrent=3)
+            tickets = [engine.submit("create", col_iri=server.iri + "/col-iri/%s" % n,
+                                     metadata_entry=Entry(title="Deposit %s" % n)) for n in range(9)]
+            assert tickets == range(9)
+            receipts = engine.collect()
+            engine.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert [r.code for r in receipts] == [201] * 9
+        # Results come back in submission order, whatever order they finished in
+        assert [r.edit for r in receipts] == ["http://example.org/edit-iri/col-iri/%s" % n for n in range(9)]
+        assert sorted(server.paths) == sorted(["/col-iri/%s" % n for n in range(9)])
+        assert server.most_in_flight == 3
+        assert len(conn.receipts) == 9
+        # The init, then one history entry for each request
+        assert len(conn.history) == 10
+
+    def test_07_close_releases_unsent_bodies(self):
+        conn = Connection("http://example.org/service-doc")
+        engine = Request_Engine(conn)
+        for n in range(2):
+            # Payloads that cannot be rewound are spooled, and the spools have to be closed
+            engine.submit("add_file_to_resource", edit_media_iri="http://example.org/em-iri/1",
+                          payload=iter(["Hello ", "world"]), filename="hello.txt", mimetype="text/plain")
+        spools = [request['spools'][0] for _, request in engine._queue]
+        assert [s.closed for s in spools] == [False, False]
+        engine.close()
+        assert [s.closed for s in spools] == [True, True]
+        assert engine.pending() == 0
+
+    def test_08_failed_start_releases_body(self):
+        conn = Connection("http://example.org/service-doc")
+        engine = Request_Engine(conn)
+        ticket = engine.submit("create", col_iri="http://example.org/col-iri/1", metadata_entry=Entry(title="Foo"),
+                               payload=iter(["Hello"]), filename="hello.txt", mimetype="text/plain",
+                               packaging="http://purl.org/net/sword/package/Binary")
+        _, request = engine._queue[0]
+        closed = []
+        request['body'].close = lambda: closed.append(True)
+        def failing_setup_curl(*args, **kw):
+            raise ValueError("Could not set up the transfer")
+        setup_curl = sword2.request_engine.setup_curl
+        sword2.request_engine.setup_curl = failing_setup_curl
+        try:
+            engine.perform()
+        finally:
+            sword2.request_engine.setup_curl = setup_curl
+        engine.close()
+        assert isinstance(engine.result(ticket), ValueError)
+        assert request['spools'][0].closed
+        assert closed == [True]
+        # The cURL handle was closed rather than returned to the pool
+        assert conn.curl_pool.created == 1
+        assert len(conn.curl_pool) == 0
+
+    def test_09_deletes_queued(self):
+        from sword2.deposit_receipt import Deposit_Receipt
+        conn = Connection("http://example.org/service-doc")
+        engine = Request_Engine(conn)
+        dr = Deposit_Receipt(code=201)
+        dr.edit = "http://example.org/edit-iri/1"
+        dr.edit_media = "http://example.org/em-iri/1"
+        assert engine.submit("delete_container", dr=dr) == 0
+        assert engine.submit("delete_content_of_resource", dr=dr) == 1
+        assert engine.submit("delete", "http://example.org/other-iri") == 2
+        assert [(request['method'], request['target_iri']) for _, request in engine._queue] == \
+            [("DELETE", "http://example.org/edit-iri/1"), ("DELETE", "http://example.org/em-iri/1"),
+             ("DELETE", "http://example.org/other-iri")]
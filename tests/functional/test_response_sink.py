@@ -0,0 +1,57 @@
+from . import TestController
+
+from sword2.utils import Response_Sink
+
+from StringIO import StringIO
+import tempfile
+import os
+
+class TestResponseSink(TestController):
+    def test_01_successful_body_goes_to_sink(self):
+        out = StringIO()
+        seen = []
+        sink = Response_Sink(out, chunk_callback=lambda chunk, total: seen.append(total))
+        sink.header("HTTP/1.1 200 OK\r\n")
+        sink.header("Content-Length: 10\r\n")
+        sink.header("\r\n")
+        sink.write("hello")
+        sink.write("world")
+        sink.close()
+        assert out.getvalue() == "helloworld"
+        assert sink.size == 10
+        assert seen == [5, 10]
+        assert sink.getvalue() == ""
+
+    def test_02_challenge_body_is_discarded(self):
+        out = StringIO()
+        sink = Response_Sink(out)
+        sink.header("HTTP/1.1 401 Unauthorized\r\n")
+        sink.header("\r\n")
+        sink.write("denied")
+        sink.header("HTTP/1.1 200 OK\r\n")
+        sink.header("\r\n")
+        sink.write("data")
+        sink.close()
+        assert out.getvalue() == "data"
+        assert sink.getvalue() == ""
+
+    def test_03_path_untouched_on_error(self):
+        path = os.path.join(tempfile.mkdtemp(), "package.zip")
+        sink = Response_Sink(path)
+        sink.header("HTTP/1.1 404 Not Found\r\n")
+        sink.header("\r\n")
+        sink.write("<error/>")
+        sink.close()
+        assert not os.path.exists(path)
+        assert sink.getvalue() == "<error/>"
+        assert sink.size == 0
+
+    def test_04_path_written_on_success(self):
+        path = os.path.join(tempfile.mkdtemp(), "package.zip")
+        sink = Response_Sink(path)
+        assert sink.path == path
+        sink.header("HTTP/1.1 200 OK\r\n")
+        sink.header("\r\n")
+        sink.write("PK")
+        sink.close()
+        assert open(path, "rb").read() == "PK"
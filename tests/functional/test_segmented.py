@@ -0,0 +1,136 @@
+from . import TestController
+
+from sword2 import Connection, Segmented_Deposit
+from sword2.segmented import File_Segment, PENDING, UPLOADED, FAILED
+from sword2.utils import get_md5
+
+from StringIO import StringIO
+
+from sword2.deposit_receipt import Deposit_Receipt
+
+from .test_connection import long_service_doc
+
+class Stub_Engine(object):
+    """Stands in for a `Request_Engine`, failing the (filename, attempt)s in `failing`"""
+    failing = set()
+    submitted = []
+    attempts = {}
+
+    def __init__(self, conn, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self.results = {}
+
+    def submit(self, operation, **kw):
+        assert operation == "add_file_to_resource"
+        attempt = Stub_Engine.attempts[kw['filename']] = Stub_Engine.attempts.get(kw['filename'], 0) + 1
+        Stub_Engine.submitted.append(kw)
+        ticket = len(self.results)
+        if (kw['filename'], attempt) in Stub_Engine.failing:
+            self.results[ticket] = Exception("Connection reset")
+        else:
+            self.results[ticket] = Deposit_Receipt(code=201)
+        return ticket
+
+    def perform(self):
+        pass
+
+    def result(self, ticket):
+        return self.results.pop(ticket)
+
+    def close(self):
+        pass
+
+class TestSegmented(TestController):
+    def test_01_file_segment(self):
+        f = StringIO("0123456789")
+        segment = File_Segment(f, 3, 4)
+        assert segment.read(2) == "34"
+        assert segment.read() == "56"
+        assert segment.read() == ""
+        segment.seek(0)
+        assert segment.read(100) == "3456"
+        assert get_md5(segment) == get_md5("3456")
+
+    def test_02_parts_from_max_upload_size(self):
+        conn = Connection("http://example.org/service", download_service_document=False)
+        conn.load_service_document(long_service_doc)
+        assert conn.maxUploadSize == 16777216
+        deposit = Segmented_Deposit(conn, "x" * 10, "foo.zip")
+        assert deposit.segment_size == 16777216 * 1024
+        assert len(deposit.parts) == 1
+
+    def test_03_parts_cover_the_file(self):
+        conn = Connection("http://example.org/service", download_service_document=False)
+        deposit = Segmented_Deposit(conn, "x" * 2500, "foo.zip", segment_size=1000)
+        assert [(p['offset'], p['length']) for p in deposit.parts] == [(0, 1000), (1000, 1000), (2000, 500)]
+        assert [p['filename'] for p in deposit.parts] == ["foo.zip.part001", "foo.zip.part002", "foo.zip.part003"]
+        assert [p['status'] for p in deposit.parts] == [PENDING] * 3
+
+    def test_04_only_failed_parts_are_pending(self):
+        conn = Connection("http://example.org/service", download_service_document=False)
+        deposit = Segmented_Deposit(conn, "x" * 2500, "foo.zip", segment_size=1000)
+        deposit.parts[0]['status'] = UPLOADED
+        deposit.parts[1]['status'] = FAILED
+        deposit.parts[2]['status'] = UPLOADED
+        assert [p['number'] for p in deposit.pending()] == [2]
+        try:
+            deposit.complete()
+            assert False, "expected an Exception"
+        except Exception, e:
+            assert "1 of the 3 parts" in str(e)
+
+    def test_05_empty_file(self):
+        conn = Connection("http://example.org/service", download_service_document=False)
+        deposit = Segmented_Deposit(conn, "", "empty.zip", segment_size=1000)
+        assert [(p['offset'], p['length']) for p in deposit.parts] == [(0, 0)]
+        segment = File_Segment(StringIO(""), 0, 0)
+        assert segment
+        request = conn._prepare_request("http://example.org/em-iri/1", payload=segment, filename="empty.zip.part001",
+                                        mimetype="application/zip", method="POST")
+        assert request['body'] is segment
+        assert request['headers']['Content-Length'] == "0"
+        assert request['headers']['Content-MD5'] == get_md5("")[0]
+
+    def test_06_upload_retry_and_complete(self):
+        conn = Connection("http://example.org/service", download_service_document=False)
+        deposit = Segmented_Deposit(conn, "abcdefghij", "foo.zip", segment_size=4, max_concurrent=2)
+        deposit.use_container(Deposit_Receipt(code=201))
+        deposit.receipt.edit_media = "http://example.org/em-iri/1"
+        # Parts 2 and 3 fail the first time round, part 3 again the second time
+        Stub_Engine.failing = set([("foo.zip.part002", 1), ("foo.zip.part003", 1), ("foo.zip.part003", 2)])
+        Stub_Engine.submitted = []
+        Stub_Engine.attempts = {}
+        deposit.engine_class = Stub_Engine
+
+        failed = deposit.upload()
+        assert [p['number'] for p in failed] == [2, 3]
+        assert [p['status'] for p in deposit.parts] == [UPLOADED, FAILED, FAILED]
+        assert isinstance(deposit.parts[2]['result'], Exception)
+        assert [(kw['filename'], kw['payload'].read()) for kw in Stub_Engine.submitted] == \
+            [("foo.zip.part001", "abcd"), ("foo.zip.part002", "efgh"), ("foo.zip.part003", "ij")]
+        assert Stub_Engine.submitted[0]['edit_media_iri'] == "http://example.org/em-iri/1"
+        assert Stub_Engine.submitted[0]['in_progress'] == True
+
+        # Only the failed parts are sent again
+        Stub_Engine.submitted = []
+        failed = deposit.upload()
+        assert [kw['filename'] for kw in Stub_Engine.submitted] == ["foo.zip.part002", "foo.zip.part003"]
+        assert [p['number'] for p in failed] == [3]
+        assert [p['attempts'] for p in deposit.parts] == [1, 2, 2]
+        try:
+            deposit.complete()
+            assert False, "expected an Exception"
+        except Exception, e:
+            assert "1 of the 3 parts" in str(e)
+
+        # A single part can be retried alone
+        Stub_Engine.submitted = []
+        assert deposit.upload(failed) == []
+        assert [kw['filename'] for kw in Stub_Engine.submitted] == ["foo.zip.part003"]
+        assert [p['status'] for p in deposit.parts] == [UPLOADED] * 3
+        assert [p['attempts'] for p in deposit.parts] == [1, 2, 3]
+
+        completed = []
+        conn.complete_deposit = lambda dr: completed.append(dr) or "completed"
+        assert deposit.complete() == "completed"
+        assert completed == [deposit.receipt]
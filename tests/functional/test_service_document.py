@@ -1,6 +1,7 @@
 from . import TestController
 
 from sword2 import SDCollection, ServiceDocument
+from sword2.collection import Compact_SDCollection
 from sword2.compatible_libs import json
 
 class TestSDCollection(TestController):
@@ -188,3 +189,75 @@ class TestServiceDocument(TestController):
                 assert "application/zip" in c.accept
                 assert "http://purl.org/net/sword/package/SimpleZip" in c.acceptPackaging
 
+
+    def test_10_compact_collections(self):
+        s = ServiceDocument(xml_response = long_service_doc)
+        for workspace, collections in s.workspaces:
+            for c in collections:
+                compact = Compact_SDCollection(dom = c.dom, keep_dom = False)
+                assert not hasattr(compact, '__dict__')
+                assert compact.dom is None
+                for field in ['title', 'href', 'accept', 'accept_multipart', 'mediation', 'treatment',
+                              'collectionPolicy', 'acceptPackaging', 'service', 'description']:
+                    assert getattr(compact, field) == getattr(c, field), field
+                assert [cat.term for cat in compact.categories] == [cat.term for cat in c.categories]
+
+    def test_11_streamed_workspaces(self):
+        s = ServiceDocument(xml_response = long_service_doc, streaming = True)
+        assert s.version == "2.0"
+        assert s.valid == True
+        assert s.maxUploadSize == 16777216
+        assert s.service_dom is None
+        assert s.workspaces[0][0] == "Main Site"
+        assert not s.stream.finished
+        full = ServiceDocument(xml_response = long_service_doc)
+        assert len(s.workspaces) == len(full.workspaces)
+        for (title, collections), (full_title, full_collections) in zip(s.workspaces, full.workspaces):
+            assert title == full_title
+            assert [c.href for c in collections] == [c.href for c in full_collections]
+            assert [c.acceptPackaging for c in collections] == [c.acceptPackaging for c in full_collections]
+            assert [c.dom for c in collections] == [None] * len(full_collections)
+        assert s.stream.finished
+
+    def test_12_streamed_elements_discarded(self):
+        from StringIO import StringIO
+        s = ServiceDocument(xml_response = StringIO(long_service_doc), streaming = True)
+        collections = s.workspaces[1][1]
+        assert collections[0].title == "Collection 44"
+        root = s.stream.stack[0]
+        assert len(collections) == 2
+        assert len(s.workspaces) == 2
+        # Each workspace, and each collection in it, is removed from the tree once it has been read
+        assert root.findall(".//{http://www.w3.org/2007/app}collection") == []
+        assert root.findall("{http://www.w3.org/2007/app}workspace") == []
+
+    def test_13_collection_indexes(self):
+        for streaming in (False, True):
+            s = ServiceDocument(xml_response = long_service_doc, streaming = streaming)
+            assert s.find_collection("Sub-site", "Collection 46").href == "http://swordapp.org/col-iri/46"
+            assert s.find_collection("Main Site", "Collection 46") is None
+            assert s.get_collection("http://swordapp.org/col-iri/44").title == "Collection 44"
+            assert s.get_collection("http://example.org/unknown") is None
+            simplezip = s.collections_accepting_packaging("http://purl.org/net/sword/package/SimpleZip")
+            assert [c.href for c in simplezip] == ["http://swordapp.org/col-iri/43", "http://swordapp.org/col-iri/44",
+                                                   "http://swordapp.org/col-iri/46"]
+            mets = s.collections_accepting_packaging("http://purl.org/net/sword/package/METSDSpaceSIP")
+            assert [c.href for c in mets] == ["http://swordapp.org/col-iri/43"]
+            assert [c.href for c in s.collections_accepting("application/zip")] == \
+                ["http://swordapp.org/col-iri/46", "http://swordapp.org/col-iri/43", "http://swordapp.org/col-iri/44"]
+            assert [c.href for c in s.collections_accepting("text/plain", multipart=True)] == \
+                ["http://swordapp.org/col-iri/43", "http://swordapp.org/col-iri/44"]
+
+    def test_14_streamed_collections_not_retained(self):
+        from StringIO import StringIO
+        full = ServiceDocument(xml_response = long_service_doc)
+        s = ServiceDocument(xml_response = StringIO(long_service_doc), streaming = True, retain_collections = False)
+        found = []
+        for workspace_title, c in s.iter_collections():
+            # No collection read before is held
+            assert [w.collections._items for w in s.workspaces._items] == [[]] * len(s.workspaces._items)
+            found.append((workspace_title, c.href))
+        assert found == list((title, c.href) for title, c in full.iter_collections())
+        assert s.stream.last_collection is None
+        assert s.find_collection("Main Site", "Collection 43") is None
+        assert list(s.iter_collections()) == []
@@ -0,0 +1,56 @@
+from . import TestController
+
+from sword2 import Connection
+from sword2.utils import spool, is_seekable, get_md5
+from sword2.multipart import data_length
+
+from StringIO import StringIO
+import os
+
+class Pipe(object):
+    """A file-like object that cannot be rewound"""
+    def __init__(self, data):
+        self.f = StringIO(data)
+    def read(self, size=-1):
+        return self.f.read(size)
+    def tell(self):
+        raise IOError(29, "Illegal seek")
+    def seek(self, offset, whence=0):
+        raise IOError(29, "Illegal seek")
+
+class TestSpool(TestController):
+    def test_01_is_seekable(self):
+        assert is_seekable(StringIO("abc"))
+        assert not is_seekable(Pipe("abc"))
+        r, w = os.pipe()
+        os.close(w)
+        assert not is_seekable(os.fdopen(r))
+
+    def test_02_small_payload_stays_in_memory(self):
+        spooled, digests, size = spool(Pipe("hello"), threshold=100)
+        assert (digests['md5'], size) == get_md5("hello")
+        assert not spooled._rolled
+        assert data_length(spooled) == 5
+        assert not spooled._rolled
+        assert spooled.read() == "hello"
+
+    def test_03_large_payload_goes_to_disc(self):
+        data = "x" * 1000
+        spooled, digests, size = spool(Pipe(data), threshold=100)
+        assert spooled._rolled
+        assert size == 1000
+        assert spooled.read() == data
+
+    def test_04_iterable_payload(self):
+        spooled, digests, size = spool(iter(["abc", "def"]), algorithms=('md5', 'sha1'))
+        assert spooled.read() == "abcdef"
+        assert sorted(digests.keys()) == ['md5', 'sha1']
+
+    def test_05_connection_spools_pipes(self):
+        conn = Connection("http://example.org/service", spool_threshold=4)
+        request = conn._prepare_request("http://example.org/em-iri", payload=Pipe("streamed payload"),
+                                        filename="foo.txt", mimetype="text/plain")
+        assert request['spools'] == [request['body']]
+        assert request['headers']['Content-MD5'] == get_md5("streamed payload")[0]
+        assert request['headers']['Content-Length'] == str(len("streamed payload"))
+        assert request['body'].read() == "streamed payload"